@@ -0,0 +1,306 @@
+"""Background job queue for long-running Architect requests."""
+
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, nullcontext
+from datetime import datetime
+from enum import Enum
+from typing import Any, AsyncIterator, Callable, Deque, Dict, List, Optional, Set, Tuple
+from uuid import uuid4
+
+from fastapi import HTTPException
+from pydantic import BaseModel, Field
+
+ProgressFn = Callable[..., None]
+
+
+def no_progress(stage: str, **detail: Any) -> None:
+    pass
+
+
+class JobStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+
+class JobEvent(BaseModel):
+    stage: str
+    at: datetime = Field(default_factory=datetime.utcnow)
+    detail: Dict[str, Any] = Field(default_factory=dict)
+
+
+class Job(BaseModel):
+    id: str = Field(default_factory=lambda: uuid4().hex)
+    kind: str
+    version: Optional[str] = None
+    status: JobStatus = JobStatus.QUEUED
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[Dict[str, Any]] = None
+    events: List[JobEvent] = Field(default_factory=list)
+    merged: int = 1
+    priority: int = 0
+
+    @property
+    def done(self) -> bool:
+        return self.status in (JobStatus.SUCCEEDED, JobStatus.FAILED)
+
+
+class QueueFull(RuntimeError):
+    def __init__(self, message: str, retry_after: float) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _PrioritySlots:
+    """Execution slots granted lowest `priority` first, in arrival order within one."""
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self.busy = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for *_, future in self._waiters if not future.done())
+
+    async def acquire(self, priority: int) -> None:
+        if self.busy < self.size and not self.waiting:
+            self.busy += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()  # granted just before the cancellation landed
+            raise
+
+    def release(self) -> None:
+        while self._waiters:
+            *_, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)  # hand the slot over; `busy` is unchanged
+                return
+        self.busy -= 1
+
+
+class StagingGate:
+    """Lets workspace jobs run side by side, or garbage collection run alone.
+
+    Jobs hold the gate shared while they hold their workspace lock; `exclusive`
+    waits for them to finish and keeps new ones out until it is released, so a
+    job created after collection started cannot stage from a directory being
+    removed. A waiting collection goes before jobs that arrive after it.
+    """
+
+    def __init__(self) -> None:
+        self._cond = asyncio.Condition()
+        self._active = 0
+        self._exclusive = False
+        self._waiting_exclusive = 0
+
+    @asynccontextmanager
+    async def shared(self) -> AsyncIterator[None]:
+        async with self._cond:
+            await self._cond.wait_for(lambda: not self._exclusive and not self._waiting_exclusive)
+            self._active += 1
+        try:
+            yield
+        finally:
+            async with self._cond:
+                self._active -= 1
+                self._cond.notify_all()
+
+    @asynccontextmanager
+    async def exclusive(self) -> AsyncIterator[None]:
+        async with self._cond:
+            self._waiting_exclusive += 1
+            try:
+                await self._cond.wait_for(lambda: not self._exclusive and not self._active)
+            finally:
+                self._waiting_exclusive -= 1
+                self._cond.notify_all()
+            self._exclusive = True
+        try:
+            yield
+        finally:
+            async with self._cond:
+                self._exclusive = False
+                self._cond.notify_all()
+
+
+class JobQueue:
+    """Runs blocking Architect work on a dedicated, bounded thread pool.
+
+    `submit` returns immediately with a queued `Job`. After an optional `delay`
+    (used to collect coalesced feedback), each job takes its per-workspace lock
+    (if any) and with it the shared `gate`, then one of `concurrency` execution
+    slots, so a busy workspace never holds a slot while it waits. Slots go to
+    the lowest `priority` first. At most `max_pending` unfinished jobs are
+    accepted; finished jobs are kept for `history` entries.
+    """
+
+    def __init__(self, *, concurrency: int, max_pending: int, history: int) -> None:
+        self.concurrency = concurrency
+        self.max_pending = max_pending
+        self.history = history
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="architect-job")
+        self._slots = _PrioritySlots(concurrency)
+        self.gate = StagingGate()
+        self._waits: Deque[float] = deque(maxlen=256)
+        self._runs: Deque[float] = deque(maxlen=256)
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._signals: Dict[str, asyncio.Event] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._pending = 0
+
+    def submit(
+        self,
+        kind: str,
+        fn: Callable[[ProgressFn], BaseModel],
+        *,
+        version: Optional[str] = None,
+        lock: Optional[asyncio.Lock] = None,
+        delay: float = 0.0,
+        priority: int = 0,
+    ) -> Job:
+        if self._pending >= self.max_pending:
+            raise QueueFull(f"{self._pending} Architect jobs already pending", self.retry_after())
+        job = Job(kind=kind, version=version, priority=priority)
+        self._jobs[job.id] = job
+        self._signals[job.id] = asyncio.Event()
+        self._pending += 1
+        self._trim()
+        task = asyncio.create_task(self._run(job, fn, lock, delay))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    def get(self, job_id: str) -> Job:
+        job = self._jobs.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+        return job
+
+    async def wait(self, job_id: str) -> Job:
+        job = self.get(job_id)
+        while not job.done:
+            await self._signals[job_id].wait()
+        return job
+
+    async def events(self, job_id: str) -> AsyncIterator[JobEvent]:
+        """Yield the job's events, including past ones, until it finishes."""
+
+        job = self.get(job_id)
+        sent = 0
+        while True:
+            signal = self._signals.get(job_id)
+            fresh = job.events[sent:]
+            for event in fresh:
+                yield event
+            sent += len(fresh)
+            if job.done and sent == len(job.events):
+                return
+            if signal is not None and len(job.events) == sent:
+                await signal.wait()
+
+    def retry_after(self) -> float:
+        """Seconds until a slot is likely free, from recent job durations (at least 1)."""
+
+        average = sum(self._runs) / len(self._runs) if self._runs else 5.0
+        return max(1.0, math.ceil(average * self._pending / self.concurrency))
+
+    def stats(self) -> Dict[str, Any]:
+        running = sum(1 for job in self._jobs.values() if job.status is JobStatus.RUNNING)
+        queued: Dict[str, int] = {}
+        for job in self._jobs.values():
+            if job.status is JobStatus.QUEUED:
+                queued[job.kind] = queued.get(job.kind, 0) + 1
+        return {
+            "pending": self._pending,
+            "running": running,
+            "queued": self._pending - running,
+            "queued_by_kind": queued,
+            "waiting_for_slot": self._slots.waiting,
+            "concurrency": self.concurrency,
+            "wait_seconds_avg": sum(self._waits) / len(self._waits) if self._waits else 0.0,
+            "wait_seconds_max": max(self._waits, default=0.0),
+            "retry_after": self.retry_after(),
+        }
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _run(
+        self,
+        job: Job,
+        fn: Callable[[ProgressFn], BaseModel],
+        lock: Optional[asyncio.Lock],
+        delay: float,
+    ) -> None:
+        loop = asyncio.get_running_loop()
+
+        def progress(stage: str, **detail: Any) -> None:
+            loop.call_soon_threadsafe(self._publish, job, JobEvent(stage=stage, detail=detail))
+
+        try:
+            if delay > 0:
+                await asyncio.sleep(delay)
+            async with lock or nullcontext(), self.gate.shared() if lock else nullcontext():
+                await self._slots.acquire(job.priority)
+                try:
+                    job.status = JobStatus.RUNNING
+                    job.started_at = datetime.utcnow()
+                    self._waits.append((job.started_at - job.created_at).total_seconds())
+                    self._publish(job, JobEvent(stage="started"))
+                    started = time.monotonic()
+                    result = await loop.run_in_executor(self._executor, fn, progress)
+                    self._runs.append(time.monotonic() - started)
+                finally:
+                    self._slots.release()
+            job.result = result.model_dump(mode="json")
+            job.status = JobStatus.SUCCEEDED
+        except HTTPException as err:
+            job.error = {"status_code": err.status_code, "detail": err.detail}
+            job.status = JobStatus.FAILED
+        except Exception as err:
+            job.error = {"status_code": 500, "detail": str(err)}
+            job.status = JobStatus.FAILED
+        finally:
+            job.finished_at = datetime.utcnow()
+            self._pending -= 1
+            self._publish(job, JobEvent(stage=job.status.value))
+
+    def note(self, job: Job, stage: str, **detail: Any) -> None:
+        """Append an event from the event loop thread."""
+
+        self._publish(job, JobEvent(stage=stage, detail=detail))
+
+    def _publish(self, job: Job, event: JobEvent) -> None:
+        # Progress callbacks are queued with call_soon_threadsafe before the executor
+        # future resolves, so events arrive in the order the worker emitted them.
+        job.events.append(event)
+        signal = self._signals.get(job.id)
+        if signal is not None:
+            self._signals[job.id] = asyncio.Event()
+            signal.set()
+
+    def _trim(self) -> None:
+        finished = [job_id for job_id, job in self._jobs.items() if job.done]
+        for job_id in finished[: max(len(finished) - self.history, 0)]:
+            del self._jobs[job_id]
+            self._signals.pop(job_id, None)
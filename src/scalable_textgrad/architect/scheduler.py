@@ -0,0 +1,118 @@
+"""Admission control for Codex processes started by Architect jobs."""
+
+from __future__ import annotations
+
+import itertools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Deque, Dict, Iterator, List
+
+
+class CodexPriority(IntEnum):
+    """Lower values are served first."""
+
+    BOOTSTRAP = 0
+    FEEDBACK = 1
+    ESCALATION = 2
+
+
+@dataclass
+class _Ticket:
+    agent: str
+    priority: CodexPriority
+    seq: int
+    enqueued: float = field(default_factory=time.monotonic)
+
+
+class CodexScheduler:
+    """Caps concurrent Codex runs across all Architect jobs.
+
+    Waiting runs are granted a slot by priority (bootstrap, then feedback, then
+    Tuner escalations); within a priority, agents with fewer running Codex
+    processes go first, then the agent served least recently, then arrival
+    order. Callers block in their worker thread until granted.
+    """
+
+    def __init__(self, concurrency: int, *, window: int = 256) -> None:
+        self.concurrency = max(concurrency, 1)
+        self._cond = threading.Condition()
+        self._waiting: List[_Ticket] = []
+        self._running: Dict[str, int] = {}
+        self._served: Dict[str, int] = {}
+        self._seq = itertools.count()
+        self._grants = itertools.count(1)
+        self._waits: Deque[float] = deque(maxlen=window)
+        self._runs: Deque[float] = deque(maxlen=window)
+        self.granted = 0
+
+    @contextmanager
+    def slot(self, agent: str, priority: CodexPriority) -> Iterator[float]:
+        """Hold one Codex slot for `agent`; yields the seconds spent waiting for it."""
+
+        ticket = _Ticket(agent=agent, priority=priority, seq=next(self._seq))
+        with self._cond:
+            self._waiting.append(ticket)
+            while sum(self._running.values()) >= self.concurrency or self._next() is not ticket:
+                self._cond.wait()
+            self._waiting.remove(ticket)
+            self._running[agent] = self._running.get(agent, 0) + 1
+            self._served[agent] = next(self._grants)
+            self.granted += 1
+            waited = time.monotonic() - ticket.enqueued
+            self._waits.append(waited)
+            # The head of the queue changed; let the new head re-check.
+            self._cond.notify_all()
+        started = time.monotonic()
+        try:
+            yield waited
+        finally:
+            with self._cond:
+                self._runs.append(time.monotonic() - started)
+                self._running[agent] -= 1
+                if not self._running[agent]:
+                    del self._running[agent]
+                self._prune()
+                self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            waiting = {priority.name.lower(): 0 for priority in CodexPriority}
+            for ticket in self._waiting:
+                waiting[ticket.priority.name.lower()] += 1
+            now = time.monotonic()
+            return {
+                "concurrency": self.concurrency,
+                "running": sum(self._running.values()),
+                "running_agents": len(self._running),
+                "queue_depth": len(self._waiting),
+                "waiting": waiting,
+                "oldest_wait_seconds": max((now - t.enqueued for t in self._waiting), default=0.0),
+                "granted": self.granted,
+                "wait_seconds_avg": sum(self._waits) / len(self._waits) if self._waits else 0.0,
+                "wait_seconds_max": max(self._waits, default=0.0),
+                "run_seconds_avg": sum(self._runs) / len(self._runs) if self._runs else 0.0,
+            }
+
+    def _prune(self) -> None:
+        """Forget idle agents served before every active one.
+
+        A forgotten agent ranks as never served, which is where its old grant
+        already placed it, so the order of waiting runs does not change.
+        """
+
+        active = set(self._running) | {ticket.agent for ticket in self._waiting}
+        floor = min((self._served.get(agent, 0) for agent in active), default=None)
+        for agent, grant in list(self._served.items()):
+            if agent not in active and (floor is None or grant < floor):
+                del self._served[agent]
+
+    def _next(self) -> _Ticket:
+        def rank(ticket: _Ticket) -> tuple:
+            running = self._running.get(ticket.agent, 0)
+            return (ticket.priority, running, self._served.get(ticket.agent, 0), ticket.seq)
+
+        return min(self._waiting, key=rank)
@@ -3,22 +3,32 @@
 from __future__ import annotations
 
 import asyncio
+import json
 import shutil
+import threading
+import time
+from dataclasses import asdict, dataclass
+from functools import partial
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Any, AsyncIterator, Callable, Dict, List, Literal, Optional, Tuple
 
 from fastapi import FastAPI, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel, Field
 
-from ..ci import run_ci
-from ..codex_client import CodexRunner, CodexError
+from ..ci import CIResultCache, PipelineResult, ci_fingerprint, run_ci
+from ..codex_client import CodexError, CodexResult, CodexRunner, CodexSessions, CodexTimeout
 from ..config import AgentDirectories, AgentSettings, resolve_workspace
 from ..git_repo import GitRepository
+from ..impact import ImpactAnalyzer
 from ..logging_utils import configure_logging, log_event
 from ..metadata import VersionBump, load_metadata, save_metadata
-from ..registry import VersionRegistry
+from ..registry import open_registry
 from ..state_manager import StateManager
+from ..warm_pool import DEFAULT_PRELOAD, WarmPytestPool
+from ..workspace_store import CollectResult, WorkspaceCache, WorkspaceStore
+from .jobs import Job, JobQueue, ProgressFn, QueueFull, no_progress
+from .scheduler import CodexPriority, CodexScheduler
 
 app = FastAPI(title="Architect Service", version="0.1.0")
 
@@ -44,6 +54,12 @@ class ArchitectChatRequest(BaseModel):
     attachments: list[str] = Field(default_factory=list)
     dry_run: bool = False
     bump: VersionBump = VersionBump.PATCH
+    # Escalations sent by a version's Tuner queue behind user feedback.
+    source: Literal["user", "tuner"] = "user"
+
+    @property
+    def priority(self) -> CodexPriority:
+        return CodexPriority.ESCALATION if self.source == "tuner" else CodexPriority.FEEDBACK
 
 
 class ArchitectChatResponse(BaseModel):
@@ -53,15 +69,92 @@ class ArchitectChatResponse(BaseModel):
     notes: Optional[str] = None
 
 
+@dataclass
+class _FeedbackBatch:
+    """Chat requests for one workspace collected into a single Codex run."""
+
+    requests: List[ArchitectChatRequest]
+    job: Optional[Job] = None
+    closed: bool = False
+
+    def merged_request(self) -> ArchitectChatRequest:
+        first = self.requests[0]
+        if len(self.requests) == 1:
+            return first
+        message = "\n\n".join(
+            f"[{idx}] {request.message}" for idx, request in enumerate(self.requests, start=1)
+        )
+        attachments = list(dict.fromkeys(uri for r in self.requests for uri in r.attachments))
+        return ArchitectChatRequest(
+            message=message,
+            attachments=attachments,
+            dry_run=first.dry_run,
+            bump=first.bump,
+            source=first.source,
+        )
+
+
+# (workspace directory name, dry_run, bump, source) of coalesced feedback.
+BatchKey = Tuple[str, bool, VersionBump, str]
+
+
+def _codex_progress(progress: ProgressFn) -> Callable[[dict], None]:
+    """Forward Codex turn and item lifecycle events as job progress."""
+
+    def relay(event: dict) -> None:
+        kind = str(event.get("type", ""))
+        if kind.startswith(("turn.", "item.started", "item.completed")):
+            item = event.get("item") or {}
+            progress("codex_event", type=kind, item=item.get("type"), usage=event.get("usage"))
+
+    return relay
+
+
+def _codex_status(err: CodexError) -> int:
+    return 504 if isinstance(err, CodexTimeout) else 500
+
+
 class ArchitectService:
     def __init__(self) -> None:
         self.settings = AgentSettings()
-        self.registry = VersionRegistry(self.settings.registry_file)
+        self.registry = open_registry(self.settings)
+        self.store = WorkspaceStore(self.settings)
+        self.workspaces = WorkspaceCache(self.settings, self.store, in_use=self._is_serving)
+        self.ci_cache = CIResultCache(
+            self.settings.ci_cache_dir / "results",
+            max_entries=self.settings.ci_result_cache_size,
+        )
+        self.impact = ImpactAnalyzer(
+            self.settings.ci_cache_dir / "impact",
+            full_every=self.settings.ci_full_run_every,
+            tests_file=self.settings.tests_filename,
+        )
+        self.ci_pool: Optional[WarmPytestPool] = None
+        if self.settings.ci_warm_workers > 0:
+            self.ci_pool = WarmPytestPool(
+                size=self.settings.ci_warm_workers,
+                max_runs=self.settings.ci_warm_max_runs,
+                preload=self.settings.ci_warm_preload or DEFAULT_PRELOAD,
+            )
         self.codex = CodexRunner(self.settings)
+        self.codex_sessions = CodexSessions(self.settings.codex_sessions_file)
+        self.codex_slots = CodexScheduler(self.settings.codex_concurrency)
         self.logger = configure_logging("architect")
         self._locks: Dict[str, asyncio.Lock] = {}
+        self.jobs = JobQueue(
+            concurrency=self.settings.architect_concurrency,
+            max_pending=self.settings.architect_max_pending,
+            history=self.settings.architect_job_history,
+        )
+        self._batches: Dict[BatchKey, _FeedbackBatch] = {}
+        self._batch_guard = threading.Lock()
         self.settings.workspace_root.mkdir(parents=True, exist_ok=True)
 
+    def _is_serving(self, commit: str) -> bool:
+        # Evicting a served version would move `state/` and `logs/` from under it.
+        record = self.registry.get_by_commit(commit)
+        return record is not None and record.is_serving()
+
     def _lock_for(self, key: str) -> asyncio.Lock:
         if key not in self._locks:
             self._locks[key] = asyncio.Lock()
@@ -84,7 +177,9 @@ class ArchitectService:
             f"Feedback:\n{message}\n{attachment_txt}\n"
         )
 
-    def start_agent(self, request: StartAgentRequest) -> StartAgentResponse:
+    def start_agent(
+        self, request: StartAgentRequest, progress: ProgressFn = no_progress
+    ) -> StartAgentResponse:
         dirs = resolve_workspace(self.settings, request.agent_name)
         if dirs.root.exists() and any(dirs.root.iterdir()):
             raise HTTPException(status_code=409, detail=f"Workspace {dirs.root} is not empty")
@@ -98,23 +193,39 @@ class ArchitectService:
         metadata = load_metadata(dirs.metadata_file)
 
         repo = GitRepository.open(dirs.root)
+        # Commit the skeleton first so the lineage has its root commit, which
+        # identifies the agent to the Codex scheduler, before Codex runs.
+        repo.commit_all("Initialize agent workspace")
         bootstrap_prompt = request.bootstrap_prompt or self._bootstrap_prompt(request.description)
+        progress("codex")
         try:
-            result = self.codex.run(bootstrap_prompt, dirs.root)
+            result = self._run_codex(
+                bootstrap_prompt,
+                dirs.root,
+                progress,
+                agent=repo.root_commit(),
+                priority=CodexPriority.BOOTSTRAP,
+            )
         except CodexError as err:
-            raise HTTPException(status_code=500, detail=str(err)) from err
+            raise HTTPException(status_code=_codex_status(err), detail=str(err)) from err
         if result.exit_code != 0:
             raise HTTPException(status_code=500, detail="Codex bootstrap failed")
 
+        progress("commit")
         commit_hash = repo.commit_all("Bootstrap agent")
         metadata.update_commit(commit_hash)
+        metadata.codex_session = result.session_id
         save_metadata(dirs.metadata_file, metadata)
+        if result.session_id:
+            self.codex_sessions.advance(result.session_id, commit_hash)
 
         new_root = dirs.root.parent / commit_hash
         if new_root != dirs.root:
             if new_root.exists():
                 raise HTTPException(status_code=409, detail=f"Workspace {new_root} already exists")
             shutil.move(str(dirs.root), str(new_root))
+        self.store.ingest(new_root)
+        self.workspaces.admit(new_root)
         self.registry.upsert(commit_hash=commit_hash, version=metadata.version)
         log_event(self.logger, "workspace_bootstrap", commit=commit_hash, version=metadata.version)
 
@@ -129,65 +240,181 @@ class ArchitectService:
         candidate = self.settings.workspace_root / version
         if candidate.exists():
             return self.settings.paths_for(candidate)
-        record = self.registry.get_by_version(version)
+        record = self.registry.get_by_version(version) or self.registry.get_by_commit(version)
         if record:
-            commit_path = self.settings.workspace_root / record.commit_hash
-            if commit_path.exists():
+            commit_path = self.workspaces.path_for(record.commit_hash)
+            # Evicted versions are checked out again when their job runs.
+            if commit_path.exists() or self.workspaces.can_restore(record.commit_hash):
                 return self.settings.paths_for(commit_path)
         raise HTTPException(status_code=404, detail=f"Unknown version {version}")
 
-    async def handle_chat(self, version: str, request: ArchitectChatRequest) -> ArchitectChatResponse:
+    def submit_start(self, request: StartAgentRequest) -> Job:
+        return self._submit(
+            "start",
+            partial(self.start_agent, request),
+            lock=self._lock_for(request.agent_name),
+            priority=CodexPriority.BOOTSTRAP,
+        )
+
+    def submit_chat(self, version: str, request: ArchitectChatRequest) -> Job:
         dirs = self._resolve_dirs(version)
-        lock = self._lock_for(dirs.root.name)
-        async with lock:
-            return await asyncio.get_running_loop().run_in_executor(
-                None, self._sync_handle_chat, version, request, dirs
+        window = self.settings.architect_coalesce_window
+        if window <= 0:
+            return self._submit(
+                "chat",
+                partial(self._sync_handle_chat, version, request, dirs),
+                version=version,
+                lock=self._lock_for(dirs.root.name),
+                priority=request.priority,
             )
 
+        # Requests for the same workspace (and the same dry_run/bump) that arrive
+        # before the batch starts running share one Codex prompt, CI run and commit.
+        key: BatchKey = (dirs.root.name, request.dry_run, request.bump, request.source)
+        with self._batch_guard:
+            batch = self._batches.get(key)
+            if batch is not None and not batch.closed and batch.job is not None:
+                batch.requests.append(request)
+                batch.job.merged = len(batch.requests)
+                self.jobs.note(batch.job, "merged", requests=len(batch.requests))
+                return batch.job
+            batch = _FeedbackBatch(requests=[request])
+            batch.job = self._submit(
+                "chat",
+                partial(self._run_batch, version, key, batch, dirs),
+                version=version,
+                lock=self._lock_for(dirs.root.name),
+                delay=window,
+                priority=request.priority,
+            )
+            self._batches[key] = batch
+            return batch.job
+
+    def _run_batch(
+        self,
+        version: str,
+        key: BatchKey,
+        batch: _FeedbackBatch,
+        dirs: AgentDirectories,
+        progress: ProgressFn = no_progress,
+    ) -> ArchitectChatResponse:
+        with self._batch_guard:
+            batch.closed = True
+            if self._batches.get(key) is batch:
+                del self._batches[key]
+        response = self._sync_handle_chat(version, batch.merged_request(), dirs, progress)
+        if len(batch.requests) > 1:
+            summary = f"Coalesced {len(batch.requests)} feedback requests"
+            response.notes = f"{summary}. {response.notes}" if response.notes else summary
+        return response
+
+    def _submit(self, kind: str, fn: Callable[[ProgressFn], BaseModel], **kwargs: Any) -> Job:
+        try:
+            return self.jobs.submit(kind, fn, **kwargs)
+        except QueueFull as err:
+            log_event(self.logger, "architect_saturated", kind=kind, retry_after=err.retry_after)
+            raise HTTPException(
+                status_code=429, detail=str(err), headers={"Retry-After": str(int(err.retry_after))}
+            ) from err
+
+    async def outcome(self, job: Job) -> dict:
+        """Wait for `job` and return its result, re-raising its HTTP error."""
+
+        job = await self.jobs.wait(job.id)
+        if job.error is not None:
+            raise HTTPException(status_code=job.error["status_code"], detail=job.error["detail"])
+        assert job.result is not None
+        return job.result
+
+    async def handle_chat(self, version: str, request: ArchitectChatRequest) -> ArchitectChatResponse:
+        result = await self.outcome(self.submit_chat(version, request))
+        return ArchitectChatResponse.model_validate(result)
+
     def _sync_handle_chat(
-        self, version: str, request: ArchitectChatRequest, dirs: AgentDirectories
+        self,
+        version: str,
+        request: ArchitectChatRequest,
+        dirs: AgentDirectories,
+        progress: ProgressFn = no_progress,
+    ) -> ArchitectChatResponse:
+        with self.workspaces.pin(dirs.root.name):
+            if not dirs.root.exists():
+                progress("materialize", path=str(dirs.root))
+            try:
+                self.workspaces.ensure(dirs.root.name)
+            except FileNotFoundError as err:
+                raise HTTPException(status_code=404, detail=f"Unknown version {version}") from err
+            return self._apply_feedback(request, dirs, progress)
+
+    def _apply_feedback(
+        self, request: ArchitectChatRequest, dirs: AgentDirectories, progress: ProgressFn
     ) -> ArchitectChatResponse:
         metadata = load_metadata(dirs.metadata_file)
         repo = GitRepository.open(dirs.root)
         staging_dir = dirs.staging_path(self.settings.staging_suffix)
-        repo.clone_to(staging_dir)
+        progress("staging", path=str(staging_dir))
+        staging_repo = repo.stage_to(staging_dir, self.settings.staging_mode)
         prompt = self._feedback_prompt(request.message, request.attachments)
+        progress("codex")
+        # Continue the Codex session that produced this version, unless another
+        # round has since continued it from here or its last round was discarded.
+        resume = metadata.codex_session if self.settings.codex_resume else None
+        if resume and not self.codex_sessions.claim(resume, repo.head):
+            resume = None
+        run_codex = partial(self._run_codex, agent=repo.root_commit(), priority=request.priority)
         try:
-            result = self.codex.run(prompt, staging_dir)
+            result = run_codex(prompt, staging_dir, progress, resume=resume)
+            if resume and result.exit_code != 0:
+                # The session may have expired; retry from a fresh staging tree and session.
+                log_event(self.logger, "codex_resume_failed", session=resume, commit=repo.head)
+                resume = None
+                repo.remove_worktree(staging_dir)
+                staging_repo = repo.stage_to(staging_dir, self.settings.staging_mode)
+                result = run_codex(prompt, staging_dir, progress)
         except CodexError as err:
-            shutil.rmtree(staging_dir, ignore_errors=True)
-            raise HTTPException(status_code=500, detail=str(err)) from err
+            repo.remove_worktree(staging_dir)
+            raise HTTPException(status_code=_codex_status(err), detail=str(err)) from err
         if result.exit_code != 0:
-            shutil.rmtree(staging_dir, ignore_errors=True)
+            repo.remove_worktree(staging_dir)
             raise HTTPException(status_code=500, detail="Codex update failed")
 
-        staging_repo = GitRepository.open(staging_dir)
         if staging_repo.is_clean():
-            shutil.rmtree(staging_dir, ignore_errors=True)
+            repo.remove_worktree(staging_dir)
             return ArchitectChatResponse(result="rejected", notes="No changes produced")
 
         if request.dry_run:
-            shutil.rmtree(staging_dir, ignore_errors=True)
+            repo.remove_worktree(staging_dir)
             return ArchitectChatResponse(
                 result="rejected", notes="Dry run requested; changes not applied"
             )
 
-        ci_result = run_ci(staging_dir)
+        progress("ci")
+        ci_result, impact = self._run_ci(repo.head, staging_repo)
         if not ci_result.success:
-            shutil.rmtree(staging_dir, ignore_errors=True)
+            repo.remove_worktree(staging_dir)
             return ArchitectChatResponse(result="rejected", notes=ci_result.summary)
 
         metadata.bump(request.bump)
+        metadata.codex_session = result.session_id or resume
         stage_metadata = Path(staging_dir) / self.settings.metadata_filename
         save_metadata(stage_metadata, metadata)
         commit_message = f"Architect update: {request.message[:80]}"
+        progress("commit")
         commit_hash = staging_repo.commit_all(commit_message)
 
         new_root = dirs.root.parent / commit_hash
         if new_root.exists():
-            shutil.rmtree(staging_dir, ignore_errors=True)
+            repo.remove_worktree(staging_dir)
             raise HTTPException(status_code=409, detail=f"Workspace {new_root} already exists")
-        shutil.move(str(staging_dir), str(new_root))
+        repo.relocate(staging_dir, new_root)
+        if metadata.codex_session:
+            self.codex_sessions.advance(metadata.codex_session, commit_hash)
+        if impact is not None:
+            self.impact.save(commit_hash, impact)
+        self.store.ingest(new_root)
+        evicted = self.workspaces.admit(new_root)
+        if evicted:
+            log_event(self.logger, "workspace_evict", commits=evicted)
         self.registry.upsert(
             commit_hash=commit_hash,
             version=metadata.version,
@@ -208,16 +435,157 @@ class ArchitectService:
             notes=result.last_message,
         )
 
+    def _run_codex(
+        self,
+        prompt: str,
+        workdir: Path,
+        progress: ProgressFn,
+        *,
+        agent: str,
+        priority: CodexPriority,
+        resume: Optional[str] = None,
+    ) -> CodexResult:
+        """Run Codex once a slot of the global Codex cap is granted to `agent`.
+
+        `agent` is the root commit of the lineage, for bootstraps and feedback alike.
+        """
+
+        with self.codex_slots.slot(agent, priority) as waited:
+            progress("codex_slot", waited=round(waited, 3), priority=priority.name.lower())
+            if resume:
+                log_event(self.logger, "codex_resume", session=resume)
+            return self.codex.run(
+                prompt, workdir, json_output=True, on_event=_codex_progress(progress), resume=resume
+            )
+
+    def _run_ci(
+        self, base_commit: str, staging_repo: GitRepository
+    ) -> Tuple[PipelineResult, Optional[dict]]:
+        """Run CI for the staging tree unless an identical tree already passed.
+
+        A passing full run is reused for any test selection, a passing selective
+        run only for the same selection. Also returns the per-test coverage map
+        to store with the resulting commit.
+        """
+
+        settings = self.settings
+        plan = self.impact.plan(base_commit, staging_repo) if settings.ci_test_impact else None
+        tree_hash = staging_repo.tree_hash()
+        fingerprint = ci_fingerprint(workers=settings.ci_pytest_workers)
+        keys = [self.ci_cache.key(tree_hash, fingerprint)]
+        if plan is not None and plan.tests is not None:
+            keys.append(self.ci_cache.key(tree_hash, fingerprint, plan.tests))
+        key = keys[-1]
+        cached = self.ci_cache.get(*keys) if settings.ci_result_cache_size > 0 else None
+        if cached is not None:
+            if plan is not None:
+                self.impact.discard(plan)
+            log_event(self.logger, "ci_cache_hit", key=key, **self.ci_cache.stats())
+            return cached, self.impact.load(base_commit)
+
+        if plan is not None:
+            log_event(self.logger, "ci_test_selection", tests=plan.tests, reason=plan.reason)
+        started = time.monotonic()
+        result = run_ci(
+            staging_repo.worktree,
+            timeout=settings.ci_timeout,
+            workers=settings.ci_pytest_workers,
+            cache_dir=settings.ci_cache_dir if settings.ci_step_cache else None,
+            tests=plan.tests if plan else None,
+            coverage_rc=plan.coverage_rc if plan else None,
+            pytest_runner=self.ci_pool.run if self.ci_pool else None,
+        )
+        self.ci_cache.put(key, result, time.monotonic() - started)
+        log_event(self.logger, "ci_cache_miss", key=key, **self.ci_cache.stats())
+        impact = None
+        if plan is not None:
+            impact = self.impact.record(plan, staging_repo.worktree) if result.success else None
+            self.impact.discard(plan)
+        return result, impact
+
+    def collect_garbage(self) -> CollectResult:
+        """Drop workspaces the registry no longer references, then unused blobs."""
+
+        records = self.registry.list_versions(limit=self.registry.count())
+        result = self.store.collect(record.commit_hash for record in records)
+        self.workspaces.reload()
+        log_event(self.logger, "workspace_gc", **asdict(result))
+        return result
+
 
 _service = ArchitectService()
 
 
 @app.post("/agent/start")
-def start_agent(request: StartAgentRequest) -> StartAgentResponse:
-    return _service.start_agent(request)
+async def start_agent(request: StartAgentRequest) -> StartAgentResponse:
+    result = await _service.outcome(_service.submit_start(request))
+    return StartAgentResponse.model_validate(result)
+
+
+@app.post("/agent/start/jobs", status_code=202)
+async def submit_start(request: StartAgentRequest) -> Job:
+    return _service.submit_start(request)
 
 
 @app.post("/agent/{version}/architect/chat")
 async def architect_chat(version: str, request: ArchitectChatRequest) -> JSONResponse:
     response = await _service.handle_chat(version, request)
     return JSONResponse(content=response.model_dump())
+
+
+@app.post("/agent/{version}/architect/jobs", status_code=202)
+async def submit_chat(version: str, request: ArchitectChatRequest) -> Job:
+    return _service.submit_chat(version, request)
+
+
+@app.get("/jobs/{job_id}")
+@app.get("/agent/{version}/architect/jobs/{job_id}")
+async def job_status(job_id: str, version: Optional[str] = None) -> Job:
+    return _service.jobs.get(job_id)
+
+
+@app.get("/jobs/{job_id}/events")
+@app.get("/agent/{version}/architect/jobs/{job_id}/events")
+async def job_events(job_id: str, version: Optional[str] = None) -> StreamingResponse:
+    _service.jobs.get(job_id)
+
+    async def stream() -> AsyncIterator[str]:
+        async for event in _service.jobs.events(job_id):
+            yield f"event: {event.stage}\ndata: {json.dumps(event.model_dump(mode='json'))}\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+
+@app.get("/jobs")
+async def job_stats() -> dict:
+    return _service.jobs.stats()
+
+
+@app.get("/metrics")
+async def metrics() -> dict:
+    return {"jobs": _service.jobs.stats(), "codex": _service.codex_slots.stats()}
+
+
+@app.post("/workspaces/gc")
+async def collect_garbage() -> dict:
+    # Wait out running workspace jobs and hold off new ones, so none stages from a
+    # directory being removed.
+    async with _service.jobs.gate.exclusive():
+        result = await asyncio.to_thread(_service.collect_garbage)
+    return {**asdict(result), **_service.store.stats()}
+
+
+@app.get("/workspaces")
+async def workspace_stats() -> dict:
+    return {
+        **_service.store.stats(),
+        **_service.workspaces.stats(),
+        "ci_cache": _service.ci_cache.stats(),
+    }
+
+
+@app.on_event("shutdown")
+async def _shutdown() -> None:
+    _service.jobs.shutdown()
+    if _service.ci_pool is not None:
+        _service.ci_pool.close()
@@ -2,12 +2,28 @@
 
 from __future__ import annotations
 
+import hashlib
+import importlib.util
+import json
+import os
 import shutil
-from dataclasses import dataclass
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from functools import lru_cache
 from pathlib import Path
-from typing import List
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 
-from .process import run_command
+from .process import CommandResult, run_command
+
+# Same signature as `run_command`, e.g. `WarmPytestPool.run`.
+CommandRunner = Callable[..., CommandResult]
+
+# Directories never considered step inputs: VCS data, runtime output and tool caches.
+IGNORED_DIRS = {".git", "state", "logs", "__pycache__", ".pytest_cache", ".ruff_cache"}
 
 
 @dataclass
@@ -16,6 +32,8 @@ class StepResult:
     success: bool
     stdout: str
     stderr: str
+    duration: float = 0.0
+    cached: bool = False
 
 
 @dataclass
@@ -28,30 +46,269 @@ class PipelineResult:
         lines = []
         for step in self.steps:
             status = "PASS" if step.success else "FAIL"
-            lines.append(f"[{status}] {step.name}")
+            lines.append(f"[{status}] {step.name}" + (" (cached)" if step.cached else ""))
             if step.stderr:
                 lines.append(step.stderr.strip())
         return "\n".join(lines)
 
 
-def run_ci(workdir: Path) -> PipelineResult:
-    steps: List[StepResult] = []
+@dataclass
+class Step:
+    """One CI command, run from the workdir, and the files that determine its outcome."""
+
+    name: str
+    command: List[str]
+    inputs: Tuple[str, ...] = ("**/*",)
+    timeout: Optional[float] = None
+    cacheable: bool = True
+    runner: Optional[CommandRunner] = field(default=None, repr=False)
+    outcome: Optional[StepResult] = field(default=None, repr=False)
+
+    @classmethod
+    def fixed(cls, result: StepResult) -> "Step":
+        """A step whose result is known up front (e.g. a missing tool)."""
+
+        return cls(name=result.name, command=[], outcome=result)
+
+
+def ci_steps(
+    workdir: Path,
+    *,
+    timeout: Optional[float] = None,
+    workers: int = 0,
+    tests: Optional[List[str]] = None,
+    coverage_rc: Optional[Path] = None,
+    pytest_runner: Optional[CommandRunner] = None,
+) -> List[Step]:
+    steps: List[Step] = []
 
     # Ruff lint if available
     if shutil.which("ruff"):
-        result = run_command(["ruff", "check", "--select", "E,F", "--quiet", str(workdir)], cwd=workdir)
-        steps.append(StepResult("ruff", result.exit_code == 0, result.stdout, result.stderr))
+        steps.append(
+            Step(
+                "ruff",
+                ["ruff", "check", "--select", "E,F", "--quiet", "."],
+                inputs=("**/*.py", "pyproject.toml", "ruff.toml", ".ruff.toml"),
+                timeout=timeout,
+            )
+        )
 
     tests_path = workdir / "tests.py"
     pytest_bin = shutil.which("pytest")
-    if tests_path.exists() and pytest_bin:
-        pytest_cmd = [pytest_bin, "-q", str(tests_path)]
-        result = run_command(pytest_cmd, cwd=workdir)
-        steps.append(StepResult("pytest", result.exit_code == 0, result.stdout, result.stderr))
+    coverage_bin = shutil.which("coverage") if coverage_rc is not None else None
+    if tests_path.exists() and pytest_bin and tests == []:
+        steps.append(Step.fixed(StepResult("pytest", True, "no tests affected; skipping", "")))
+    elif tests_path.exists() and pytest_bin:
+        pytest_cmd = [pytest_bin, "-q"]
+        runner = pytest_runner
+        if coverage_bin is not None:
+            # Full runs record which test executed which lines (see impact.ImpactAnalyzer);
+            # selective runs get no `coverage_rc` and keep sharding and step caching.
+            pytest_cmd = [coverage_bin, "run", f"--rcfile={coverage_rc}", "-m", "pytest", "-q"]
+        elif workers > 1 and importlib.util.find_spec("xdist") is not None:
+            pytest_cmd += ["-n", str(workers)]
+            runner = None
+        pytest_cmd += tests or [tests_path.name]
+        steps.append(
+            Step(
+                "pytest",
+                pytest_cmd,
+                timeout=timeout,
+                cacheable=coverage_bin is None,
+                runner=runner,
+            )
+        )
     elif tests_path.exists():
-        steps.append(StepResult("pytest", False, "", "pytest not available"))
+        steps.append(Step.fixed(StepResult("pytest", False, "", "pytest not available")))
     else:
-        steps.append(StepResult("pytest", True, "tests.py missing; skipping", ""))
+        steps.append(Step.fixed(StepResult("pytest", True, "tests.py missing; skipping", "")))
+    return steps
+
+
+def run_ci(
+    workdir: Path,
+    *,
+    timeout: Optional[float] = None,
+    workers: int = 0,
+    cache_dir: Optional[Path] = None,
+    tests: Optional[List[str]] = None,
+    coverage_rc: Optional[Path] = None,
+    pytest_runner: Optional[CommandRunner] = None,
+) -> PipelineResult:
+    """Run lint and tests for `workdir` concurrently.
+
+    `workers` > 1 shards pytest with pytest-xdist when it is installed. With a
+    `cache_dir`, steps whose input files hash to a previously passing digest are
+    skipped and reported as cached. `tests` restricts pytest to those node ids
+    and `coverage_rc` runs it under coverage with per-test contexts. Plain
+    unsharded pytest runs go through `pytest_runner` when given.
+    """
+
+    steps = ci_steps(
+        workdir,
+        timeout=timeout,
+        workers=workers,
+        tests=tests,
+        coverage_rc=coverage_rc,
+        pytest_runner=pytest_runner,
+    )
+    return run_pipeline(workdir, steps, cache_dir=cache_dir)
+
+
+def run_pipeline(
+    workdir: Path, steps: List[Step], *, cache_dir: Optional[Path] = None
+) -> PipelineResult:
+    results: List[Optional[StepResult]] = [step.outcome for step in steps]
+    pending = [(idx, step) for idx, step in enumerate(steps) if step.outcome is None]
+    if pending:
+        with ThreadPoolExecutor(max_workers=len(pending), thread_name_prefix="ci") as pool:
+            futures = [
+                (idx, pool.submit(_run_step, workdir, step, cache_dir)) for idx, step in pending
+            ]
+            for idx, future in futures:
+                results[idx] = future.result()
+    finished = [result for result in results if result is not None]
+    return PipelineResult(success=all(step.success for step in finished), steps=finished)
+
+
+def _run_step(workdir: Path, step: Step, cache_dir: Optional[Path]) -> StepResult:
+    marker: Optional[Path] = None
+    if cache_dir is not None and step.cacheable:
+        marker = cache_dir / f"{step.name}-{step_digest(workdir, step)}.json"
+        if marker.exists():
+            cached = StepResult(**json.loads(marker.read_text()))
+            cached.cached = True
+            return cached
+
+    started = time.monotonic()
+    try:
+        outcome = (step.runner or run_command)(step.command, cwd=workdir, timeout=step.timeout)
+    except subprocess.TimeoutExpired:
+        return StepResult(
+            step.name, False, "", f"timed out after {step.timeout}s", time.monotonic() - started
+        )
+    result = StepResult(
+        step.name, outcome.exit_code == 0, outcome.stdout, outcome.stderr, time.monotonic() - started
+    )
+    if marker is not None and result.success:
+        marker.parent.mkdir(parents=True, exist_ok=True)
+        staged = marker.with_name(f".{marker.name}.{os.getpid()}")
+        staged.write_text(json.dumps(asdict(result)))
+        os.replace(staged, marker)
+    return result
+
+
+def step_digest(workdir: Path, step: Step) -> str:
+    """Hash the step's command and the path and content of each input file."""
+
+    digest = hashlib.sha256("\0".join(step.command).encode())
+    for path in _input_files(workdir, step.inputs):
+        digest.update(b"\0" + path.relative_to(workdir).as_posix().encode() + b"\0")
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def _input_files(workdir: Path, patterns: Tuple[str, ...]) -> Iterator[Path]:
+    seen = set()
+    for pattern in patterns:
+        for path in workdir.glob(pattern):
+            rel = path.relative_to(workdir)
+            if rel in seen or IGNORED_DIRS.intersection(rel.parts) or not path.is_file():
+                continue
+            seen.add(rel)
+    for rel in sorted(seen):
+        yield workdir / rel
+
+
+@lru_cache(maxsize=None)
+def _tool_version(tool: str) -> str:
+    binary = shutil.which(tool)
+    if binary is None:
+        return "missing"
+    return run_command([binary, "--version"]).stdout.strip()
+
+
+def ci_fingerprint(*, workers: int = 0) -> str:
+    """Identify the toolchain a CI result was produced with."""
+
+    xdist = importlib.util.find_spec("xdist") is not None
+    parts = [sys.version, _tool_version("ruff"), _tool_version("pytest"), f"xdist={xdist}:{workers}"]
+    return hashlib.sha256("\0".join(parts).encode()).hexdigest()[:16]
+
+
+class CIResultCache:
+    """Persistent passing `PipelineResult`s keyed by tree hash, toolchain and test
+    selection, evicted LRU.
+
+    Failures (including timeouts) are not stored, so retrying a tree runs CI
+    again. Entries are JSON files whose mtime records the last use; hit/miss
+    counters and the CI time saved by hits are kept per process.
+    """
+
+    def __init__(self, directory: Path, *, max_entries: int = 256) -> None:
+        self.directory = directory
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self._guard = threading.Lock()
+
+    def key(self, tree_hash: str, fingerprint: str, tests: Optional[List[str]] = None) -> str:
+        """`tests` is the selected subset; None (the whole suite) satisfies any selection."""
+
+        if tests is None:
+            return f"{tree_hash}-{fingerprint}"
+        selection = hashlib.sha256("\0".join(sorted(tests)).encode()).hexdigest()[:16]
+        return f"{tree_hash}-{fingerprint}-{selection}"
+
+    def get(self, *keys: str) -> Optional[PipelineResult]:
+        """The entry of the first key present; the lookup counts as one hit or miss."""
+
+        for key in keys:
+            path = self.directory / f"{key}.json"
+            try:
+                payload = json.loads(path.read_text())
+                os.utime(path)
+                break
+            except (OSError, ValueError):
+                continue
+        else:
+            with self._guard:
+                self.misses += 1
+            return None
+        with self._guard:
+            self.hits += 1
+            self.saved_seconds += payload["duration"]
+        steps = [StepResult(**step) for step in payload["steps"]]
+        return PipelineResult(success=payload["success"], steps=steps)
+
+    def put(self, key: str, result: PipelineResult, duration: float) -> None:
+        if self.max_entries <= 0 or not result.success:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / f"{key}.json"
+        staged = path.with_name(f".{path.name}.{os.getpid()}")
+        staged.write_text(json.dumps({**asdict(result), "duration": duration}))
+        os.replace(staged, path)
+        self._evict()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._guard:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "saved_seconds": round(self.saved_seconds, 3),
+            }
 
-    success = all(step.success for step in steps)
-    return PipelineResult(success=success, steps=steps)
+    def _evict(self) -> None:
+        entries = []
+        for path in self.directory.glob("*.json"):
+            try:
+                entries.append((path.stat().st_mtime, path))
+            except FileNotFoundError:
+                continue
+        entries.sort()
+        for _, path in entries[: max(0, len(entries) - self.max_entries)]:
+            path.unlink(missing_ok=True)
@@ -2,21 +2,36 @@
 
 from __future__ import annotations
 
+import asyncio
+import contextlib
 import json
 import os
 import shutil
-import subprocess
+import signal
+from collections import deque
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Iterable, List, Optional
+from typing import AsyncIterator, Callable, Deque, Dict, Iterable, List, Optional
+
+from filelock import FileLock
 
 from .config import AgentSettings
 
+EventCallback = Callable[[dict], None]
+
+
+# Seconds to keep draining stderr after Codex exited, when no deadline is left.
+_STDERR_GRACE = 1.0
+
 
 class CodexError(RuntimeError):
     pass
 
 
+class CodexTimeout(CodexError):
+    pass
+
+
 @dataclass
 class CodexResult:
     """Response returned by the Codex CLI."""
@@ -26,6 +41,165 @@ class CodexResult:
     stderr: str
     last_message: str | None = None
     events: Optional[List[dict]] = None
+    session_id: Optional[str] = None
+
+
+class CodexStream:
+    """Events of one running `codex exec` process, parsed line by line as they arrive.
+
+    Only the last `tail_lines` lines of stdout/stderr and events are retained,
+    and a single line longer than `line_limit` bytes is dropped rather than
+    buffered. The process runs in its own process group so a timeout, an error
+    in the consumer or task cancellation kills Codex and everything it spawned.
+    """
+
+    def __init__(
+        self,
+        cmd: List[str],
+        workdir: Path,
+        *,
+        json_output: bool,
+        timeout: Optional[float] = None,
+        line_limit: int = 1 << 20,
+        tail_lines: int = 200,
+    ) -> None:
+        self.cmd = cmd
+        self.workdir = workdir
+        self.json_output = json_output
+        self.timeout = timeout
+        self.line_limit = line_limit
+        self.exit_code: Optional[int] = None
+        self.last_message: Optional[str] = None
+        self.session_id: Optional[str] = None
+        self.dropped_lines = 0
+        self.stdout_tail: Deque[str] = deque(maxlen=tail_lines)
+        self.stderr_tail: Deque[str] = deque(maxlen=tail_lines)
+        self.events: Deque[dict] = deque(maxlen=tail_lines)
+        self._process: Optional[asyncio.subprocess.Process] = None
+
+    def __aiter__(self) -> AsyncIterator[dict]:
+        return self._events()
+
+    def result(self) -> CodexResult:
+        assert self.exit_code is not None, "stream has not finished"
+        return CodexResult(
+            exit_code=self.exit_code,
+            stdout="\n".join(self.stdout_tail),
+            stderr="\n".join(self.stderr_tail),
+            last_message=self.last_message,
+            events=list(self.events) if self.json_output else None,
+            session_id=self.session_id,
+        )
+
+    def kill(self) -> None:
+        process = self._process
+        if process is None or process.returncode is not None:
+            return
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    async def _events(self) -> AsyncIterator[dict]:
+        self._process = await asyncio.create_subprocess_exec(
+            *self.cmd,
+            cwd=str(self.workdir),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            env=os.environ,
+            start_new_session=True,
+            limit=self.line_limit,
+        )
+        assert self._process.stdout is not None and self._process.stderr is not None
+        stderr = asyncio.create_task(self._drain(self._process.stderr, self.stderr_tail))
+        loop = asyncio.get_running_loop()
+        deadline = None if self.timeout is None else loop.time() + self.timeout
+        try:
+            while True:
+                remaining = None if deadline is None else max(deadline - loop.time(), 0)
+                try:
+                    line = await asyncio.wait_for(self._readline(self._process.stdout), remaining)
+                except asyncio.TimeoutError:
+                    raise CodexTimeout(f"Codex did not finish within {self.timeout}s") from None
+                if line is None:
+                    break
+                event = self._parse(line)
+                if event is not None:
+                    yield event
+            remaining = None if deadline is None else max(deadline - loop.time(), 0)
+            try:
+                self.exit_code = await asyncio.wait_for(self._exited(), remaining)
+            except asyncio.TimeoutError:
+                raise CodexTimeout(f"Codex did not finish within {self.timeout}s") from None
+        finally:
+            self.kill()
+            await self._exited()  # killed above, so this returns promptly
+            # A descendant that left the process group can keep stderr open indefinitely.
+            grace = _STDERR_GRACE
+            if deadline is not None:
+                grace = max(deadline - loop.time(), grace)
+            try:
+                await asyncio.wait_for(stderr, grace)
+            except asyncio.TimeoutError:
+                pass
+            # Release both pipes, read to the end or not; Process has no public close().
+            self._process._transport.close()  # type: ignore[attr-defined]
+            await self._process.wait()
+            if self.exit_code is None:
+                self.exit_code = self._process.returncode
+
+    async def _exited(self) -> int:
+        """Wait for Codex itself to exit; `Process.wait()` also waits for its pipes to close."""
+
+        assert self._process is not None
+        while self._process.returncode is None:
+            await asyncio.sleep(0.05)
+        return self._process.returncode
+
+    async def _readline(self, reader: asyncio.StreamReader) -> Optional[str]:
+        overrun = False
+        while True:
+            try:
+                raw = await reader.readuntil(b"\n")
+            except asyncio.IncompleteReadError as err:  # EOF
+                raw = err.partial
+            except asyncio.LimitOverrunError as err:
+                # Longer than line_limit: discard what is buffered, then the rest of the line.
+                await reader.readexactly(err.consumed)
+                overrun = True
+                continue
+            if overrun:
+                overrun = False
+                self.dropped_lines += 1
+                continue
+            if not raw:
+                return None
+            return raw.decode(errors="replace").rstrip("\r\n")
+
+    async def _drain(self, reader: asyncio.StreamReader, tail: Deque[str]) -> None:
+        while (line := await self._readline(reader)) is not None:
+            tail.append(line)
+
+    def _parse(self, line: str) -> Optional[dict]:
+        if not line.strip():
+            return None
+        self.stdout_tail.append(line)
+        if not self.json_output:
+            self.last_message = line.strip()
+            return {"type": "output", "text": line}
+        try:
+            event = json.loads(line)
+        except ValueError:
+            return None
+        if not isinstance(event, dict):
+            return None
+        item = event.get("item") or {}
+        if event.get("type") == "thread.started":
+            self.session_id = event.get("thread_id")
+        elif event.get("type") == "item.completed" and item.get("type") == "agent_message":
+            self.last_message = item.get("text")
+        self.events.append(event)
+        return event
 
 
 class CodexRunner:
@@ -34,30 +208,21 @@ class CodexRunner:
     def __init__(self, settings: AgentSettings) -> None:
         self.settings = settings
 
-    def run(
+    def command(
         self,
         prompt: str,
-        workdir: Path,
         *,
         json_output: bool = False,
         full_auto: bool = True,
         sandbox: str = "danger-full-access",
         extra_args: Optional[Iterable[str]] = None,
-    ) -> CodexResult:
-        if self.settings.codex_simulate:
-            return CodexResult(
-                exit_code=0,
-                stdout="",
-                stderr="",
-                last_message="Simulation mode enabled; Codex execution skipped.",
-                events=[],
-            )
-
+        resume: Optional[str] = None,
+    ) -> List[str]:
         executable = shutil.which(self.settings.codex_command)
         if not executable:
             raise CodexError("Codex CLI not found in PATH; set STG_CODEX_COMMAND or enable simulation")
 
-        cmd: List[str] = [executable, "exec", prompt]
+        cmd: List[str] = [executable, "exec"]
         if sandbox:
             cmd += ["--sandbox", sandbox]
         if full_auto:
@@ -68,23 +233,140 @@ class CodexRunner:
             cmd += ["--profile", self.settings.codex_profile]
         if extra_args:
             cmd.extend(extra_args)
+        if resume:
+            cmd += ["resume", resume]
+        cmd.append(prompt)
+        return cmd
 
-        process = subprocess.run(
-            cmd,
-            cwd=str(workdir),
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            env=os.environ,
-            text=True,
-            check=False,
+    def stream(
+        self,
+        prompt: str,
+        workdir: Path,
+        *,
+        json_output: bool = True,
+        timeout: Optional[float] = None,
+        **options: object,
+    ) -> CodexStream:
+        """Start Codex lazily; iterate the returned stream with `async for`."""
+
+        return CodexStream(
+            self.command(prompt, json_output=json_output, **options),  # type: ignore[arg-type]
+            workdir,
+            json_output=json_output,
+            timeout=timeout if timeout is not None else self.settings.codex_timeout,
+            line_limit=self.settings.codex_max_line_bytes,
+            tail_lines=self.settings.codex_output_tail_lines,
         )
-        last_message = process.stdout.strip().splitlines()[-1] if process.stdout.strip() else None
-        result = CodexResult(
-            exit_code=process.returncode,
-            stdout=process.stdout,
-            stderr=process.stderr,
-            last_message=last_message,
+
+    async def run_async(
+        self,
+        prompt: str,
+        workdir: Path,
+        *,
+        json_output: bool = False,
+        on_event: Optional[EventCallback] = None,
+        timeout: Optional[float] = None,
+        **options: object,
+    ) -> CodexResult:
+        if self.settings.codex_simulate:
+            return self._simulated()
+        stream = self.stream(prompt, workdir, json_output=json_output, timeout=timeout, **options)
+        # Close the generator as soon as `on_event` raises, which kills Codex right away.
+        async with contextlib.aclosing(aiter(stream)) as events:
+            async for event in events:
+                if on_event is not None:
+                    on_event(event)
+        return stream.result()
+
+    def run(
+        self,
+        prompt: str,
+        workdir: Path,
+        *,
+        json_output: bool = False,
+        full_auto: bool = True,
+        sandbox: str = "danger-full-access",
+        extra_args: Optional[Iterable[str]] = None,
+        on_event: Optional[EventCallback] = None,
+        timeout: Optional[float] = None,
+        resume: Optional[str] = None,
+    ) -> CodexResult:
+        """Blocking wrapper around `run_async`; call it from a worker thread, not an event loop.
+
+        With `resume`, the prompt continues that Codex session (`codex exec resume`).
+        """
+
+        if self.settings.codex_simulate:
+            return self._simulated()
+        return asyncio.run(
+            self.run_async(
+                prompt,
+                workdir,
+                json_output=json_output,
+                on_event=on_event,
+                timeout=timeout,
+                full_auto=full_auto,
+                sandbox=sandbox,
+                extra_args=extra_args,
+                resume=resume,
+            )
         )
-        if json_output and process.stdout.strip():
-            result.events = [json.loads(line) for line in process.stdout.splitlines() if line.strip()]
-        return result
+
+    @staticmethod
+    def _simulated() -> CodexResult:
+        return CodexResult(
+            exit_code=0,
+            stdout="",
+            stderr="",
+            last_message="Simulation mode enabled; Codex execution skipped.",
+            events=[],
+        )
+
+
+class CodexSessions:
+    """Tracks the commit each Codex session's context currently ends at.
+
+    A session may only be resumed for feedback on exactly that commit; once
+    another branch continued it, or its changes were rejected, callers start a
+    fresh session instead. Updates hold a file lock next to `path`, so several
+    Architect workers can share one sessions file.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._guard = FileLock(str(path.with_name(f"{path.name}.lock")))
+
+    def claim(self, session_id: str, commit_hash: str) -> bool:
+        """Take `session_id` for a round on `commit_hash` if its context ends there.
+
+        A claimed session counts as diverged until `advance` records the commit
+        the round produced, so concurrent rounds never share a session.
+        """
+
+        with self._guard:
+            heads = self._load()
+            if heads.get(session_id) != commit_hash:
+                return False
+            heads[session_id] = None
+            self._save(heads)
+            return True
+
+    def advance(self, session_id: str, commit_hash: Optional[str]) -> None:
+        """Record the commit `session_id` now reflects (None: no usable commit)."""
+
+        with self._guard:
+            heads = self._load()
+            heads[session_id] = commit_hash
+            self._save(heads)
+
+    def _save(self, heads: Dict[str, Optional[str]]) -> None:
+        staged = self.path.with_name(f".{self.path.name}.{os.getpid()}")
+        staged.write_text(json.dumps(heads))
+        os.replace(staged, self.path)
+
+    def _load(self) -> Dict[str, Optional[str]]:
+        try:
+            return json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return {}
@@ -3,7 +3,7 @@
 from __future__ import annotations
 
 from pathlib import Path
-from typing import Optional
+from typing import Dict, List, Literal, Optional
 
 from pydantic import BaseModel, Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -30,11 +30,23 @@ class AgentDirectories(BaseModel):
         return self.root.parent / f"{self.root.name}{suffix}"
 
 
+class UpstreamPoolSettings(BaseModel):
+    """Connection pool limits for one proxied upstream (scheme, host and port)."""
+
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 5.0
+    http2: bool = False
+
+
 class AgentSettings(BaseSettings):
     """Global configuration for services and helpers."""
 
     workspace_root: Path = Field(default_factory=lambda: Path.cwd() / "agents")
     staging_suffix: str = "-staging"
+    staging_mode: Literal["worktree", "clone"] = "worktree"
+    workspace_dedup: Literal["off", "auto", "reflink", "hardlink"] = "auto"
+    workspace_disk_budget: Optional[int] = None
     metadata_filename: str = "metadata.json"
     schema_filename: str = "state_schema.json"
     active_state_filename: str = "active.state.json"
@@ -44,14 +56,60 @@ class AgentSettings(BaseSettings):
     codex_command: str = "codex"
     codex_profile: Optional[str] = None
     codex_simulate: bool = False
+    codex_timeout: Optional[float] = None
+    codex_resume: bool = True
+    codex_concurrency: int = 2
+    codex_max_line_bytes: int = 1 << 20
+    codex_output_tail_lines: int = 200
     default_version: str = "0.0.0"
     tests_filename: str = "tests.py"
     runner_filename: str = "runner.py"
     tuner_filename: str = "tuner.py"
     registry_filename: str = "version_registry.json"
+    registry_backend: Literal["json", "journal", "sqlite"] = "journal"
+    registry_compact_every: int = 1000
+    proxy_streaming: bool = True
+    proxy_timeout: float = 30.0
+    proxy_connect_timeout: float = 5.0
+    proxy_pool_timeout: float = 10.0
+    proxy_max_connections: int = 100
+    proxy_max_keepalive_connections: int = 20
+    proxy_keepalive_expiry: float = 5.0
+    proxy_http2: bool = False
+    proxy_pool_overrides: Dict[str, UpstreamPoolSettings] = Field(default_factory=dict)
+    proxy_balancer: Literal["p2c", "least_outstanding"] = "p2c"
+    proxy_eject_after_failures: int = 3
+    proxy_eject_seconds: float = 30.0
+    proxy_health_check_interval: Optional[float] = None
+    proxy_health_check_path: str = ""
+    proxy_health_check_timeout: float = 2.0
+    # Off by default: replicas that do not heartbeat would otherwise be failed after the TTL.
+    replica_heartbeat_ttl: Optional[float] = None
+    heartbeat_flush_interval: float = 30.0
+    architect_concurrency: int = 4
+    architect_max_pending: int = 100
+    architect_job_history: int = 1000
+    architect_coalesce_window: float = 0.0
+    ci_timeout: Optional[float] = 600.0
+    ci_pytest_workers: int = 0
+    ci_step_cache: bool = True
+    ci_result_cache_size: int = 256
+    ci_test_impact: bool = True
+    ci_full_run_every: int = 10
+    ci_warm_workers: int = 0
+    ci_warm_max_runs: int = 50
+    ci_warm_preload: Optional[List[str]] = None
 
     model_config = SettingsConfigDict(env_prefix="STG_", env_file=".env", extra="allow")
 
+    @property
+    def codex_sessions_file(self) -> Path:
+        return self.workspace_root / ".store" / "codex_sessions.json"
+
+    @property
+    def ci_cache_dir(self) -> Path:
+        return self.workspace_root / ".store" / "ci"
+
     def paths_for(self, root: Path) -> AgentDirectories:
         state_dir = root / self.state_dirname
         logs_dir = root / self.logs_dirname
@@ -69,6 +127,19 @@ class AgentSettings(BaseSettings):
             tuner_file=root / self.tuner_filename,
         )
 
+    def upstream_pool(self, origin: str) -> UpstreamPoolSettings:
+        """Return pool limits for `origin`, falling back to the `proxy_*` defaults."""
+
+        override = self.proxy_pool_overrides.get(origin)
+        if override is not None:
+            return override
+        return UpstreamPoolSettings(
+            max_connections=self.proxy_max_connections,
+            max_keepalive_connections=self.proxy_max_keepalive_connections,
+            keepalive_expiry=self.proxy_keepalive_expiry,
+            http2=self.proxy_http2,
+        )
+
     @property
     def registry_file(self) -> Path:
         return self.workspace_root / self.registry_filename
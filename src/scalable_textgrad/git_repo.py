@@ -3,10 +3,11 @@
 from __future__ import annotations
 
 import shutil
+import tempfile
 from pathlib import Path
 from typing import Iterable, Optional
 
-from git import Repo
+from git import GitCommandError, Repo
 
 
 class GitRepository:
@@ -46,6 +47,18 @@ class GitRepository:
             self.repo.delete_tag(version)
         self.repo.create_tag(version)
 
+    def keep(self, commit_hash: str) -> None:
+        """Pin `commit_hash` under `refs/versions/` so it outlives its worktree."""
+
+        self.repo.git.update_ref(f"refs/versions/{commit_hash}", commit_hash)
+
+    def has_commit(self, commit_hash: str) -> bool:
+        try:
+            self.repo.git.cat_file("-e", f"{commit_hash}^{{commit}}")
+        except GitCommandError:
+            return False
+        return True
+
     def checkout_detached(self, commit_hash: str) -> None:
         self.repo.git.checkout(commit_hash)
 
@@ -55,6 +68,65 @@ class GitRepository:
         repo = self.repo.clone(destination)
         return GitRepository(repo)
 
+    def add_worktree(self, destination: Path, commit: Optional[str] = None) -> "GitRepository":
+        """Check out `commit` (default HEAD) at `destination` sharing this object store.
+
+        The new worktree has a detached HEAD, so committing in it never moves a
+        branch that another worktree has checked out.
+        """
+
+        if destination.exists():
+            self.remove_worktree(destination)
+        self.repo.git.worktree("prune")
+        self.repo.git.worktree("add", "--detach", str(destination), commit or self.head)
+        return GitRepository(Repo(destination))
+
+    def move_worktree(self, source: Path, destination: Path) -> "GitRepository":
+        self.repo.git.worktree("move", str(source), str(destination))
+        return GitRepository(Repo(destination))
+
+    def remove_worktree(self, path: Path) -> None:
+        """Drop a linked worktree; plain directories at `path` are deleted."""
+
+        if (path / ".git").is_file():
+            self.repo.git.worktree("remove", "--force", str(path))
+        shutil.rmtree(path, ignore_errors=True)
+        self.repo.git.worktree("prune")
+
+    def stage_to(self, destination: Path, mode: str = "worktree") -> "GitRepository":
+        """Prepare a staging copy of HEAD using a linked worktree or a full clone."""
+
+        if mode == "clone":
+            return self.clone_to(destination)
+        return self.add_worktree(destination)
+
+    def relocate(self, source: Path, destination: Path) -> "GitRepository":
+        """Move a staging copy to its final location, keeping worktree links valid."""
+
+        if (source / ".git").is_file():
+            return self.move_worktree(source, destination)
+        shutil.move(str(source), str(destination))
+        return GitRepository(Repo(destination))
+
+    def tree_hash(self) -> str:
+        """Tree id of the working copy (tracked and untracked, minus ignored files).
+
+        Uses a scratch copy of the index so the real index is left untouched.
+        """
+
+        with tempfile.TemporaryDirectory() as scratch:
+            index = Path(scratch) / "index"
+            if Path(self.repo.index.path).exists():
+                shutil.copyfile(self.repo.index.path, index)
+            env = {"GIT_INDEX_FILE": str(index)}
+            self.repo.git.add("-A", env=env)
+            return self.repo.git.write_tree(env=env)
+
+    def root_commit(self) -> str:
+        """The first parentless commit reachable from HEAD; identifies the agent lineage."""
+
+        return self.repo.git.rev_list("--max-parents=0", "HEAD").splitlines()[0]
+
     @property
     def head(self) -> str:
         return self.repo.head.commit.hexsha
@@ -0,0 +1,266 @@
+"""Test impact analysis: run only the tests a staging change can affect."""
+
+from __future__ import annotations
+
+import ast
+import json
+import os
+import re
+import shutil
+import tempfile
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from .git_repo import GitRepository
+from .process import run_command
+
+MODULE = "<module>"
+HUNK = re.compile(r"^@@ -(\d+)(?:,\d+)? \+(\d+)(?:,\d+)? @@")
+# Changes to these never alter test outcomes; anything else non-Python forces a full run.
+INERT_FILES = {"metadata.json", ".gitignore"}
+INERT_SUFFIXES = {".md"}
+
+# test id -> source file -> qualified names of the functions it executed
+Coverage = Dict[str, Dict[str, List[str]]]
+
+
+@dataclass
+class ImpactPlan:
+    """Which tests a CI run should execute, and where it records coverage."""
+
+    tests: Optional[List[str]]  # None runs the whole file
+    reason: str
+    coverage_rc: Optional[Path] = None
+    parent: Optional[dict] = None
+    collected: Optional[Set[str]] = None
+    scratch: Optional[Path] = field(default=None, repr=False)
+
+
+def coverage_available() -> bool:
+    return shutil.which("coverage") is not None
+
+
+def _spans(source: str) -> List[Tuple[int, int, str]]:
+    """(first line, last line, qualname) of every function, decorators included."""
+
+    spans: List[Tuple[int, int, str]] = []
+
+    def visit(node: ast.AST, prefix: str) -> None:
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                name = f"{prefix}{child.name}"
+                if not isinstance(child, ast.ClassDef):
+                    first = min([child.lineno] + [d.lineno for d in child.decorator_list])
+                    spans.append((first, child.end_lineno or child.lineno, name))
+                visit(child, f"{name}.")
+
+    try:
+        visit(ast.parse(source), "")
+    except SyntaxError:
+        return []
+    return spans
+
+
+def _owner(spans: List[Tuple[int, int, str]], line: int) -> str:
+    """Innermost function enclosing `line`, or MODULE for top-level and class code."""
+
+    best: Optional[Tuple[int, int, str]] = None
+    for span in spans:
+        if span[0] <= line <= span[1] and (best is None or span[0] >= best[0]):
+            best = span
+    return best[2] if best else MODULE
+
+
+def _node_id(context: str, tests_file: str) -> Optional[str]:
+    """Map a coverage `test_function` context such as `tests.TestX.test_y` to a node id."""
+
+    module = Path(tests_file).stem + "."
+    if not context.startswith(module):
+        return None
+    return f"{tests_file}::" + context[len(module) :].replace(".", "::")
+
+
+def _changed_lines(repo: GitRepository) -> Iterator[Tuple[str, Set[int], Set[int]]]:
+    """Yield (path, removed lines, added lines) for each tracked file changed since HEAD.
+
+    Blank and comment-only lines are left out: they cannot change behaviour.
+    """
+
+    diff = repo.repo.git.diff("HEAD", "-U0", "--no-renames", "--no-color")
+    path: Optional[str] = None
+    old: Set[int] = set()
+    new: Set[int] = set()
+    old_no = new_no = 0
+    for line in diff.splitlines():
+        if line.startswith("diff --git "):
+            if path is not None:
+                yield path, old, new
+            path, old, new = line.split(" b/", 1)[-1], set(), set()
+        elif (match := HUNK.match(line)) is not None:
+            old_no, new_no = int(match.group(1)), int(match.group(2))
+        elif line.startswith(("---", "+++")) or line[:1] not in ("-", "+"):
+            continue
+        else:
+            meaningful = line[1:].strip() and not line[1:].strip().startswith("#")
+            if line[0] == "-":
+                old.update([old_no] if meaningful else [])
+                old_no += 1
+            else:
+                new.update([new_no] if meaningful else [])
+                new_no += 1
+    if path is not None:
+        yield path, old, new
+
+
+class ImpactAnalyzer:
+    """Plans test selection from per-test coverage stored for each committed version.
+
+    A successful full CI run records which functions every test executed; the
+    map is saved under `<directory>/<commit>.json`. For a later change, only
+    tests that executed a changed function (or any code of a file whose
+    module-level code changed), plus tests added since, are run. Every
+    `full_every`-th run in a lineage, or when the change touches non-Python
+    files, runs everything.
+
+    Selective runs are not recorded, so they keep pytest-xdist sharding and the
+    step cache. A test they ran may now execute different code than its map
+    says; it is marked stale and selected on every change until the next full
+    run records it again.
+    """
+
+    def __init__(self, directory: Path, *, full_every: int = 10, tests_file: str = "tests.py") -> None:
+        self.directory = directory
+        self.full_every = full_every
+        self.tests_file = tests_file
+
+    def load(self, commit: str) -> Optional[dict]:
+        try:
+            return json.loads((self.directory / f"{commit}.json").read_text())
+        except (OSError, ValueError):
+            return None
+
+    def save(self, commit: str, impact: dict) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / f"{commit}.json"
+        staged = path.with_name(f".{path.name}.{os.getpid()}")
+        staged.write_text(json.dumps(impact))
+        os.replace(staged, path)
+
+    def plan(self, base_commit: str, staging: GitRepository) -> ImpactPlan:
+        if not coverage_available():
+            return ImpactPlan(tests=None, reason="coverage not installed")
+        parent = self.load(base_commit)
+        plan = ImpactPlan(tests=None, reason="", parent=parent)
+        if parent is None:
+            plan.reason = "no coverage recorded for the parent version"
+        elif parent.get("selective_runs", 0) + 1 >= self.full_every:
+            plan.reason = f"periodic full run (every {self.full_every})"
+        else:
+            selected, plan.reason = self._select(parent["tests"], staging)
+            if selected is not None:
+                collected = self._collect(staging.worktree)
+                if collected is None:
+                    plan.reason = "test collection failed"
+                else:
+                    plan.collected = collected
+                    new = collected - set(parent["tests"])
+                    selected |= set(parent.get("stale", []))
+                    plan.tests = sorted((selected & collected) | new)
+                    plan.reason = f"{len(plan.tests)} of {len(collected)} tests affected"
+        if plan.tests is None:
+            # Only full runs record coverage; it rules out sharding and step caching.
+            plan.scratch = Path(tempfile.mkdtemp(prefix="stg-impact-"))
+            plan.coverage_rc = plan.scratch / "coveragerc"
+            plan.coverage_rc.write_text(
+                "[run]\ndynamic_context = test_function\nsource = .\n"
+                f"data_file = {plan.scratch / 'data'}\n"
+            )
+        return plan
+
+    def record(self, plan: ImpactPlan, workdir: Path) -> Optional[dict]:
+        """Build the coverage map for the tree CI just passed."""
+
+        recorded = self._read_coverage(plan, workdir) if plan.coverage_rc else None
+        if plan.tests is None:
+            # Without fresh coverage (e.g. a cached CI result) the parent's map is the best guess.
+            return {"tests": recorded, "selective_runs": 0} if recorded is not None else plan.parent
+        assert plan.parent is not None and plan.collected is not None
+        tests = {k: v for k, v in plan.parent["tests"].items() if k in plan.collected}
+        # Tests added since the last full run have no map yet and are always selected as new.
+        stale = (set(plan.parent.get("stale", [])) | set(plan.tests)) & set(tests)
+        return {
+            "tests": tests,
+            "stale": sorted(stale),
+            "selective_runs": plan.parent.get("selective_runs", 0) + 1,
+        }
+
+    def discard(self, plan: ImpactPlan) -> None:
+        if plan.scratch is not None:
+            shutil.rmtree(plan.scratch, ignore_errors=True)
+
+    def _select(self, coverage: Coverage, staging: GitRepository) -> Tuple[Optional[Set[str]], str]:
+        root = staging.worktree
+        changed = [(path, old, new) for path, old, new in _changed_lines(staging)]
+        # New modules only matter through the (changed) code that imports them.
+        changed += [(path, set(), set()) for path in staging.repo.untracked_files]
+        selected: Set[str] = set()
+        for path, old_lines, new_lines in changed:
+            name, suffix = Path(path).name, Path(path).suffix
+            if name in INERT_FILES or suffix in INERT_SUFFIXES:
+                continue
+            if suffix != ".py" or name == "conftest.py":
+                return None, f"{path} changed"
+            names: Set[str] = set()
+            if old_lines:
+                previous = staging.repo.git.show(f"HEAD:{path}")
+                names |= {_owner(_spans(previous), line) for line in old_lines}
+            if new_lines and (root / path).exists():
+                current = (root / path).read_text()
+                names |= {_owner(_spans(current), line) for line in new_lines}
+            if MODULE in names:
+                if path == self.tests_file:
+                    return None, f"module-level code of {path} changed"
+                selected |= {test for test, files in coverage.items() if path in files}
+                continue
+            selected |= {test for test, files in coverage.items() if names & set(files.get(path, ()))}
+            if path == self.tests_file:
+                selected |= {f"{path}::" + name.replace(".", "::") for name in names}
+        return selected, ""
+
+    def _collect(self, workdir: Path) -> Optional[Set[str]]:
+        pytest_bin = shutil.which("pytest")
+        if pytest_bin is None:
+            return None
+        result = run_command([pytest_bin, "--collect-only", "-q", self.tests_file], cwd=workdir)
+        if result.exit_code != 0:
+            return None
+        prefix = f"{self.tests_file}::"
+        return {line.split("[", 1)[0] for line in result.stdout.splitlines() if line.startswith(prefix)}
+
+    def _read_coverage(self, plan: ImpactPlan, workdir: Path) -> Optional[Coverage]:
+        assert plan.coverage_rc is not None and plan.scratch is not None
+        report = plan.scratch / "coverage.json"
+        coverage_bin = shutil.which("coverage")
+        if coverage_bin is None:
+            return None
+        result = run_command(
+            [coverage_bin, "json", f"--rcfile={plan.coverage_rc}", "--show-contexts", "-q", "-o", str(report)],
+            cwd=workdir,
+        )
+        if result.exit_code != 0 or not report.exists():
+            return None
+        coverage: Coverage = {}
+        for path, data in json.loads(report.read_text())["files"].items():
+            source = workdir / path
+            spans = _spans(source.read_text()) if source.exists() else []
+            for line, contexts in data.get("contexts", {}).items():
+                for context in contexts:
+                    test = _node_id(context, self.tests_file)
+                    if test is None:
+                        continue
+                    names = coverage.setdefault(test, {}).setdefault(path, [])
+                    name = _owner(spans, int(line))
+                    if name not in names:
+                        names.append(name)
+        return coverage
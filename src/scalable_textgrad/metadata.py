@@ -32,6 +32,7 @@ class VersionMetadata(BaseModel):
     changelog: Optional[str] = None
     notes: Optional[str] = None
     tags: List[str] = Field(default_factory=list)
+    codex_session: Optional[str] = None
 
     def bump(self, bump: VersionBump) -> str:
         """Return the new semantic version after applying `bump`."""
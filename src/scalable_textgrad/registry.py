@@ -2,14 +2,23 @@
 
 from __future__ import annotations
 
+import base64
 import json
-from datetime import datetime
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from bisect import bisect_left, insort
+from dataclasses import dataclass
+from datetime import datetime, timezone
 from pathlib import Path
 from threading import RLock
-from typing import Dict, Iterable, List, Optional
+from typing import Callable, Dict, Iterable, List, Mapping, Optional, Sequence, Set, Tuple
 
+from filelock import FileLock
 from pydantic import BaseModel, Field
 
+from .config import AgentSettings
 from .metadata import VersionMetadata
 
 
@@ -39,40 +48,501 @@ class VersionRecord(BaseModel):
     runner: Optional[ServiceEndpoint] = None
     tuner: Optional[ServiceEndpoint] = None
     architect: Optional[ServiceEndpoint] = None
+    replicas: Dict[str, List[ServiceEndpoint]] = Field(default_factory=dict)
 
     def update_from_metadata(self, metadata: VersionMetadata) -> None:
         self.version = metadata.version
         self.updated_at = datetime.utcnow()
 
+    def endpoints(self, component: str) -> List[ServiceEndpoint]:
+        """Return every replica registered for `component`.
 
-class VersionRegistry:
-    """Thread-safe registry persisted to a JSON file."""
+        `runner`/`tuner`/`architect` hold the most recently registered replica;
+        records written before replicas existed only have that field.
+        """
 
-    def __init__(self, storage_path: Path) -> None:
+        replicas = self.replicas.get(component)
+        if replicas:
+            return list(replicas)
+        endpoint = getattr(self, component, None)
+        return [endpoint] if isinstance(endpoint, ServiceEndpoint) else []
+
+    def is_serving(self) -> bool:
+        """Whether any component of this version has a registered endpoint."""
+
+        return any(self.endpoints(component) for component in COMPONENTS)
+
+
+COMPONENTS = ("runner", "tuner", "architect")
+
+
+def _apply_upsert(
+    record: VersionRecord,
+    version: str,
+    changelog_uri: Optional[str],
+    tags: Optional[Iterable[str]],
+) -> None:
+    record.version = version
+    record.updated_at = datetime.utcnow()
+    if changelog_uri:
+        record.changelog_uri = changelog_uri
+    if tags is not None:
+        record.tags = list(tags)
+
+
+def _apply_endpoint(record: VersionRecord, component: str, base_url: str) -> None:
+    if component not in COMPONENTS:
+        raise ValueError(f"Unknown component {component}")
+    endpoint = ServiceEndpoint(base_url=base_url, kind=component)
+    replicas = [item for item in record.endpoints(component) if item.base_url != base_url]
+    replicas.append(endpoint)
+    record.replicas[component] = replicas
+    setattr(record, component, endpoint)
+    record.updated_at = datetime.utcnow()
+
+
+HeartbeatKey = Tuple[str, str, str]
+
+
+def _touch_endpoint(record: VersionRecord, component: str, base_url: str, seen: datetime) -> bool:
+    target = base_url.rstrip("/")
+    touched = False
+    candidates = list(record.replicas.get(component, []))
+    legacy = getattr(record, component, None)
+    if isinstance(legacy, ServiceEndpoint):
+        candidates.append(legacy)
+    for endpoint in candidates:
+        if endpoint.base_url.rstrip("/") == target and endpoint.last_heartbeat < seen:
+            endpoint.last_heartbeat = seen
+            touched = True
+    return touched
+
+
+def _remove_endpoint(record: VersionRecord, component: str, base_url: str) -> bool:
+    if component not in COMPONENTS:
+        raise ValueError(f"Unknown component {component}")
+    current = record.endpoints(component)
+    replicas = [item for item in current if item.base_url != base_url]
+    if len(replicas) == len(current):
+        return False
+    record.replicas[component] = replicas
+    setattr(record, component, replicas[-1] if replicas else None)
+    record.updated_at = datetime.utcnow()
+    return True
+
+
+def _utc_naive(value: datetime) -> datetime:
+    """Normalise to the naive-UTC timestamps stored on records."""
+
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+Cursor = Tuple[datetime, str]
+
+
+def encode_cursor(record: VersionRecord) -> str:
+    raw = f"{record.created_at.isoformat()}|{record.commit_hash}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Cursor:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, commit_hash = base64.urlsafe_b64decode(padded).decode().split("|", 1)
+        return _utc_naive(datetime.fromisoformat(created_at)), commit_hash
+    except (ValueError, UnicodeDecodeError) as err:
+        raise ValueError(f"Invalid cursor {cursor!r}") from err
+
+
+RecordListener = Callable[[VersionRecord, Optional[str]], None]
+
+
+@dataclass
+class VersionPage:
+    records: List[VersionRecord]
+    next_cursor: Optional[str] = None
+
+
+class BaseVersionRegistry(ABC):
+    """Interface shared by registry implementations.
+
+    Listings are ordered newest first by `(created_at, commit_hash)`. `page_versions`
+    applies `since` and tag filters before pagination; when `cursor` is given it
+    continues after that position (keyset pagination) and `offset` is ignored.
+    """
+
+    def __init__(self) -> None:
+        self._listeners: List[RecordListener] = []
+
+    def subscribe(self, listener: RecordListener) -> None:
+        """Call `listener(record, previous_version)` after every change to a record."""
+
+        self._listeners.append(listener)
+
+    def _notify(self, record: VersionRecord, previous_version: Optional[str]) -> None:
+        for listener in self._listeners:
+            listener(record, previous_version)
+
+    def list_versions(self, limit: int = 50, offset: int = 0) -> List[VersionRecord]:
+        return self.page_versions(limit=limit, offset=offset).records
+
+    @abstractmethod
+    def page_versions(
+        self,
+        *,
+        limit: int = 50,
+        offset: int = 0,
+        since: Optional[datetime] = None,
+        tags: Optional[Sequence[str]] = None,
+        cursor: Optional[str] = None,
+    ) -> VersionPage:
+        """Return one page of records matching the filters."""
+
+    @abstractmethod
+    def upsert(
+        self,
+        *,
+        commit_hash: str,
+        version: str,
+        changelog_uri: Optional[str] = None,
+        tags: Optional[Iterable[str]] = None,
+    ) -> VersionRecord:
+        """Create or update the record for `commit_hash` and return it."""
+
+    @abstractmethod
+    def register_service(
+        self,
+        *,
+        commit_hash: str,
+        version: str,
+        component: str,
+        base_url: str,
+    ) -> VersionRecord:
+        """Add `base_url` as a replica of `component` and return the updated record."""
+
+    @abstractmethod
+    def deregister_service(
+        self, *, commit_hash: str, component: str, base_url: str
+    ) -> Optional[VersionRecord]:
+        """Remove one replica; return the updated record, or `None` if nothing changed."""
+
+    @abstractmethod
+    def record_heartbeats(self, beats: Mapping[HeartbeatKey, datetime]) -> int:
+        """Persist a batch of `(commit_hash, component, base_url) -> last_heartbeat`.
+
+        Heartbeats only affect liveness, so listeners are not notified. Returns the
+        number of records written.
+        """
+
+    @abstractmethod
+    def get_by_version(self, version: str) -> Optional[VersionRecord]:
+        """Return the newest record with `version`, if any."""
+
+    @abstractmethod
+    def list_by_version(self, version: str) -> List[VersionRecord]:
+        """Return every record sharing `version`, newest first."""
+
+    @abstractmethod
+    def get_by_commit(self, commit_hash: str) -> Optional[VersionRecord]:
+        """Return the record for `commit_hash`, if any."""
+
+    @abstractmethod
+    def count(self) -> int:
+        """Return the number of records."""
+
+    def close(self) -> None:
+        pass
+
+    @staticmethod
+    def _make_page(records: List[VersionRecord], limit: int) -> VersionPage:
+        next_cursor = encode_cursor(records[-1]) if records and len(records) == limit else None
+        return VersionPage(records=records, next_cursor=next_cursor)
+
+
+class RegistryStore(ABC):
+    """Persistence backend used by `VersionRegistry`."""
+
+    @abstractmethod
+    def load(self) -> List[VersionRecord]:
+        """Return every persisted record."""
+
+    @abstractmethod
+    def save(self, record: VersionRecord, records: Mapping[str, VersionRecord]) -> None:
+        """Persist `record`; `records` is the full in-memory view for stores that need it."""
+
+    def save_many(
+        self, changed: Sequence[VersionRecord], records: Mapping[str, VersionRecord]
+    ) -> None:
+        """Persist a batch of changed records."""
+
+        for record in changed:
+            self.save(record, records)
+
+    def close(self) -> None:
+        pass
+
+
+def _stage_snapshot(path: Path, records: Iterable[dict]) -> Path:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with tmp_path.open("w") as handle:
+        handle.write(json.dumps({"records": list(records)}, indent=2) + "\n")
+        handle.flush()
+        os.fsync(handle.fileno())
+    return tmp_path
+
+
+def _write_snapshot(path: Path, records: Iterable[dict]) -> None:
+    os.replace(_stage_snapshot(path, records), path)
+
+
+def _read_snapshot(path: Path) -> List[dict]:
+    if not path.exists():
+        return []
+    return list(json.loads(path.read_text()).get("records", []))
+
+
+class JsonFileStore(RegistryStore):
+    """Rewrites the whole registry file on every change."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+
+    def load(self) -> List[VersionRecord]:
+        if not self.path.exists():
+            _write_snapshot(self.path, [])
+            return []
+        return [VersionRecord(**entry) for entry in _read_snapshot(self.path)]
+
+    def save(self, record: VersionRecord, records: Mapping[str, VersionRecord]) -> None:
+        _write_snapshot(self.path, (item.model_dump(mode="json") for item in records.values()))
+
+    def save_many(
+        self, changed: Sequence[VersionRecord], records: Mapping[str, VersionRecord]
+    ) -> None:
+        # One rewrite covers the whole batch.
+        if changed:
+            self.save(changed[-1], records)
+
+
+class JournalStore(RegistryStore):
+    """Append-only journal of record changes, compacted into a JSON snapshot.
+
+    Each change appends the full record as one JSON line to `<path>.journal`, so a
+    write costs O(record) instead of O(registry). Once `compact_every` entries have
+    accumulated, the journal is rotated to `<path>.journal.compacting` and a
+    background thread folds it into the snapshot at `<path>`. Entries are
+    idempotent upserts keyed by commit hash, so replaying snapshot + rotated
+    journal + live journal after a crash at any point yields the same records.
+    """
+
+    def __init__(self, path: Path, *, compact_every: int = 1000, background: bool = True) -> None:
+        self.path = path
+        self.journal_path = path.with_name(f"{path.name}.journal")
+        self.compacting_path = path.with_name(f"{path.name}.journal.compacting")
+        self.compact_every = compact_every
+        self.background = background
+        self._file_lock = FileLock(str(path.with_name(f"{path.name}.lock")))
+        self._pending = 0
+        self._compactor: Optional[threading.Thread] = None
+
+    def load(self) -> List[VersionRecord]:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._file_lock:
+            if not self.path.exists():
+                _write_snapshot(self.path, [])
+            entries: Dict[str, dict] = {}
+            for entry in _read_snapshot(self.path):
+                entries[entry["commit_hash"]] = entry
+            for journal in (self.compacting_path, self.journal_path):
+                for entry in self._replay(journal):
+                    entries[entry["commit_hash"]] = entry
+        self._pending = self._count_lines(self.journal_path)
+        return [VersionRecord(**entry) for entry in entries.values()]
+
+    def save(self, record: VersionRecord, records: Mapping[str, VersionRecord]) -> None:
+        self.save_many([record], records)
+
+    def save_many(
+        self, changed: Sequence[VersionRecord], records: Mapping[str, VersionRecord]
+    ) -> None:
+        lines = "".join(
+            json.dumps({"op": "put", "record": record.model_dump(mode="json")}) + "\n"
+            for record in changed
+        )
+        if not lines:
+            return
+        with self._file_lock:
+            with self.journal_path.open("a") as handle:
+                handle.write(lines)
+        self._pending += len(changed)
+        if self._pending >= self.compact_every:
+            self._schedule_compaction()
+
+    def compact(self) -> None:
+        """Fold all journal entries into the snapshot synchronously."""
+
+        self.wait()
+        if self._rotate():
+            self._fold()
+
+    def wait(self) -> None:
+        compactor = self._compactor
+        if compactor is not None:
+            compactor.join()
+
+    def close(self) -> None:
+        self.wait()
+
+    def _schedule_compaction(self) -> None:
+        if self._compactor is not None and self._compactor.is_alive():
+            return
+        if not self._rotate():
+            return
+        if not self.background:
+            self._fold()
+            return
+        self._compactor = threading.Thread(
+            target=self._fold, name="registry-compactor", daemon=True
+        )
+        self._compactor.start()
+
+    def _rotate(self) -> bool:
+        with self._file_lock:
+            if self.compacting_path.exists() or not self.journal_path.exists():
+                return False
+            os.replace(self.journal_path, self.compacting_path)
+        self._pending = 0
+        return True
+
+    def _fold(self) -> None:
+        # Only the thread that rotated the journal folds it, so the snapshot and the
+        # rotated journal can be read without the lock; only the swap must be atomic
+        # with respect to concurrent loads.
+        entries: Dict[str, dict] = {}
+        for entry in _read_snapshot(self.path):
+            entries[entry["commit_hash"]] = entry
+        for entry in self._replay(self.compacting_path):
+            entries[entry["commit_hash"]] = entry
+        staged = _stage_snapshot(self.path, entries.values())
+        with self._file_lock:
+            os.replace(staged, self.path)
+            self.compacting_path.unlink(missing_ok=True)
+
+    @staticmethod
+    def _replay(path: Path) -> Iterable[dict]:
+        if not path.exists():
+            return []
+        entries: List[dict] = []
+        good_offset = 0
+        with path.open("rb") as handle:
+            for raw in handle:
+                if not raw.endswith(b"\n"):
+                    break
+                try:
+                    entry = json.loads(raw)
+                except json.JSONDecodeError:
+                    break
+                good_offset += len(raw)
+                if entry.get("op") == "put":
+                    entries.append(entry["record"])
+        if good_offset != path.stat().st_size:
+            # Drop a torn tail left by a crash mid-append so later appends stay parseable.
+            with path.open("r+b") as handle:
+                handle.truncate(good_offset)
+        return entries
+
+    @staticmethod
+    def _count_lines(path: Path) -> int:
+        if not path.exists():
+            return 0
+        with path.open("rb") as handle:
+            return sum(1 for _ in handle)
+
+
+def _sort_key(record: VersionRecord) -> Cursor:
+    return record.created_at, record.commit_hash
+
+
+class VersionRegistry(BaseVersionRegistry):
+    """Thread-safe in-memory registry persisted through a pluggable `RegistryStore`.
+
+    Besides the commit-hash map, the registry keeps secondary indexes that are
+    updated incrementally on every write: version -> commit hashes (several
+    branches may share a semver), and `(created_at, commit_hash)` keys kept sorted
+    with `bisect`, both globally and per tag. Lookups and page queries therefore
+    avoid scanning or re-sorting the whole registry.
+    """
+
+    def __init__(self, storage_path: Path, *, store: Optional[RegistryStore] = None) -> None:
+        super().__init__()
         self.storage_path = storage_path
+        self.store = store or JournalStore(storage_path)
         self._lock = RLock()
         self._records: Dict[str, VersionRecord] = {}
+        self._by_version: Dict[str, Set[str]] = {}
+        self._by_tag: Dict[str, List[Cursor]] = {}
+        self._order: List[Cursor] = []
         self._load()
 
     def _load(self) -> None:
-        if not self.storage_path.exists():
-            self.storage_path.parent.mkdir(parents=True, exist_ok=True)
-            self.storage_path.write_text(json.dumps({"records": []}, indent=2) + "\n")
-            return
-        data = json.loads(self.storage_path.read_text())
-        for entry in data.get("records", []):
-            record = VersionRecord(**entry)
+        for record in self.store.load():
             self._records[record.commit_hash] = record
+        for record in self._records.values():
+            self._by_version.setdefault(record.version, set()).add(record.commit_hash)
+            for tag in set(record.tags):
+                self._by_tag.setdefault(tag, []).append(_sort_key(record))
+        for keys in self._by_tag.values():
+            keys.sort()
+        self._order = sorted(_sort_key(record) for record in self._records.values())
 
-    def _flush(self) -> None:
-        payload = {"records": [record.model_dump(mode="json") for record in self._records.values()]}
-        self.storage_path.parent.mkdir(parents=True, exist_ok=True)
-        self.storage_path.write_text(json.dumps(payload, indent=2) + "\n")
+    def _flush(self, record: VersionRecord) -> None:
+        self.store.save(record, self._records)
 
-    def list_versions(self, limit: int = 50, offset: int = 0) -> List[VersionRecord]:
+    def close(self) -> None:
         with self._lock:
-            records = sorted(self._records.values(), key=lambda r: r.created_at, reverse=True)
-            return records[offset : offset + limit]
+            self.store.close()
+
+    def page_versions(
+        self,
+        *,
+        limit: int = 50,
+        offset: int = 0,
+        since: Optional[datetime] = None,
+        tags: Optional[Sequence[str]] = None,
+        cursor: Optional[str] = None,
+    ) -> VersionPage:
+        position = decode_cursor(cursor) if cursor else None
+        if position:
+            offset = 0
+        wanted = set(tags or ())
+        with self._lock:
+            keys = self._order
+            if wanted:
+                # Walk the smallest tag index and check the remaining tags per record.
+                keys = min((self._by_tag.get(tag, []) for tag in wanted), key=len)
+            lo = bisect_left(keys, (_utc_naive(since), "")) if since else 0
+            hi = bisect_left(keys, position) if position else len(keys)
+            if len(wanted) <= 1:
+                start = max(hi - offset - limit, lo)
+                stop = max(hi - offset, lo)
+                selected = [commit_hash for _, commit_hash in reversed(keys[start:stop])]
+            else:
+                selected = []
+                for idx in range(hi - 1, lo - 1, -1):
+                    commit_hash = keys[idx][1]
+                    if not wanted.issubset(self._records[commit_hash].tags):
+                        continue
+                    if offset:
+                        offset -= 1
+                        continue
+                    selected.append(commit_hash)
+                    if len(selected) == limit:
+                        break
+            records = [self._records[commit_hash] for commit_hash in selected]
+        return self._make_page(records, limit)
 
     def upsert(
         self,
@@ -86,14 +556,12 @@ class VersionRegistry:
             record = self._records.get(commit_hash)
             if not record:
                 record = VersionRecord(version=version, commit_hash=commit_hash)
-            record.version = version
-            record.updated_at = datetime.utcnow()
-            if changelog_uri:
-                record.changelog_uri = changelog_uri
-            if tags is not None:
-                record.tags = list(tags)
-            self._records[commit_hash] = record
-            self._flush()
+            previous = self._unindex(record)
+            previous_version = previous.version if previous else None
+            _apply_upsert(record, version, changelog_uri, tags)
+            self._index(record, previous)
+            self._flush(record)
+            self._notify(record, previous_version)
             return record
 
     def register_service(
@@ -108,26 +576,84 @@ class VersionRegistry:
             record = self._records.get(commit_hash)
             if not record:
                 record = VersionRecord(version=version, commit_hash=commit_hash)
-            endpoint = ServiceEndpoint(base_url=base_url, kind=component)
-            if component == "runner":
-                record.runner = endpoint
-            elif component == "tuner":
-                record.tuner = endpoint
-            elif component == "architect":
-                record.architect = endpoint
-            else:
-                raise ValueError(f"Unknown component {component}")
-            record.updated_at = datetime.utcnow()
-            self._records[commit_hash] = record
-            self._flush()
+            previous = self._unindex(record)
+            previous_version = previous.version if previous else None
+            _apply_endpoint(record, component, base_url)
+            self._index(record, previous)
+            self._flush(record)
+            self._notify(record, previous_version)
             return record
 
-    def get_by_version(self, version: str) -> Optional[VersionRecord]:
+    def deregister_service(
+        self, *, commit_hash: str, component: str, base_url: str
+    ) -> Optional[VersionRecord]:
         with self._lock:
-            for record in self._records.values():
-                if record.version == version:
-                    return record
+            record = self._records.get(commit_hash)
+            if record is None or not _remove_endpoint(record, component, base_url):
+                return None
+            self._flush(record)
+            self._notify(record, record.version)
+            return record
+
+    def record_heartbeats(self, beats: Mapping[HeartbeatKey, datetime]) -> int:
+        with self._lock:
+            touched: Dict[str, VersionRecord] = {}
+            for (commit_hash, component, base_url), seen in beats.items():
+                record = self._records.get(commit_hash)
+                if record and _touch_endpoint(record, component, base_url, seen):
+                    touched[commit_hash] = record
+            self.store.save_many(list(touched.values()), self._records)
+            return len(touched)
+
+    def _unindex(self, record: VersionRecord) -> Optional[VersionRecord]:
+        """Drop `record` from the version/tag indexes and return its stored form, if any."""
+
+        stored = self._records.get(record.commit_hash)
+        if stored is None:
             return None
+        self._discard(self._by_version, stored.version, stored.commit_hash)
+        key = _sort_key(stored)
+        for tag in set(stored.tags):
+            keys = self._by_tag.get(tag)
+            if keys is None:
+                continue
+            idx = bisect_left(keys, key)
+            if idx < len(keys) and keys[idx] == key:
+                del keys[idx]
+            if not keys:
+                del self._by_tag[tag]
+        return stored
+
+    def _index(self, record: VersionRecord, previous: Optional[VersionRecord]) -> None:
+        if previous is None:
+            insort(self._order, _sort_key(record))
+        self._records[record.commit_hash] = record
+        self._by_version.setdefault(record.version, set()).add(record.commit_hash)
+        for tag in set(record.tags):
+            insort(self._by_tag.setdefault(tag, []), _sort_key(record))
+
+    @staticmethod
+    def _discard(index: Dict[str, Set[str]], key: str, commit_hash: str) -> None:
+        members = index.get(key)
+        if members is None:
+            return
+        members.discard(commit_hash)
+        if not members:
+            del index[key]
+
+    def get_by_version(self, version: str) -> Optional[VersionRecord]:
+        """Return the newest record carrying `version`."""
+
+        with self._lock:
+            commits = self._by_version.get(version)
+            if not commits:
+                return None
+            return max((self._records[commit] for commit in commits), key=_sort_key)
+
+    def list_by_version(self, version: str) -> List[VersionRecord]:
+        with self._lock:
+            records = [self._records[commit] for commit in self._by_version.get(version, ())]
+        return sorted(records, key=_sort_key, reverse=True)
 
     def get_by_commit(self, commit_hash: str) -> Optional[VersionRecord]:
         with self._lock:
@@ -136,3 +662,202 @@ class VersionRegistry:
     def count(self) -> int:
         with self._lock:
             return len(self._records)
+
+
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS versions (
+    commit_hash TEXT PRIMARY KEY,
+    version TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    payload TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS versions_version ON versions (version);
+CREATE INDEX IF NOT EXISTS versions_created ON versions (created_at DESC, commit_hash DESC);
+CREATE TABLE IF NOT EXISTS version_tags (
+    tag TEXT NOT NULL,
+    commit_hash TEXT NOT NULL,
+    PRIMARY KEY (tag, commit_hash)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS version_tags_commit ON version_tags (commit_hash);
+"""
+
+
+def _sql_timestamp(value: datetime) -> str:
+    # Fixed-width so lexical order in SQLite matches chronological order.
+    return _utc_naive(value).strftime("%Y-%m-%dT%H:%M:%S.%f")
+
+
+class SqliteVersionRegistry(BaseVersionRegistry):
+    """Registry stored in SQLite; queries run against indexes instead of loading all records."""
+
+    def __init__(self, storage_path: Path) -> None:
+        super().__init__()
+        self.storage_path = storage_path
+        storage_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = RLock()
+        self._conn = sqlite3.connect(str(storage_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SQLITE_SCHEMA)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def page_versions(
+        self,
+        *,
+        limit: int = 50,
+        offset: int = 0,
+        since: Optional[datetime] = None,
+        tags: Optional[Sequence[str]] = None,
+        cursor: Optional[str] = None,
+    ) -> VersionPage:
+        clauses: List[str] = []
+        params: List[object] = []
+        if since:
+            clauses.append("v.created_at >= ?")
+            params.append(_sql_timestamp(since))
+        for tag in dict.fromkeys(tags or ()):
+            clauses.append(
+                "EXISTS (SELECT 1 FROM version_tags t WHERE t.tag = ? AND t.commit_hash = v.commit_hash)"
+            )
+            params.append(tag)
+        if cursor:
+            created_at, commit_hash = decode_cursor(cursor)
+            clauses.append("(v.created_at, v.commit_hash) < (?, ?)")
+            params.extend([_sql_timestamp(created_at), commit_hash])
+            offset = 0
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        query = (
+            f"SELECT v.payload FROM versions v {where} "
+            "ORDER BY v.created_at DESC, v.commit_hash DESC LIMIT ? OFFSET ?"
+        )
+        params.extend([limit, offset])
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        records = [VersionRecord.model_validate_json(row[0]) for row in rows]
+        return self._make_page(records, limit)
+
+    def upsert(
+        self,
+        *,
+        commit_hash: str,
+        version: str,
+        changelog_uri: Optional[str] = None,
+        tags: Optional[Iterable[str]] = None,
+    ) -> VersionRecord:
+        with self._lock:
+            record = self.get_by_commit(commit_hash)
+            previous_version = record.version if record else None
+            if not record:
+                record = VersionRecord(version=version, commit_hash=commit_hash)
+            _apply_upsert(record, version, changelog_uri, tags)
+            self._save(record, update_tags=tags is not None)
+            self._notify(record, previous_version)
+            return record
+
+    def register_service(
+        self,
+        *,
+        commit_hash: str,
+        version: str,
+        component: str,
+        base_url: str,
+    ) -> VersionRecord:
+        with self._lock:
+            record = self.get_by_commit(commit_hash)
+            previous_version = record.version if record else None
+            if not record:
+                record = VersionRecord(version=version, commit_hash=commit_hash)
+            _apply_endpoint(record, component, base_url)
+            self._save(record, update_tags=previous_version is None)
+            self._notify(record, previous_version)
+            return record
+
+    def deregister_service(
+        self, *, commit_hash: str, component: str, base_url: str
+    ) -> Optional[VersionRecord]:
+        with self._lock:
+            record = self.get_by_commit(commit_hash)
+            if record is None or not _remove_endpoint(record, component, base_url):
+                return None
+            self._save(record, update_tags=False)
+            self._notify(record, record.version)
+            return record
+
+    def record_heartbeats(self, beats: Mapping[HeartbeatKey, datetime]) -> int:
+        with self._lock:
+            touched: Dict[str, VersionRecord] = {}
+            for (commit_hash, component, base_url), seen in beats.items():
+                record = touched.get(commit_hash) or self.get_by_commit(commit_hash)
+                if record and _touch_endpoint(record, component, base_url, seen):
+                    touched[commit_hash] = record
+            with self._conn:
+                for record in touched.values():
+                    self._write(record, update_tags=False)
+            return len(touched)
+
+    def get_by_version(self, version: str) -> Optional[VersionRecord]:
+        return self._fetch_one(
+            "SELECT payload FROM versions WHERE version = ? "
+            "ORDER BY created_at DESC, commit_hash DESC LIMIT 1",
+            (version,),
+        )
+
+    def list_by_version(self, version: str) -> List[VersionRecord]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT payload FROM versions WHERE version = ? "
+                "ORDER BY created_at DESC, commit_hash DESC",
+                (version,),
+            ).fetchall()
+        return [VersionRecord.model_validate_json(row[0]) for row in rows]
+
+    def get_by_commit(self, commit_hash: str) -> Optional[VersionRecord]:
+        return self._fetch_one("SELECT payload FROM versions WHERE commit_hash = ?", (commit_hash,))
+
+    def count(self) -> int:
+        with self._lock:
+            return int(self._conn.execute("SELECT COUNT(*) FROM versions").fetchone()[0])
+
+    def _fetch_one(self, query: str, params: Sequence[object]) -> Optional[VersionRecord]:
+        with self._lock:
+            row = self._conn.execute(query, params).fetchone()
+        return VersionRecord.model_validate_json(row[0]) if row else None
+
+    def _save(self, record: VersionRecord, *, update_tags: bool) -> None:
+        with self._conn:
+            self._write(record, update_tags=update_tags)
+
+    def _write(self, record: VersionRecord, *, update_tags: bool) -> None:
+        self._conn.execute(
+            "INSERT OR REPLACE INTO versions (commit_hash, version, created_at, payload) "
+            "VALUES (?, ?, ?, ?)",
+            (
+                record.commit_hash,
+                record.version,
+                _sql_timestamp(record.created_at),
+                record.model_dump_json(),
+            ),
+        )
+        if update_tags:
+            self._conn.execute("DELETE FROM version_tags WHERE commit_hash = ?", (record.commit_hash,))
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO version_tags (tag, commit_hash) VALUES (?, ?)",
+                [(tag, record.commit_hash) for tag in record.tags],
+            )
+
+
+def open_registry(settings: AgentSettings) -> BaseVersionRegistry:
+    """Open the registry at `settings.registry_file` with the configured backend."""
+
+    path = settings.registry_file
+    if settings.registry_backend == "json":
+        return VersionRegistry(path, store=JsonFileStore(path))
+    if settings.registry_backend == "journal":
+        store = JournalStore(path, compact_every=settings.registry_compact_every)
+        return VersionRegistry(path, store=store)
+    if settings.registry_backend == "sqlite":
+        return SqliteVersionRegistry(path.with_suffix(".sqlite3"))
+    raise ValueError(f"Unknown registry backend {settings.registry_backend}")
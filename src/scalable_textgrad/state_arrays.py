@@ -0,0 +1,187 @@
+"""Binary sidecar arrays for state: NumPy `.npy` files memory-mapped read-only.
+
+Files are written without NumPy. Readers get `numpy.memmap` arrays when NumPy
+is installed (the `numpy` extra) and otherwise zero-copy, read-only
+`memoryview`s shaped like the array.
+"""
+
+from __future__ import annotations
+
+import ast
+import hashlib
+import importlib.util
+import mmap
+import os
+import struct
+import sys
+import time
+from collections.abc import Mapping
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Set, Tuple
+from uuid import uuid4
+
+MAGIC = b"\x93NUMPY"
+
+# memoryview format -> NumPy descr (native little-endian layouts only).
+_DESCRS = {
+    "?": "|b1", "b": "|i1", "B": "|u1", "h": "<i2", "H": "<u2", "i": "<i4", "I": "<u4",
+    "q": "<i8", "Q": "<u8", "e": "<f2", "f": "<f4", "d": "<f8",
+    # C long is 4 bytes on Windows and 8 on most 64-bit Unix platforms.
+    "l": f"<i{struct.calcsize('l')}", "L": f"<u{struct.calcsize('L')}",
+}
+_FORMATS = {descr: fmt for fmt, descr in _DESCRS.items() if fmt not in "lL"}
+
+
+class ArrayFormatError(ValueError):
+    pass
+
+
+def numpy_available() -> bool:
+    return importlib.util.find_spec("numpy") is not None
+
+
+def encode_npy(value: Any) -> Tuple[bytes, bytes, Dict[str, Any]]:
+    """Header, data and description (`dtype`, `shape`) of a C-contiguous buffer."""
+
+    view = memoryview(value)
+    if not view.c_contiguous:
+        raise ArrayFormatError("Arrays must be C-contiguous")
+    fmt = view.format.lstrip("@=<")
+    descr = _DESCRS.get(fmt)
+    if descr is None or (sys.byteorder != "little" and descr[0] == "<"):
+        raise ArrayFormatError(f"Unsupported array format {view.format!r}")
+    shape = list(view.shape or ())
+    header = f"{{'descr': '{descr}', 'fortran_order': False, 'shape': {tuple(shape)!r}, }}"
+    # Pad so the data starts on a 64-byte boundary, as NumPy does.
+    size = len(MAGIC) + 4 + len(header) + 1
+    header += " " * (-size % 64) + "\n"
+    prefix = MAGIC + bytes([1, 0]) + struct.pack("<H", len(header)) + header.encode("latin1")
+    return prefix, view.cast("B").tobytes(), {"dtype": descr, "shape": shape}
+
+
+def write_npy(directory: Path, value: Any, *, fsync: bool = True) -> Dict[str, Any]:
+    """Store `value` as `<sha256>.npy` in `directory` (once) and return its reference."""
+
+    prefix, data, ref = encode_npy(value)
+    digest = hashlib.sha256(prefix)
+    digest.update(data)
+    ref["sha256"] = digest.hexdigest()
+    path = directory / f"{ref['sha256']}.npy"
+    if path.exists():
+        _unref_marker(path).unlink(missing_ok=True)  # referenced again
+        return ref
+    directory.mkdir(parents=True, exist_ok=True)
+    temp = directory / f".{ref['sha256']}.{uuid4().hex}.tmp"
+    try:
+        with temp.open("wb") as handle:
+            handle.write(prefix)
+            handle.write(data)
+            handle.flush()
+            if fsync:
+                os.fsync(handle.fileno())
+        os.chmod(temp, 0o444)
+        os.replace(temp, path)
+    except BaseException:
+        temp.unlink(missing_ok=True)
+        raise
+    return ref
+
+
+def retain(directory: Path, ref: Dict[str, Any]) -> bool:
+    """Mark the file of `ref` as referenced again; False if a sweep already deleted it."""
+
+    path = directory / f"{ref['sha256']}.npy"
+    _unref_marker(path).unlink(missing_ok=True)
+    return path.exists()
+
+
+def open_npy(path: Path) -> Any:
+    """Memory-map an `.npy` file read-only."""
+
+    if numpy_available():
+        import numpy
+
+        return numpy.load(path, mmap_mode="r")
+    with path.open("rb") as handle:
+        mapped = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)
+    if bytes(view[:6]) != MAGIC:
+        raise ArrayFormatError(f"{path} is not an .npy file")
+    major = view[6]
+    if major == 1:
+        (length,) = struct.unpack_from("<H", view, 8)
+        offset = 10
+    else:
+        (length,) = struct.unpack_from("<I", view, 8)
+        offset = 12
+    header = ast.literal_eval(bytes(view[offset : offset + length]).decode("latin1"))
+    if header.get("fortran_order"):
+        raise ArrayFormatError(f"{path}: Fortran-ordered arrays need NumPy")
+    fmt = _FORMATS.get(header["descr"])
+    if fmt is None:
+        raise ArrayFormatError(f"{path}: dtype {header['descr']} needs NumPy")
+    shape: List[int] = list(header["shape"])
+    data = view[offset + length :]
+    if not shape:
+        return data.cast(fmt)[0]
+    if 0 in shape:
+        return data[:0].cast(fmt)
+    return data.cast(fmt, shape)
+
+
+class MappedArrays(Mapping):
+    """Arrays referenced by a state document, memory-mapped on first access."""
+
+    def __init__(self, directory: Path, refs: Dict[str, Dict[str, Any]]) -> None:
+        self.directory = directory
+        self.refs = refs
+        self._opened: Dict[str, Any] = {}
+
+    def __getitem__(self, name: str) -> Any:
+        if name not in self._opened:
+            self._opened[name] = open_npy(self.directory / f"{self.refs[name]['sha256']}.npy")
+        return self._opened[name]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.refs)
+
+    def __len__(self) -> int:
+        return len(self.refs)
+
+
+def _unref_marker(path: Path) -> Path:
+    return path.with_name(f".{path.stem}.unref")
+
+
+def collect(directory: Path, referenced: Set[str], *, grace: float) -> List[str]:
+    """Delete array files unreferenced for at least `grace` seconds; returns their names.
+
+    The first sweep that finds a file unreferenced leaves a `.<sha256>.unref`
+    marker recording when; the file is deleted once the marker is `grace`
+    seconds old. This lets a reader that loaded a state document just before it
+    was replaced still open the arrays it references, however long they had
+    been in use. Mapped files stay readable after deletion.
+    """
+
+    removed: List[str] = []
+    if not directory.exists():
+        return removed
+    now = time.time()
+    for path in directory.glob("*.npy"):
+        marker = _unref_marker(path)
+        if path.stem in referenced:
+            marker.unlink(missing_ok=True)
+            continue
+        try:
+            since = marker.stat().st_mtime
+        except FileNotFoundError:
+            marker.touch()
+            since = now
+        if now - since >= grace:
+            path.unlink(missing_ok=True)
+            marker.unlink(missing_ok=True)
+            removed.append(path.name)
+    for marker in directory.glob(".*.unref"):
+        if not marker.with_name(f"{marker.name[1:-len('.unref')]}.npy").exists():
+            marker.unlink(missing_ok=True)
+    return removed
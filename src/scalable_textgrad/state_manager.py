@@ -2,18 +2,45 @@
 
 from __future__ import annotations
 
+import asyncio
+import copy
 import json
+import logging
+import os
+import threading
+from collections.abc import Mapping, Sequence
 from contextlib import contextmanager
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Any, Dict, Literal, Optional
+from typing import (
+    Any,
+    AsyncIterator,
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Literal,
+    Optional,
+    Set,
+    Tuple,
+)
 from uuid import uuid4
 
 from filelock import FileLock
-from jsonschema import Draft202012Validator
+from jsonschema import Draft202012Validator, ValidationError
 
 from .config import AgentDirectories
+from .state_arrays import MappedArrays, collect, retain, write_npy
+from .state_patch import Patch, PatchError, Pointer, apply_patch, outermost, resolve
+from .state_watch import InotifyWatcher, inotify_available
 
 StateTarget = Literal["active", "staging"]
+StateCallback = Callable[[str, "StateSnapshot"], None]
+# "always": fsync every write before returning; "group": concurrent writers in
+# this process share one fsync per batch; "none": atomic but not durable.
+Durability = Literal["always", "group", "none"]
 
 
 class StateDocument(dict):
@@ -35,16 +62,365 @@ class StateDocument(dict):
             self["data"] = data
         return data
 
+    @property
+    def array_refs(self) -> Dict[str, Dict[str, Any]]:
+        """Sidecar arrays by name: `{"sha256", "dtype", "shape"}` of each `.npy` file."""
+
+        return self.get("arrays") or {}
+
 
 class StateValidationError(RuntimeError):
     pass
 
 
+class FrozenMapping(Mapping):
+    """Read-only view of a JSON object; nested containers are wrapped as they are accessed."""
+
+    __slots__ = ("_data",)
+
+    def __init__(self, data: Dict[str, Any]) -> None:
+        self._data = data
+
+    def __getitem__(self, key: str) -> Any:
+        return _frozen(self._data[key])
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._data)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __repr__(self) -> str:
+        return f"FrozenMapping({self._data!r})"
+
+    def thaw(self) -> Dict[str, Any]:
+        """A mutable deep copy."""
+
+        return copy.deepcopy(self._data)
+
+
+class FrozenSequence(Sequence):
+    """Read-only view of a JSON array."""
+
+    __slots__ = ("_data",)
+
+    def __init__(self, data: List[Any]) -> None:
+        self._data = data
+
+    def __getitem__(self, index: Any) -> Any:
+        if isinstance(index, slice):
+            return FrozenSequence(self._data[index])
+        return _frozen(self._data[index])
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, (list, tuple, FrozenSequence)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"FrozenSequence({self._data!r})"
+
+    def thaw(self) -> List[Any]:
+        return copy.deepcopy(self._data)
+
+
+def _frozen(value: Any) -> Any:
+    if isinstance(value, dict):
+        return FrozenMapping(value)
+    if isinstance(value, list):
+        return FrozenSequence(value)
+    return value
+
+
+@dataclass(frozen=True)
+class StateSnapshot:
+    """Immutable state shared by every reader in the process until the state changes."""
+
+    token: str
+    payload: FrozenMapping
+    arrays: Mapping = field(default_factory=dict)
+
+
+# Keywords that only constrain a schema's own members one by one, or how many
+# members it has. A change inside an existing member can then be validated
+# against that member's subschema alone (changes adding or removing members are
+# reported at the container itself).
+_LOCAL_KEYWORDS = frozenset(
+    {
+        "type", "properties", "additionalProperties", "items", "required",
+        "minProperties", "maxProperties", "propertyNames", "dependentRequired",
+        "minItems", "maxItems", "title", "description", "default", "examples",
+        "deprecated", "readOnly", "writeOnly", "$comment", "$schema", "$defs",
+        "definitions",
+    }
+)
+
+
+def _anchor(schema: Any, tokens: Pointer) -> Tuple[int, Any]:
+    """Deepest prefix of `tokens` whose subschema can validate a change there on its own."""
+
+    node = schema
+    for depth, token in enumerate(tokens):
+        if not isinstance(node, dict) or set(node) - _LOCAL_KEYWORDS:
+            return depth, node
+        properties = node.get("properties", {})
+        if token in properties:
+            node = properties[token]
+        elif isinstance(node.get("items"), dict) and token.isdigit():
+            node = node["items"]
+        elif "additionalProperties" in node:
+            if node["additionalProperties"] is False:
+                return depth, node
+            node = node["additionalProperties"]
+        else:
+            return len(tokens), True
+    return len(tokens), node
+
+
+def _fsync(path: Path) -> None:
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return  # replaced or compacted away; its contents were synced then
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class _GroupSync:
+    """Coalesces the fsyncs requested by concurrent writers.
+
+    A writer whose request arrives while a flush is in progress waits for the
+    next one, which one of the waiting writers performs on behalf of all of them.
+    """
+
+    def __init__(self) -> None:
+        self._cond = threading.Condition()
+        self._paths: Set[Path] = set()
+        self._requested = 0
+        self._synced = 0
+        self._flushing = False
+        # First ticket of each failed batch -> (last ticket, error, writers yet to see it).
+        self._failed: Dict[int, Tuple[int, BaseException, int]] = {}
+        self.flushes = 0
+
+    def sync(self, path: Path) -> None:
+        with self._cond:
+            self._requested += 1
+            ticket = self._requested
+            self._paths.add(path)
+            while self._synced < ticket:
+                if self._flushing:
+                    self._cond.wait()
+                    continue
+                self._flushing = True
+                first, batch, paths = self._synced + 1, self._requested, self._paths
+                self._paths = set()
+                self._cond.release()
+                error: Optional[BaseException] = None
+                try:
+                    for item in paths:
+                        _fsync(item)
+                except OSError as err:
+                    error = err
+                finally:
+                    self._cond.acquire()
+                    self._flushing = False
+                    self._synced = batch
+                    self.flushes += 1
+                    if error is not None:
+                        self._failed[first] = (batch, error, batch - first + 1)
+                    self._cond.notify_all()
+            for first, (last, error, unseen) in list(self._failed.items()):
+                if first <= ticket <= last:
+                    if unseen > 1:
+                        self._failed[first] = (last, error, unseen - 1)
+                    else:
+                        del self._failed[first]
+                    raise error
+
+
+_GROUP_SYNC = _GroupSync()
+
+
+@dataclass
+class _View:
+    """A state document materialized from its file plus the applied part of its op log.
+
+    Views are shared by all managers in the process and never modified in
+    place: a change replaces `doc`, so readers holding the old one are safe.
+    """
+
+    signature: Optional[Tuple[int, int, int]] = None
+    offset: int = 0
+    entries: int = 0
+    doc: Optional[StateDocument] = None
+    snapshot: Optional[StateSnapshot] = None
+    generation: Optional[int] = None
+    guard: threading.Lock = field(default_factory=threading.Lock)
+
+
+_VIEWS: Dict[Path, _View] = {}
+_VIEWS_GUARD = threading.Lock()
+
+
+class _DirectoryWatch:
+    """Counts inotify change batches for one state directory and fans them out.
+
+    Listeners run on the shared watch thread and must return quickly.
+    """
+
+    def __init__(self, directory: Path) -> None:
+        self.generation = 0
+        self.listeners: List[Callable[[Set[str]], None]] = []
+        self.watcher = InotifyWatcher(directory, self._changed)
+
+    def _changed(self, names: Set[str]) -> None:
+        self.generation += 1
+        for listener in list(self.listeners):
+            try:
+                listener(names)
+            except Exception:
+                logger.exception("state watch listener failed for %s", self.watcher.directory)
+
+
+_WATCHES: Dict[Path, Optional[_DirectoryWatch]] = {}
+logger = logging.getLogger(__name__)
+
+
+def _directory_watch(directory: Path) -> Optional[_DirectoryWatch]:
+    with _VIEWS_GUARD:
+        if directory not in _WATCHES:
+            try:
+                _WATCHES[directory] = _DirectoryWatch(directory) if inotify_available() else None
+            except OSError:
+                _WATCHES[directory] = None
+        return _WATCHES[directory]
+
+
+class StateSubscription:
+    """Calls `callback(token, snapshot)` from its own thread whenever a target changes.
+
+    Changes are detected through inotify on `state/` or, where that is not
+    available (or with `mode="poll"`), by checking the files every
+    `poll_interval` seconds. Consecutive changes may be delivered as one, and
+    a slow callback delays only its own subscription.
+    """
+
+    def __init__(
+        self,
+        manager: "StateManager",
+        target: StateTarget,
+        callback: StateCallback,
+        *,
+        mode: Literal["auto", "poll"] = "auto",
+        poll_interval: float = 0.5,
+    ) -> None:
+        self.target = target
+        self._manager = manager
+        self._callback = callback
+        self._poll_interval = poll_interval
+        self._closed = threading.Event()
+        self._wake = threading.Event()
+        path = manager._path_for(target)
+        self._names = {path.name, manager._log_for(path).name}
+        manager.ensure_layout()
+        self._watch = _directory_watch(path.parent) if mode == "auto" else None
+        if self._watch is not None:
+            self._watch.listeners.append(self._changed)
+        # Taken after the watch is in place, so no change can fall in between.
+        self.token = manager._snapshot(target).token
+        self._thread = threading.Thread(target=self._run, name="stg-state-subscriber", daemon=True)
+        self._thread.start()
+
+    @property
+    def mode(self) -> str:
+        return "inotify" if self._watch is not None else "poll"
+
+    def close(self) -> None:
+        self._closed.set()
+        self._wake.set()
+        if self._watch is not None and self._changed in self._watch.listeners:
+            self._watch.listeners.remove(self._changed)
+        if self._thread is not threading.current_thread():
+            self._thread.join(timeout=self._poll_interval + 1)
+
+    def __enter__(self) -> "StateSubscription":
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        self.close()
+
+    def _changed(self, names: Set[str]) -> None:
+        # Runs on the shared watch thread: only hand the change to our own thread.
+        if not names or names & self._names:
+            self._wake.set()
+
+    def _run(self) -> None:
+        timeout = None if self._watch is not None else self._poll_interval
+        while True:
+            self._wake.wait(timeout)
+            self._wake.clear()
+            if self._closed.is_set():
+                return
+            try:
+                self._check()
+            except Exception:
+                logger.exception("state subscriber failed for %s", self.target)
+
+    def _check(self) -> None:
+        try:
+            snapshot = self._manager._snapshot(self.target)
+        except (OSError, ValueError):
+            return  # mid-replacement on a platform without atomic rename; retry next event
+        if snapshot.token != self.token:
+            self.token = snapshot.token
+            self._callback(snapshot.token, snapshot)
+
+
 class StateManager:
-    """Provides typed access to active and staging state files."""
+    """Provides typed access to active and staging state files.
+
+    `patch_state` appends small changes to a per-target op log
+    (`<target>.state.ops.jsonl`) next to the state file instead of rewriting it;
+    readers replay the log, and it is folded back into the state file every
+    `compact_every` entries.
+
+    Every read-check-write runs under the state directory's file lock, and
+    state files are replaced atomically (temp file, fsync, rename), so a crash
+    leaves either the old or the new document. `durability` controls fsyncs;
+    in "group" mode concurrent writers share the fsyncs of op logs and of the
+    directory after a rename, but every full rewrite (`write_state`, `promote`,
+    compaction) and array file still syncs its own temp file before the rename.
 
-    def __init__(self, dirs: AgentDirectories) -> None:
+    `read_snapshot` serves an immutable snapshot shared across the process and
+    only re-reads files whose inode, mtime or size changed. With `watch`, it
+    skips even those checks until inotify reports a change in `state/` (on
+    platforms without inotify it keeps checking).
+
+    Large numeric state can be stored as sidecar `.npy` arrays under
+    `state/arrays/`, memory-mapped read-only by readers; see `write_state`.
+    """
+
+    def __init__(
+        self,
+        dirs: AgentDirectories,
+        *,
+        compact_every: int = 256,
+        durability: Durability = "always",
+        watch: bool = False,
+    ) -> None:
         self.dirs = dirs
+        self.compact_every = compact_every
+        self.durability = durability
+        self.watch = watch
+        # Seconds an array file is kept after it stops being referenced, for readers of the
+        # previous document.
+        self.array_grace = 60.0
         self._lock = FileLock(str(dirs.state_lock_file))
         self._validator = self._load_validator(dirs.schema_file)
 
@@ -57,44 +433,213 @@ class StateManager:
 
     def ensure_layout(self) -> None:
         self.dirs.state_dir.mkdir(parents=True, exist_ok=True)
-        for path in (self.dirs.active_state_file, self.dirs.staging_state_file):
-            if not path.exists():
-                doc = StateDocument(version_id=uuid4().hex, data={})
-                path.write_text(json.dumps(doc, indent=2) + "\n")
         self.dirs.state_lock_file.touch(exist_ok=True)
+        with self._lock:
+            for path in (self.dirs.active_state_file, self.dirs.staging_state_file):
+                if not path.exists():
+                    self._write_file(path, StateDocument(version_id=uuid4().hex, data={}))
 
     def read_state(self, target: StateTarget) -> StateDocument:
         path = self._path_for(target)
         if not path.exists():
             self.ensure_layout()
-        raw = json.loads(path.read_text()) if path.exists() else {}
-        doc = StateDocument(raw)
-        doc.token  # ensure token
-        doc.payload  # ensure payload
+        # Open the log before reading the file: a compaction in between folds the log into the
+        # file and unlinks it, but this handle still reads the entries the older file lacks.
+        try:
+            handle: Optional[BinaryIO] = self._log_for(path).open("rb")
+        except FileNotFoundError:
+            handle = None
+        try:
+            raw = json.loads(path.read_text()) if path.exists() else {}
+            doc = StateDocument(raw)
+            doc.token  # ensure token
+            doc.payload  # ensure payload
+            if handle is not None:
+                doc, _ = self._replay(doc, handle.read())
+        finally:
+            if handle is not None:
+                handle.close()
         return doc
 
-    def write_state(self, target: StateTarget, payload: Dict[str, Any], expected_token: Optional[str]) -> str:
-        doc = self.read_state(target)
-        if expected_token and doc.token != expected_token:
-            raise StateValidationError(
-                f"Stale state token for {target}: have {expected_token}, current {doc.token}"
-            )
+    def read_snapshot(self, target: StateTarget) -> StateSnapshot:
+        """The current state as an immutable snapshot, parsed only when it changed.
+
+        Use `snapshot.payload.thaw()` for a mutable copy.
+        """
+
+        return self._snapshot(target, verify=False)
+
+    def subscribe(
+        self,
+        callback: StateCallback,
+        *,
+        target: StateTarget = "active",
+        mode: Literal["auto", "poll"] = "auto",
+        poll_interval: float = 0.5,
+    ) -> StateSubscription:
+        """Call `callback(token, snapshot)` on every later change of `target` until closed."""
+
+        return StateSubscription(
+            self, target, callback, mode=mode, poll_interval=poll_interval
+        )
+
+    async def changes(
+        self,
+        target: StateTarget = "active",
+        *,
+        mode: Literal["auto", "poll"] = "auto",
+        poll_interval: float = 0.5,
+    ) -> AsyncIterator[StateSnapshot]:
+        """Yield a snapshot after each change of `target`; a slow consumer gets the latest."""
+
+        loop = asyncio.get_running_loop()
+        ready = asyncio.Event()
+        latest: List[StateSnapshot] = []
+
+        def publish(snapshot: StateSnapshot) -> None:
+            latest[:] = [snapshot]
+            ready.set()
+
+        def deliver(token: str, snapshot: StateSnapshot) -> None:
+            loop.call_soon_threadsafe(publish, snapshot)
+
+        subscription = self.subscribe(
+            deliver, target=target, mode=mode, poll_interval=poll_interval
+        )
+        try:
+            while True:
+                await ready.wait()
+                ready.clear()
+                yield latest[0]
+        finally:
+            subscription.close()
+
+    def _snapshot(self, target: StateTarget, *, verify: bool = True) -> StateSnapshot:
+        view = self._view(target, verify=verify)
+        with view.guard:
+            doc = view.doc
+            assert doc is not None
+            if view.snapshot is None or view.snapshot.token != doc.token:
+                view.snapshot = StateSnapshot(
+                    token=doc.token,
+                    payload=FrozenMapping(doc.payload),
+                    arrays=MappedArrays(self.arrays_dir, doc.array_refs),
+                )
+            return view.snapshot
+
+    def read_arrays(self, target: StateTarget) -> Mapping:
+        """The target's sidecar arrays, memory-mapped read-only as they are accessed."""
+
+        return self.read_snapshot(target).arrays
+
+    def write_state(
+        self,
+        target: StateTarget,
+        payload: Dict[str, Any],
+        expected_token: Optional[str],
+        *,
+        arrays: Optional[Mapping] = None,
+    ) -> str:
+        """Replace the payload and, if given, the sidecar `arrays` (name -> C-contiguous buffer).
+
+        Arrays are kept out of the JSON file and the JSON Schema; without
+        `arrays` the current ones are kept.
+        """
+
+        if arrays is None:
+            return self._replace(target, payload, expected_token, None)
+        fsync = self.durability != "none"
+        # Written before taking the lock, which sweeps of unreferenced arrays hold.
+        refs = {
+            name: write_npy(self.arrays_dir, value, fsync=fsync) for name, value in arrays.items()
+        }
+        with self._lock:
+            # A sweep may have deleted a file that write_npy found already stored.
+            for name, value in arrays.items():
+                if not retain(self.arrays_dir, refs[name]):
+                    refs[name] = write_npy(self.arrays_dir, value, fsync=fsync)
+            return self._replace(target, payload, expected_token, refs)
+
+    def _replace(
+        self,
+        target: StateTarget,
+        payload: Dict[str, Any],
+        expected_token: Optional[str],
+        refs: Optional[Dict[str, Dict[str, Any]]],
+    ) -> str:
         if self._validator is not None:
-            errors = sorted(self._validator.iter_errors(payload), key=lambda e: e.path)
-            if errors:
-                summaries = "; ".join(f"{'.'.join(map(str, err.path))}: {err.message}" for err in errors)
-                raise StateValidationError(summaries)
-        doc["data"] = payload
-        doc["version_id"] = uuid4().hex
+            self._raise_errors(self._validator.iter_errors(payload))
         path = self._path_for(target)
-        path.write_text(json.dumps(doc, indent=2) + "\n")
+        with self._lock:
+            doc = self.read_state(target)
+            if expected_token and doc.token != expected_token:
+                raise StateValidationError(
+                    f"Stale state token for {target}: have {expected_token}, current {doc.token}"
+                )
+            doc["data"] = payload
+            doc["version_id"] = uuid4().hex
+            if refs is not None:
+                doc["arrays"] = refs
+            self._write_file(path, doc)
+            self._log_for(path).unlink(missing_ok=True)
+            if refs is not None:
+                self._collect_arrays()
+        self._sync(path.parent)
         return doc.token
 
+    def patch_state(self, target: StateTarget, patch: Patch, expected_token: Optional[str]) -> str:
+        """Apply a JSON Patch (list of operations) or merge patch (object) to the payload.
+
+        Only the subtrees the patch touches are revalidated, unless the schema
+        constrains them through keywords spanning several members (combinators,
+        `$ref`, `dependentSchemas`, ...), in which case the nearest such ancestor is.
+        """
+
+        # Round-trip through JSON so the stored change never aliases caller objects.
+        patch = json.loads(json.dumps(patch))
+        with self._lock:
+            # Always check the files: an inotify event from another writer may still be in flight.
+            view = self._view(target, verify=True)
+            current = view.doc
+            assert current is not None
+            if expected_token and current.token != expected_token:
+                raise StateValidationError(
+                    f"Stale state token for {target}: have {expected_token}, "
+                    f"current {current.token}"
+                )
+            try:
+                payload, changed = apply_patch(current.payload, patch)
+            except PatchError as err:
+                raise StateValidationError(str(err)) from err
+            if not isinstance(payload, dict):
+                raise StateValidationError("State payload must remain a JSON object")
+            self._validate_changes(payload, changed)
+            token = uuid4().hex
+            record = {"base": current.token, "version_id": token, "patch": patch}
+            entry = (json.dumps(record, separators=(",", ":")) + "\n").encode()
+            path = self._path_for(target)
+            log = self._log_for(path)
+            with view.guard:
+                with log.open("ab") as handle:
+                    handle.write(entry)
+                view.doc = StateDocument(current, version_id=token, data=payload)
+                view.offset += len(entry)
+                view.entries += 1
+                compacted = view.entries >= self.compact_every
+                if compacted:
+                    self._compact(target, view)
+        # Synced outside the lock so writers arriving meanwhile join the same flush.
+        self._sync(path.parent if compacted else log)
+        return token
+
     def promote(self, expected_staging_token: Optional[str] = None) -> str:
-        staging = self.read_state("staging")
-        if expected_staging_token and staging.token != expected_staging_token:
-            raise StateValidationError("Staging state token mismatch during promote")
-        token = self.write_state("active", staging.payload, expected_token=None)
+        with self._lock:
+            staging = self.read_state("staging")
+            if expected_staging_token and staging.token != expected_staging_token:
+                raise StateValidationError("Staging state token mismatch during promote")
+            # The arrays are immutable and content-addressed: both documents share the files,
+            # so renaming the active JSON file swaps payload and arrays together.
+            token = self._replace("active", staging.payload, None, staging.array_refs)
         return token
 
     @contextmanager
@@ -102,5 +647,130 @@ class StateManager:
         with self._lock:
             yield
 
+    @property
+    def arrays_dir(self) -> Path:
+        return self.dirs.state_dir / "arrays"
+
+    def _collect_arrays(self) -> None:
+        referenced = set()
+        for target in ("active", "staging"):
+            doc = self._view(target, verify=True).doc
+            assert doc is not None
+            referenced.update(ref["sha256"] for ref in doc.array_refs.values())
+        collect(self.arrays_dir, referenced, grace=self.array_grace)
+
     def _path_for(self, target: StateTarget) -> Path:
         return self.dirs.active_state_file if target == "active" else self.dirs.staging_state_file
+
+    @staticmethod
+    def _log_for(path: Path) -> Path:
+        return path.with_suffix(".ops.jsonl")
+
+    def _view(self, target: StateTarget, *, verify: bool = False) -> _View:
+        """The target's current document, replaying only log entries appended since last time."""
+
+        path = self._path_for(target)
+        with _VIEWS_GUARD:
+            view = _VIEWS.setdefault(path, _View())
+        watch = None
+        if self.watch and not verify and view.doc is not None:
+            watch = _directory_watch(path.parent)
+        # Read before checking the files, so a change during the refresh is seen next time.
+        generation = watch.generation if watch is not None else None
+        if view.doc is not None and generation is not None and view.generation == generation:
+            return view
+        if not path.exists():
+            self.ensure_layout()
+        with view.guard:
+            stat = path.stat()
+            signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            log = self._log_for(path)
+            log_size = log.stat().st_size if log.exists() else 0
+            if view.doc is None or view.signature != signature or log_size < view.offset:
+                doc = StateDocument(json.loads(path.read_text()))
+                doc.token
+                doc.payload
+                view.signature, view.offset, view.entries, view.doc = signature, 0, 0, doc
+            if log_size > view.offset:
+                with log.open("rb") as handle:
+                    handle.seek(view.offset)
+                    view.doc, consumed = self._replay(view.doc, handle.read(), view)
+                view.offset += consumed
+            view.generation = generation
+        return view
+
+    @staticmethod
+    def _replay(
+        doc: StateDocument, data: bytes, view: Optional[_View] = None
+    ) -> Tuple[StateDocument, int]:
+        """Apply the complete log lines in `data` that chain from `doc`'s token.
+
+        Lines whose base token does not match are leftovers of a log that was
+        already folded into the state file and are skipped.
+        """
+
+        consumed = 0
+        for raw in data.splitlines(keepends=True):
+            if not raw.endswith(b"\n"):
+                break  # an append still in progress
+            consumed += len(raw)
+            entry = json.loads(raw)
+            if entry["base"] != doc.token:
+                continue
+            payload, _ = apply_patch(doc.payload, entry["patch"])
+            doc = StateDocument(doc, version_id=entry["version_id"], data=payload)
+            if view is not None:
+                view.entries += 1
+        return doc, consumed
+
+    def _write_file(self, path: Path, doc: StateDocument) -> None:
+        """Replace `path` with `doc` atomically: write a temp file, fsync it, rename it over."""
+
+        temp = path.with_name(f".{path.name}.{uuid4().hex}.tmp")
+        try:
+            with temp.open("w") as handle:
+                handle.write(json.dumps(doc, indent=2) + "\n")
+                handle.flush()
+                if self.durability != "none":
+                    os.fsync(handle.fileno())
+            os.replace(temp, path)
+        except BaseException:
+            temp.unlink(missing_ok=True)
+            raise
+
+    def _sync(self, path: Path) -> None:
+        """Make writes to `path` (a log, or a directory after renames) durable."""
+
+        if self.durability == "always":
+            _fsync(path)
+        elif self.durability == "group":
+            _GROUP_SYNC.sync(path)
+
+    def _compact(self, target: StateTarget, view: _View) -> None:
+        path = self._path_for(target)
+        self._write_file(path, view.doc)
+        self._log_for(path).unlink(missing_ok=True)
+        stat = path.stat()
+        view.signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        view.offset = view.entries = 0
+
+    def _validate_changes(self, payload: Dict[str, Any], changed: List[Pointer]) -> None:
+        if self._validator is None:
+            return
+        schema = self._validator.schema
+        for pointer in outermost(changed):
+            depth, subschema = _anchor(schema, pointer)
+            if subschema is True:
+                continue
+            prefix = pointer[:depth]
+            errors = self._validator.descend(resolve(payload, prefix), subschema)
+            self._raise_errors(errors, prefix)
+
+    @staticmethod
+    def _raise_errors(errors: Iterable[ValidationError], prefix: Pointer = ()) -> None:
+        errors = sorted(errors, key=lambda e: e.path)
+        if errors:
+            summaries = "; ".join(
+                f"{'.'.join(map(str, [*prefix, *err.path]))}: {err.message}" for err in errors
+            )
+            raise StateValidationError(summaries)
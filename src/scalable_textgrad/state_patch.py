@@ -0,0 +1,208 @@
+"""JSON Patch (RFC 6902) and JSON Merge Patch (RFC 7396) for state payloads.
+
+Patches never modify their input: each container along a changed path is
+shallow-copied and everything else is shared. Applying a patch therefore
+costs time proportional to the size of those containers (changing one arm in
+a mapping of N arms copies that mapping, O(N)), but not to the whole document
+beneath them.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Callable, Dict, List, Tuple, Union
+
+Pointer = Tuple[str, ...]
+Patch = Union[List[Dict[str, Any]], Dict[str, Any]]
+
+
+class PatchError(ValueError):
+    pass
+
+
+def parse_pointer(pointer: str) -> Pointer:
+    if pointer == "":
+        return ()
+    if not pointer.startswith("/"):
+        raise PatchError(f"Invalid JSON pointer {pointer!r}")
+    return tuple(part.replace("~1", "/").replace("~0", "~") for part in pointer[1:].split("/"))
+
+
+def format_pointer(tokens: Pointer) -> str:
+    return "".join("/" + token.replace("~", "~0").replace("/", "~1") for token in tokens)
+
+
+def resolve(document: Any, tokens: Pointer) -> Any:
+    node = document
+    for token in tokens:
+        node = node[_member(node, token, tokens)]
+    return node
+
+
+def apply_patch(document: Any, patch: Patch) -> Tuple[Any, List[Pointer]]:
+    """Apply a JSON Patch (list of operations) or merge patch (object) to `document`.
+
+    Returns the new document and the locations whose subtree changed, for
+    revalidation. A location that gained or lost members is reported as the
+    container itself.
+    """
+
+    if isinstance(patch, dict):
+        changed: List[Pointer] = []
+        return _merge(document, patch, (), changed), changed
+    if not isinstance(patch, list):
+        raise PatchError("A patch is a list of JSON Patch operations or a merge-patch object")
+    changed = []
+    for operation in patch:
+        document = _apply_operation(document, operation, changed)
+    return document, changed
+
+
+def outermost(pointers: List[Pointer]) -> List[Pointer]:
+    """Drop pointers nested in another pointer of the list."""
+
+    kept: List[Pointer] = []
+    for pointer in sorted(set(pointers), key=len):
+        if not any(pointer[: len(parent)] == parent for parent in kept):
+            kept.append(pointer)
+    return kept
+
+
+def _apply_operation(document: Any, operation: Dict[str, Any], changed: List[Pointer]) -> Any:
+    try:
+        op = operation["op"]
+        path = parse_pointer(operation["path"])
+    except (KeyError, TypeError) as err:
+        raise PatchError(f"Malformed patch operation {operation!r}") from err
+    if op == "test":
+        if not _json_equal(resolve(document, path), _value(operation)):
+            raise PatchError(f"Test failed at {operation['path']}")
+        return document
+    if op == "replace":
+        resolve(document, path)
+        changed.append(path)
+        return _update(document, path, lambda _: _value(operation))
+    if op == "add":
+        changed.append(path[:-1])
+        return _add(document, path, _value(operation))
+    if op == "remove":
+        changed.append(path[:-1])
+        return _remove(document, path)
+    if op in ("move", "copy"):
+        source = parse_pointer(_field(operation, "from"))
+        value = resolve(document, source)
+        if op == "move":
+            if path[: len(source)] == source and path != source:
+                raise PatchError(f"Cannot move {format_pointer(source)} into itself")
+            changed.append(source[:-1])
+            document = _remove(document, source)
+        changed.append(path[:-1])
+        return _add(document, path, value)
+    raise PatchError(f"Unknown patch operation {op!r}")
+
+
+def _field(operation: Dict[str, Any], name: str) -> Any:
+    if name not in operation:
+        raise PatchError(f"Patch operation {operation.get('op')!r} requires {name!r}")
+    return operation[name]
+
+
+def _value(operation: Dict[str, Any]) -> Any:
+    return _field(operation, "value")
+
+
+def _json_equal(left: Any, right: Any) -> bool:
+    """Equality of JSON values: like `==`, but booleans are never equal to numbers.
+
+    Integers and floats are both JSON numbers, so `1` equals `1.0` (RFC 6902, 4.6).
+    """
+
+    if isinstance(left, bool) or isinstance(right, bool):
+        return type(left) is type(right) and left == right
+    if isinstance(left, (int, float)) and isinstance(right, (int, float)):
+        return left == right
+    if isinstance(left, dict) and isinstance(right, dict):
+        return left.keys() == right.keys() and all(_json_equal(left[k], right[k]) for k in left)
+    if isinstance(left, list) and isinstance(right, list):
+        return len(left) == len(right) and all(map(_json_equal, left, right))
+    return type(left) is type(right) and left == right
+
+
+def _member(node: Any, token: str, tokens: Pointer) -> Union[str, int]:
+    if isinstance(node, dict):
+        if token not in node:
+            raise PatchError(f"{format_pointer(tokens)} does not exist")
+        return token
+    if isinstance(node, list):
+        index = _index(token, tokens)
+        if index >= len(node):
+            raise PatchError(f"{format_pointer(tokens)} does not exist")
+        return index
+    raise PatchError(f"{format_pointer(tokens)} does not exist")
+
+
+def _index(token: str, tokens: Pointer) -> int:
+    if not token.isdigit() or (token != "0" and token.startswith("0")):
+        raise PatchError(f"Invalid array index in {format_pointer(tokens)}")
+    return int(token)
+
+
+def _update(node: Any, tokens: Pointer, fn: Callable[[Any], Any], depth: int = 0) -> Any:
+    """Return `node` with the value at `tokens` replaced by `fn(value)`, copying the path."""
+
+    if depth == len(tokens):
+        return fn(node)
+    key = _member(node, tokens[depth], tokens[: depth + 1])
+    copy = dict(node) if isinstance(node, dict) else list(node)
+    copy[key] = _update(node[key], tokens, fn, depth + 1)  # type: ignore[index]
+    return copy
+
+
+def _add(document: Any, path: Pointer, value: Any) -> Any:
+    if not path:
+        return value
+
+    def insert(container: Any) -> Any:
+        token = path[-1]
+        if isinstance(container, dict):
+            return {**container, token: value}
+        if isinstance(container, list):
+            index = len(container) if token == "-" else _index(token, path)
+            if index > len(container):
+                raise PatchError(f"{format_pointer(path)} is out of range")
+            return container[:index] + [value] + container[index:]
+        raise PatchError(f"Cannot add {format_pointer(path)} to a scalar")
+
+    return _update(document, path[:-1], insert)
+
+
+def _remove(document: Any, path: Pointer) -> Any:
+    if not path:
+        raise PatchError("Cannot remove the whole document")
+
+    def delete(container: Any) -> Any:
+        key = _member(container, path[-1], path)
+        if isinstance(container, dict):
+            return {name: item for name, item in container.items() if name != key}
+        return container[:key] + container[key + 1 :]  # type: ignore[operator]
+
+    return _update(document, path[:-1], delete)
+
+
+def _merge(target: Any, patch: Any, path: Pointer, changed: List[Pointer]) -> Any:
+    if not isinstance(patch, dict):
+        return patch
+    if not isinstance(target, dict):
+        changed.append(path)
+        target = {}
+    merged = dict(target)
+    for key, value in patch.items():
+        if value is None:
+            if key in merged:
+                del merged[key]
+                changed.append(path)
+        elif isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge(merged[key], value, path + (key,), changed)
+        else:
+            changed.append(path + (key,) if key in merged else path)
+            merged[key] = _merge({}, value, path + (key,), []) if isinstance(value, dict) else value
+    return merged
@@ -0,0 +1,107 @@
+"""Directory change notifications through Linux inotify (via ctypes, no dependencies)."""
+
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+from pathlib import Path
+from typing import Callable, Optional, Set
+
+IN_MODIFY = 0x002
+IN_ATTRIB = 0x004
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+CHANGE_MASK = (
+    IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+)
+
+_EVENT = struct.Struct("iIII")
+logger = logging.getLogger(__name__)
+_libc: Optional[ctypes.CDLL] = None
+
+
+def _load_libc() -> Optional[ctypes.CDLL]:
+    global _libc
+    if _libc is None and sys.platform.startswith("linux"):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            libc.inotify_init1, libc.inotify_add_watch  # noqa: B018 - probe the symbols
+        except (OSError, AttributeError):
+            return None
+        _libc = libc
+    return _libc
+
+
+def inotify_available() -> bool:
+    return _load_libc() is not None
+
+
+class InotifyWatcher:
+    """Calls `callback(names)` from a daemon thread when files in `directory` change.
+
+    `names` is the set of changed file names in one batch of events; it is
+    empty when the kernel queue overflowed and any file may have changed.
+    """
+
+    def __init__(self, directory: Path, callback: Callable[[Set[str]], None]) -> None:
+        libc = _load_libc()
+        if libc is None:
+            raise OSError("inotify is not available on this platform")
+        self.directory = directory
+        self._callback = callback
+        self._fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self._fd, os.fsencode(directory), CHANGE_MASK) < 0:
+            errno = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(errno, f"cannot watch {directory}")
+        self._wake_r, self._wake_w = os.pipe()
+        self._thread = threading.Thread(target=self._loop, name="stg-state-watch", daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        if self._thread.is_alive():
+            os.write(self._wake_w, b"x")
+            self._thread.join(timeout=1)
+        for fd in (self._fd, self._wake_r, self._wake_w):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def _loop(self) -> None:
+        while True:
+            ready, _, _ = select.select([self._fd, self._wake_r], [], [])
+            if self._wake_r in ready:
+                return
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                continue
+            names: Set[str] = set()
+            overflow = False
+            offset = 0
+            while offset < len(data):
+                _, mask, _, length = _EVENT.unpack_from(data, offset)
+                offset += _EVENT.size
+                name = data[offset : offset + length].rstrip(b"\0")
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    overflow = True
+                elif name:
+                    names.add(os.fsdecode(name))
+            try:
+                self._callback(set() if overflow else names)
+            except Exception:  # keep watching; one bad subscriber must not stop the others
+                logger.exception("state watch callback failed for %s", self.directory)
@@ -0,0 +1,417 @@
+"""Routing helpers for the Version Manager proxy."""
+
+from __future__ import annotations
+
+import asyncio
+import importlib.util
+import random
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from threading import Lock
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import httpx
+
+from ..config import AgentSettings, UpstreamPoolSettings
+from ..registry import HeartbeatKey, ServiceEndpoint, VersionRecord
+
+# RFC 9110 section 7.6.1: connection-scoped headers a proxy must not forward.
+HOP_BY_HOP_HEADERS = frozenset(
+    {
+        "connection",
+        "keep-alive",
+        "proxy-authenticate",
+        "proxy-authorization",
+        "proxy-connection",
+        "te",
+        "trailer",
+        "transfer-encoding",
+        "upgrade",
+    }
+)
+
+
+def forward_headers(
+    headers: Iterable[Tuple[str, str]], *, drop: Iterable[str] = ()
+) -> List[Tuple[str, str]]:
+    """Strip hop-by-hop headers, including those named by `Connection`, plus `drop`."""
+
+    items = list(headers)
+    excluded = set(HOP_BY_HOP_HEADERS) | {name.lower() for name in drop}
+    for name, value in items:
+        if name.lower() == "connection":
+            excluded.update(token.strip().lower() for token in value.split(",") if token.strip())
+    return [(name, value) for name, value in items if name.lower() not in excluded]
+
+
+@dataclass(frozen=True)
+class Replica:
+    """One registered upstream, with its base URL normalised once at cache time."""
+
+    base_url: str
+    endpoint: ServiceEndpoint = field(compare=False)
+
+    @classmethod
+    def from_endpoint(cls, endpoint: ServiceEndpoint) -> "Replica":
+        return cls(base_url=endpoint.base_url.rstrip("/"), endpoint=endpoint)
+
+
+Route = Tuple[Replica, ...]
+
+
+class RouteCache:
+    """Maps `(version, component)` to the replicas registered for that service.
+
+    `version` is whatever the client put in the URL (a commit hash or a semver).
+    Entries are dropped whenever a registry change touches a record that the
+    reference could resolve to: its commit hash, its new version or the version it
+    carried before the change. A generation counter keeps a lookup that raced with
+    an invalidation from re-inserting a stale route.
+    """
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self._routes: Dict[str, Dict[str, Route]] = {}
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def lookup(self, version: str, component: str) -> Tuple[Optional[Route], int]:
+        """Return the cached route (or `None`) and the generation to pass to `store`."""
+
+        with self._lock:
+            route = self._routes.get(version, {}).get(component)
+            if route is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return route, self._generation
+
+    def store(self, version: str, component: str, route: Route, generation: int) -> None:
+        with self._lock:
+            if generation == self._generation:
+                self._routes.setdefault(version, {})[component] = route
+
+    def invalidate_record(self, record: VersionRecord, previous_version: Optional[str]) -> None:
+        refs = {record.commit_hash, record.version}
+        if previous_version:
+            refs.add(previous_version)
+        with self._lock:
+            self._generation += 1
+            for ref in refs:
+                if self._routes.pop(ref, None) is not None:
+                    self.invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._routes.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "entries": sum(len(routes) for routes in self._routes.values()),
+            }
+
+
+@dataclass
+class _Upstream:
+    client: httpx.AsyncClient
+    limits: UpstreamPoolSettings
+    in_flight: int = 0
+    requests: int = 0
+    pool_timeouts: int = 0
+
+
+class UpstreamPools:
+    """One `httpx.AsyncClient` per upstream origin, so a slow version cannot drain
+    the connections other versions need.
+
+    Limits come from `AgentSettings.upstream_pool`. `in_flight` counts proxied
+    requests between `acquire` and `release`, which for streamed responses spans
+    the whole body relay.
+    """
+
+    def __init__(
+        self, settings: AgentSettings, *, transport: Optional[httpx.AsyncBaseTransport] = None
+    ) -> None:
+        self.settings = settings
+        self._transport = transport
+        self._upstreams: Dict[str, _Upstream] = {}
+        self._origins: Dict[str, str] = {}
+
+    def origin_for(self, url: str) -> str:
+        origin = self._origins.get(url)
+        if origin is None:
+            parsed = httpx.URL(url)
+            origin = f"{parsed.scheme}://{parsed.netloc.decode('ascii')}"
+            self._origins[url] = origin
+        return origin
+
+    def acquire(self, origin: str) -> httpx.AsyncClient:
+        upstream = self._upstreams.get(origin)
+        if upstream is None:
+            upstream = self._open(origin)
+            self._upstreams[origin] = upstream
+        upstream.in_flight += 1
+        upstream.requests += 1
+        return upstream.client
+
+    def release(self, origin: str, *, pool_timeout: bool = False) -> None:
+        upstream = self._upstreams[origin]
+        upstream.in_flight -= 1
+        if pool_timeout:
+            upstream.pool_timeouts += 1
+
+    def _open(self, origin: str) -> _Upstream:
+        limits = self.settings.upstream_pool(origin)
+        if limits.http2 and importlib.util.find_spec("h2") is None:
+            raise RuntimeError(
+                f"HTTP/2 requested for {origin} but the 'h2' package is missing; "
+                "install scalable-textgrad[http2]"
+            )
+        kwargs: Dict[str, Any] = {}
+        if self._transport is not None:
+            kwargs["transport"] = self._transport
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(
+                self.settings.proxy_timeout,
+                connect=self.settings.proxy_connect_timeout,
+                pool=self.settings.proxy_pool_timeout,
+            ),
+            limits=httpx.Limits(
+                max_connections=limits.max_connections,
+                max_keepalive_connections=limits.max_keepalive_connections,
+                keepalive_expiry=limits.keepalive_expiry,
+            ),
+            http2=limits.http2,
+            **kwargs,
+        )
+        return _Upstream(client=client, limits=limits)
+
+    async def aclose(self) -> None:
+        upstreams = list(self._upstreams.values())
+        self._upstreams.clear()
+        for upstream in upstreams:
+            await upstream.client.aclose()
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            origin: {
+                "in_flight": upstream.in_flight,
+                "max_connections": upstream.limits.max_connections,
+                "occupancy": upstream.in_flight / max(upstream.limits.max_connections, 1),
+                "requests": upstream.requests,
+                "pool_timeouts": upstream.pool_timeouts,
+                "http2": upstream.limits.http2,
+            }
+            for origin, upstream in self._upstreams.items()
+        }
+
+
+class NoLiveReplica(LookupError):
+    pass
+
+
+class HeartbeatTracker:
+    """Keeps the latest heartbeat per replica in memory.
+
+    Beats are visible to the balancer immediately; `drain` hands the ones not yet
+    persisted to the caller, which writes them to the registry in one batch.
+    """
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self._seen: Dict[str, datetime] = {}
+        self._pending: Dict[HeartbeatKey, datetime] = {}
+        self.beats = 0
+
+    def beat(self, commit_hash: str, component: str, base_url: str) -> datetime:
+        now = datetime.utcnow()
+        with self._lock:
+            self._seen[base_url.rstrip("/")] = now
+            self._pending[(commit_hash, component, base_url)] = now
+            self.beats += 1
+        return now
+
+    def last_seen(self, endpoint: ServiceEndpoint) -> datetime:
+        seen = self._seen.get(endpoint.base_url.rstrip("/"))
+        if seen is None or seen < endpoint.last_heartbeat:
+            return endpoint.last_heartbeat
+        return seen
+
+    def forget(self, base_url: str) -> None:
+        with self._lock:
+            self._seen.pop(base_url.rstrip("/"), None)
+
+    def drain(self) -> Dict[HeartbeatKey, datetime]:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return pending
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"beats": self.beats, "tracked": len(self._seen), "pending": len(self._pending)}
+
+
+@dataclass
+class _ReplicaState:
+    outstanding: int = 0
+    failures: int = 0
+    ejected_until: float = 0.0
+    ejections: int = 0
+    expired: bool = False
+    retired: bool = False
+
+
+class LoadBalancer:
+    """Spreads requests over the replicas of a route.
+
+    Replicas whose latest heartbeat (from the tracker, else the persisted
+    `last_heartbeat`) is older than `replica_heartbeat_ttl` are marked expired and
+    not considered at all. Replicas that fail `proxy_eject_after_failures` times in a
+    row, either on proxied traffic (passive) or on the periodic probe (active),
+    are ejected for `proxy_eject_seconds`. If every live replica is ejected the
+    balancer routes to all of them rather than failing the request.
+
+    State is kept per base URL of the routes handed to `track`; it is dropped
+    (once in-flight requests finish) when `sync_record` sees the replica removed
+    from every tracked route, so deregistered replicas are no longer probed.
+    """
+
+    def __init__(
+        self,
+        settings: AgentSettings,
+        *,
+        heartbeats: Optional[HeartbeatTracker] = None,
+        rng: Optional[random.Random] = None,
+    ) -> None:
+        self.settings = settings
+        self.heartbeats = heartbeats or HeartbeatTracker()
+        self._rng = rng or random.Random()
+        self._state: Dict[str, _ReplicaState] = {}
+        self._routes: Dict[Tuple[str, str], Set[str]] = {}
+
+    def choose(self, route: Sequence[Replica]) -> Replica:
+        now = time.monotonic()
+        live = [replica for replica in route if self._is_fresh(replica)]
+        if not live:
+            raise NoLiveReplica("no replica with a recent heartbeat")
+        healthy = [replica for replica in live if self._state_for(replica).ejected_until <= now]
+        candidates = healthy or live
+        if len(candidates) == 1:
+            return candidates[0]
+        if self.settings.proxy_balancer == "least_outstanding":
+            return min(candidates, key=lambda replica: self._state_for(replica).outstanding)
+        first, second = self._rng.sample(candidates, 2)
+        if self._state_for(second).outstanding < self._state_for(first).outstanding:
+            return second
+        return first
+
+    def acquire(self, replica: Replica) -> None:
+        self._state_for(replica).outstanding += 1
+
+    def release(self, replica: Replica, *, ok: Optional[bool]) -> None:
+        """Finish a request; `ok=None` means the attempt says nothing about health."""
+
+        state = self._state.get(replica.base_url)
+        if state is None:
+            return
+        state.outstanding -= 1
+        if state.retired:
+            if not state.outstanding:
+                del self._state[replica.base_url]
+        elif ok is not None:
+            self.record(replica.base_url, ok=ok)
+
+    def track(self, commit_hash: str, component: str, route: Sequence[Replica]) -> None:
+        """Remember which replicas serve `component` of `commit_hash`."""
+
+        self._routes[(commit_hash, component)] = {replica.base_url for replica in route}
+
+    def sync_record(self, record: VersionRecord, previous_version: Optional[str] = None) -> None:
+        """Registry listener: forget replicas no longer registered for any tracked route."""
+
+        removed: Set[str] = set()
+        for (commit_hash, component), base_urls in list(self._routes.items()):
+            if commit_hash != record.commit_hash:
+                continue
+            current = {endpoint.base_url.rstrip("/") for endpoint in record.endpoints(component)}
+            removed |= base_urls - current
+            if current:
+                self._routes[(commit_hash, component)] = current
+            else:
+                del self._routes[(commit_hash, component)]
+        still_routed = set().union(*self._routes.values()) if self._routes else set()
+        for base_url in removed - still_routed:
+            self.forget(base_url)
+
+    def forget(self, base_url: str) -> None:
+        self.heartbeats.forget(base_url)
+        state = self._state.get(base_url)
+        if state is None:
+            return
+        if state.outstanding:
+            state.retired = True  # dropped when its last request is released
+        else:
+            del self._state[base_url]
+
+    def record(self, base_url: str, *, ok: bool) -> None:
+        state = self._state.get(base_url)
+        if state is None or state.retired:
+            return
+        if ok:
+            state.failures = 0
+            state.ejected_until = 0.0
+            return
+        state.failures += 1
+        if state.failures >= self.settings.proxy_eject_after_failures:
+            if state.ejected_until <= time.monotonic():
+                state.ejections += 1
+            state.ejected_until = time.monotonic() + self.settings.proxy_eject_seconds
+
+    async def probe(self, client: httpx.AsyncClient) -> None:
+        """Actively check every registered replica that has carried traffic."""
+
+        base_urls = [url for url, state in self._state.items() if not state.retired]
+        path = self.settings.proxy_health_check_path.lstrip("/")
+
+        async def check(base_url: str) -> None:
+            url = f"{base_url}/{path}" if path else base_url
+            try:
+                resp = await client.get(url)
+                ok = resp.status_code < 500
+            except httpx.HTTPError:
+                ok = False
+            self.record(base_url, ok=ok)
+
+        await asyncio.gather(*(check(base_url) for base_url in base_urls))
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        now = time.monotonic()
+        return {
+            base_url: {
+                "outstanding": state.outstanding,
+                "consecutive_failures": state.failures,
+                "ejected": state.ejected_until > now,
+                "ejections": state.ejections,
+                "expired": state.expired,
+            }
+            for base_url, state in self._state.items()
+        }
+
+    def _state_for(self, replica: Replica) -> _ReplicaState:
+        return self._state.setdefault(replica.base_url, _ReplicaState())
+
+    def _is_fresh(self, replica: Replica) -> bool:
+        ttl = self.settings.replica_heartbeat_ttl
+        if ttl is None:
+            return True
+        age = (datetime.utcnow() - self.heartbeats.last_seen(replica.endpoint)).total_seconds()
+        self._state_for(replica).expired = age > ttl
+        return age <= ttl
@@ -2,19 +2,34 @@
 
 from __future__ import annotations
 
+import asyncio
 from datetime import datetime
-from typing import Literal, Optional
+from typing import AsyncIterator, Awaitable, Callable, Literal, Optional
 
 import httpx
-from fastapi import Depends, FastAPI, HTTPException, Request, Response
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
+from starlette.background import BackgroundTask
 
 from ..config import AgentSettings
 from ..logging_utils import configure_logging, log_event
-from ..registry import ServiceEndpoint, VersionRecord, VersionRegistry
+from ..registry import COMPONENTS, VersionRecord, open_registry
+from .routing import (
+    LoadBalancer,
+    NoLiveReplica,
+    Replica,
+    Route,
+    RouteCache,
+    UpstreamPools,
+    forward_headers,
+)
 
 app = FastAPI(title="Version Manager", version="0.1.0")
 
+# Upstream answers that count as a failed attempt for passive health checks.
+UNHEALTHY_STATUSES = frozenset({502, 503, 504})
+
 
 class RegisterServiceRequest(BaseModel):
     version: str
@@ -32,37 +47,181 @@ class RegisterServiceResponse(BaseModel):
     base_url: str
 
 
+class DeregisterServiceRequest(BaseModel):
+    commit_hash: str
+    component: Literal["runner", "tuner", "architect"]
+    base_url: str
+
+
+class HeartbeatRequest(BaseModel):
+    commit_hash: str
+    component: Literal["runner", "tuner", "architect"]
+    base_url: str
+
+
 class VersionManagerService:
     def __init__(self) -> None:
         self.settings = AgentSettings()
-        self.registry = VersionRegistry(self.settings.registry_file)
+        self.registry = open_registry(self.settings)
         self.logger = configure_logging("version-manager")
-        self._client = httpx.AsyncClient(timeout=30)
+        self.routes = RouteCache()
+        self.registry.subscribe(self.routes.invalidate_record)
+        self.pools = UpstreamPools(self.settings)
+        self.balancer = LoadBalancer(self.settings)
+        self.registry.subscribe(self.balancer.sync_record)
+        self._tasks: list[asyncio.Task] = []
 
     async def aclose(self) -> None:
-        await self._client.aclose()
+        for task in self._tasks:
+            task.cancel()
+        self._tasks.clear()
+        await self.pools.aclose()
+        self.flush_heartbeats()
+        self.registry.close()
 
     async def proxy(self, version: str, component: str, path_suffix: str, request: Request) -> Response:
-        record = self._resolve_record(version)
-        if component not in {"runner", "tuner", "architect"}:
-            raise HTTPException(status_code=404, detail="Unknown component")
-        endpoint = getattr(record, component, None)
-        if not isinstance(endpoint, ServiceEndpoint):
-            raise HTTPException(status_code=404, detail=f"{component} not registered for {version}")
-        url = endpoint.base_url.rstrip("/")
-        if path_suffix:
-            url = f"{url}/{path_suffix}"
+        route = self._upstream_route(version, component)
         try:
-            resp = await self._client.request(
+            replica = self.balancer.choose(route)
+        except NoLiveReplica as err:
+            raise HTTPException(
+                status_code=503, detail=f"No live {component} replica for {version}"
+            ) from err
+        url = f"{replica.base_url}/{path_suffix}" if path_suffix else replica.base_url
+        headers = forward_headers(request.headers.items(), drop=("host",))
+        params = list(request.query_params.multi_items())
+        origin = self.pools.origin_for(replica.base_url)
+        client = self.pools.acquire(origin)
+        self.balancer.acquire(replica)
+        settled = False
+
+        def settle(*, ok: Optional[bool], pool_timeout: bool = False) -> None:
+            nonlocal settled
+            if not settled:
+                settled = True
+                self.pools.release(origin, pool_timeout=pool_timeout)
+                self.balancer.release(replica, ok=ok)
+
+        if not self.settings.proxy_streaming:
+            try:
+                resp = await client.request(
+                    request.method, url, content=await request.body(), headers=headers, params=params
+                )
+            except httpx.PoolTimeout as err:
+                settle(ok=None, pool_timeout=True)
+                raise HTTPException(status_code=503, detail=f"Upstream pool exhausted: {err}") from err
+            except httpx.HTTPError as err:
+                settle(ok=False)
+                raise HTTPException(status_code=502, detail=str(err)) from err
+            except (httpx.InvalidURL, ValueError) as err:
+                # The client's path, query or headers cannot form an upstream request.
+                settle(ok=None)
+                raise HTTPException(status_code=400, detail=f"Invalid request: {err}") from err
+            except BaseException:
+                settle(ok=None)
+                raise
+            settle(ok=resp.status_code not in UNHEALTHY_STATUSES)
+            # `resp.content` is already decoded, so the upstream framing headers no longer apply.
+            response = Response(content=resp.content, status_code=resp.status_code)
+            upstream_headers = forward_headers(
+                resp.headers.multi_items(), drop=("content-encoding", "content-length")
+            )
+            return _with_headers(response, upstream_headers)
+
+        has_body = "content-length" in request.headers or "transfer-encoding" in request.headers
+        try:
+            upstream_request = client.build_request(
                 request.method,
                 url,
-                content=await request.body(),
-                headers={k: v for k, v in request.headers.items() if k.lower() != "host"},
-                params=list(request.query_params.multi_items()),
+                content=request.stream() if has_body else None,
+                headers=headers,
+                params=params,
             )
+            resp = await client.send(upstream_request, stream=True)
+        except httpx.PoolTimeout as err:
+            settle(ok=None, pool_timeout=True)
+            raise HTTPException(status_code=503, detail=f"Upstream pool exhausted: {err}") from err
         except httpx.HTTPError as err:
+            settle(ok=False)
             raise HTTPException(status_code=502, detail=str(err)) from err
-        return Response(content=resp.content, status_code=resp.status_code, headers=dict(resp.headers))
+        except (httpx.InvalidURL, ValueError) as err:
+            # The client's path, query or headers cannot form an upstream request.
+            settle(ok=None)
+            raise HTTPException(status_code=400, detail=f"Invalid request: {err}") from err
+        except BaseException:
+            settle(ok=None)
+            raise
+        status_ok = resp.status_code not in UNHEALTHY_STATUSES
+
+        async def finish(ok: bool = True) -> None:
+            if not settled:
+                settle(ok=ok and status_ok)
+                await resp.aclose()
+
+        response = StreamingResponse(
+            self._relay(resp, url, finish),
+            status_code=resp.status_code,
+            background=BackgroundTask(finish),
+        )
+        return _with_headers(response, forward_headers(resp.headers.multi_items()))
+
+    async def _relay(
+        self, resp: httpx.Response, url: str, finish: Callable[[bool], Awaitable[None]]
+    ) -> AsyncIterator[bytes]:
+        """Yield raw upstream chunks as the client consumes them.
+
+        The ASGI server only pulls the next chunk once the previous one was sent, so
+        a slow client throttles the upstream read instead of buffering in memory. A
+        client disconnect cancels the response task, and `finally` releases the
+        upstream connection. An upstream failure mid-body is re-raised so the server
+        aborts the connection rather than ending a truncated body cleanly.
+        """
+
+        ok = True
+        try:
+            async for chunk in resp.aiter_raw():
+                yield chunk
+        except httpx.HTTPError as err:
+            ok = False
+            log_event(self.logger, "proxy_stream_aborted", url=url, error=str(err))
+            raise
+        finally:
+            await finish(ok)
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        self._tasks.append(asyncio.create_task(self._heartbeat_flush_loop()))
+        if self.settings.proxy_health_check_interval:
+            self._tasks.append(asyncio.create_task(self._health_loop()))
+
+    def heartbeat(self, payload: HeartbeatRequest) -> dict:
+        record = self.registry.get_by_commit(payload.commit_hash)
+        target = payload.base_url.rstrip("/")
+        endpoints = record.endpoints(payload.component) if record else []
+        if not any(endpoint.base_url.rstrip("/") == target for endpoint in endpoints):
+            raise HTTPException(status_code=404, detail=f"{payload.base_url} is not registered")
+        seen = self.balancer.heartbeats.beat(payload.commit_hash, payload.component, payload.base_url)
+        return {"last_heartbeat": seen.isoformat(), "ttl": self.settings.replica_heartbeat_ttl}
+
+    def flush_heartbeats(self) -> int:
+        beats = self.balancer.heartbeats.drain()
+        return self.registry.record_heartbeats(beats) if beats else 0
+
+    async def _heartbeat_flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.settings.heartbeat_flush_interval)
+            try:
+                await asyncio.to_thread(self.flush_heartbeats)
+            except Exception as err:  # keep flushing on later ticks
+                log_event(self.logger, "heartbeat_flush_failed", error=str(err))
+
+    async def _health_loop(self) -> None:
+        interval = self.settings.proxy_health_check_interval or 0
+        async with httpx.AsyncClient(timeout=self.settings.proxy_health_check_timeout) as client:
+            while True:
+                await asyncio.sleep(interval)
+                await self.balancer.probe(client)
 
     def register_service(self, payload: RegisterServiceRequest) -> RegisterServiceResponse:
         record = self.registry.register_service(
@@ -93,14 +252,42 @@ class VersionManagerService:
             base_url=payload.base_url,
         )
 
-    def list_versions(self, limit: int, offset: int, since: Optional[datetime]) -> dict:
+    def deregister_service(self, payload: DeregisterServiceRequest) -> dict:
+        record = self.registry.deregister_service(
+            commit_hash=payload.commit_hash, component=payload.component, base_url=payload.base_url
+        )
+        if record is None:
+            raise HTTPException(status_code=404, detail=f"{payload.base_url} is not registered")
+        log_event(
+            self.logger,
+            "service_deregistered",
+            commit=payload.commit_hash,
+            component=payload.component,
+            base_url=payload.base_url,
+        )
+        return {"replicas": [endpoint.base_url for endpoint in record.endpoints(payload.component)]}
+
+    def list_versions(
+        self,
+        limit: int,
+        offset: int,
+        since: Optional[datetime],
+        tags: Optional[list[str]] = None,
+        cursor: Optional[str] = None,
+    ) -> dict:
         total = self.registry.count()
-        records = self.registry.list_versions(limit=limit, offset=offset)
-        if since:
-            records = [record for record in records if record.created_at >= since]
+        try:
+            page = self.registry.page_versions(
+                limit=limit, offset=offset, since=since, tags=tags, cursor=cursor
+            )
+        except ValueError as err:
+            raise HTTPException(status_code=400, detail=str(err)) from err
+        pagination: dict = {"limit": limit, "offset": offset, "total_estimate": total}
+        if page.next_cursor:
+            pagination["next_cursor"] = page.next_cursor
         return {
-            "versions": [self._serialize_record(record) for record in records],
-            "pagination": {"limit": limit, "offset": offset, "total_estimate": total},
+            "versions": [self._serialize_record(record) for record in page.records],
+            "pagination": pagination,
         }
 
     def _serialize_record(self, record: VersionRecord) -> dict:
@@ -120,6 +307,28 @@ class VersionManagerService:
             payload["architect"] = {"rest_endpoint": f"/agent/{record.version}/architect"}
         return payload
 
+    def metrics(self) -> dict:
+        return {
+            "route_cache": self.routes.stats(),
+            "upstream_pools": self.pools.stats(),
+            "replicas": self.balancer.stats(),
+            "heartbeats": self.balancer.heartbeats.stats(),
+        }
+
+    def _upstream_route(self, version: str, component: str) -> Route:
+        route, generation = self.routes.lookup(version, component)
+        if route is not None:
+            return route
+        record = self._resolve_record(version)
+        if component not in COMPONENTS:
+            raise HTTPException(status_code=404, detail="Unknown component")
+        route = tuple(Replica.from_endpoint(endpoint) for endpoint in record.endpoints(component))
+        if not route:
+            raise HTTPException(status_code=404, detail=f"{component} not registered for {version}")
+        self.balancer.track(record.commit_hash, component, route)
+        self.routes.store(version, component, route, generation)
+        return route
+
     def _resolve_record(self, version: str) -> VersionRecord:
         record = self.registry.get_by_commit(version)
         if record:
@@ -130,6 +339,13 @@ class VersionManagerService:
         raise HTTPException(status_code=404, detail=f"Unknown version {version}")
 
 
+def _with_headers(response: Response, headers: list[tuple[str, str]]) -> Response:
+    # Append rather than assign so repeated headers such as Set-Cookie survive.
+    for name, value in headers:
+        response.headers.append(name, value)
+    return response
+
+
 _service = VersionManagerService()
 
 
@@ -138,9 +354,30 @@ def register_service(payload: RegisterServiceRequest) -> RegisterServiceResponse
     return _service.register_service(payload)
 
 
+@app.post("/agents/deregister")
+def deregister_service(payload: DeregisterServiceRequest) -> dict:
+    return _service.deregister_service(payload)
+
+
+@app.post("/agents/heartbeat")
+def heartbeat(payload: HeartbeatRequest) -> dict:
+    return _service.heartbeat(payload)
+
+
 @app.get("/versions")
-def list_versions(limit: int = 50, offset: int = 0, since: Optional[datetime] = None) -> dict:
-    return _service.list_versions(limit=limit, offset=offset, since=since)
+def list_versions(
+    limit: int = 50,
+    offset: int = 0,
+    since: Optional[datetime] = None,
+    tag: Optional[list[str]] = Query(default=None),
+    cursor: Optional[str] = None,
+) -> dict:
+    return _service.list_versions(limit=limit, offset=offset, since=since, tags=tag, cursor=cursor)
+
+
+@app.get("/metrics")
+def metrics() -> dict:
+    return _service.metrics()
 
 
 @app.api_route(
@@ -161,6 +398,11 @@ async def proxy_component(version: str, component: str, path: str, request: Requ
     return await _service.proxy(version, component, path, request)
 
 
+@app.on_event("startup")
+async def _startup() -> None:
+    _service.start()
+
+
 @app.on_event("shutdown")
 async def _shutdown() -> None:
     await _service.aclose()
@@ -0,0 +1,207 @@
+"""Pool of pre-warmed interpreters that run pytest in a forked child per request."""
+
+from __future__ import annotations
+
+import contextlib
+import importlib
+import multiprocessing
+import os
+import queue
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from multiprocessing.connection import Connection
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+
+from .process import CommandResult, run_command
+
+# Libraries the agents' runners, tuners and tests commonly import (design/libraries.md).
+DEFAULT_PRELOAD = (
+    "pytest", "coverage", "jsonschema", "pydantic", "numpy", "sklearn", "optuna", "cma"
+)
+
+
+def pytest_invocation(command: List[str]) -> Tuple[List[str], Optional[str]]:
+    """Split a CI command into pytest arguments and an optional coverage rc file.
+
+    Accepts `pytest ARGS...` and `coverage run --rcfile=RC -m pytest ARGS...`.
+    """
+
+    if Path(command[0]).name.startswith("coverage"):
+        rc = next((arg.split("=", 1)[1] for arg in command if arg.startswith("--rcfile=")), None)
+        return command[command.index("pytest") + 1 :], rc
+    return command[1:], None
+
+
+def _run_forked(
+    workdir: str, args: List[str], coverage_rc: Optional[str], timeout: Optional[float]
+) -> dict:
+    with tempfile.TemporaryFile() as out, tempfile.TemporaryFile() as err:
+        pid = os.fork()
+        if pid == 0:  # child: isolate, run the session, never return into the worker loop
+            code = 1
+            try:
+                os.chdir(workdir)
+                os.dup2(out.fileno(), 1)
+                os.dup2(err.fileno(), 2)
+                import pytest
+
+                if coverage_rc is None:
+                    code = int(pytest.main(args))
+                else:
+                    import coverage
+
+                    cov = coverage.Coverage(config_file=coverage_rc)
+                    cov.start()
+                    try:
+                        code = int(pytest.main(args))
+                    finally:
+                        cov.stop()
+                        cov.save()
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            done, status = os.waitpid(pid, os.WNOHANG)
+            if done:
+                break
+            if deadline is not None and time.monotonic() > deadline:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+                return {"timeout": True}
+            time.sleep(0.005)
+        out.seek(0)
+        err.seek(0)
+        return {
+            "exit_code": os.waitstatus_to_exitcode(status),
+            "stdout": out.read().decode(errors="replace"),
+            "stderr": err.read().decode(errors="replace"),
+        }
+
+
+def _prime_pytest() -> None:
+    """Run one empty session so pytest's plugins and hooks are imported before forking."""
+
+    import pytest
+
+    with tempfile.TemporaryDirectory() as empty:
+        with open(os.devnull, "w") as sink, contextlib.redirect_stdout(sink):
+            pytest.main(["--collect-only", "-q", "-p", "no:cacheprovider", empty])
+
+
+def _worker_main(conn: Connection, preload: List[str]) -> None:
+    for name in preload:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            continue
+    _prime_pytest()
+    conn.send({"ready": True})
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            return
+        if request is None:
+            return
+        conn.send(
+            _run_forked(
+                request["workdir"], request["args"], request["coverage_rc"], request["timeout"]
+            )
+        )
+
+
+class _Worker:
+    def __init__(self, context, preload: List[str]) -> None:
+        self.conn, child = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main, args=(child, preload), daemon=True, name="stg-pytest-worker"
+        )
+        self.process.start()
+        child.close()
+        self.runs = 0
+        self.ready = False
+
+    def wait_ready(self) -> None:
+        if not self.ready:
+            self.conn.recv()
+            self.ready = True
+
+    def stop(self) -> None:
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.kill()
+        self.conn.close()
+
+
+class WarmPytestPool:
+    """Runs pytest sessions in forks of long-lived, pre-imported worker processes.
+
+    Each worker imports `preload` once; every CI invocation forks a fresh child
+    from it, so tests see a clean interpreter without paying start-up and import
+    costs. Workers are replaced after `max_runs` sessions to bound the effects of
+    anything that leaks into the parent. POSIX only.
+    """
+
+    def __init__(
+        self, *, size: int = 1, max_runs: int = 50, preload: Iterable[str] = DEFAULT_PRELOAD
+    ) -> None:
+        self.max_runs = max_runs
+        self.preload = list(preload)
+        self._context = multiprocessing.get_context("spawn")
+        self._idle: "queue.Queue[_Worker]" = queue.Queue()
+        self._closed = False
+        self._lock = threading.Lock()
+        self.recycled = 0
+        for _ in range(size):
+            self._idle.put(_Worker(self._context, self.preload))
+
+    def run(self, command: List[str], cwd: Path, timeout: Optional[float] = None) -> CommandResult:
+        """Run a pytest `command` in `cwd`; raises `subprocess.TimeoutExpired` like `run_command`."""
+
+        args, coverage_rc = pytest_invocation(command)
+        request = {"workdir": str(cwd), "args": args, "coverage_rc": coverage_rc, "timeout": timeout}
+        worker = self._idle.get()
+        try:
+            worker.wait_ready()
+            worker.conn.send(request)
+            reply = worker.conn.recv()
+            worker.runs += 1
+        except (EOFError, OSError):
+            # The worker died (e.g. a crashing preload); fall back to a cold run.
+            self._replace(worker)
+            return run_command(command, cwd=cwd, timeout=timeout)
+        if worker.runs >= self.max_runs:
+            self._replace(worker)
+        else:
+            self._idle.put(worker)
+        if reply.get("timeout"):
+            raise subprocess.TimeoutExpired(command, timeout or 0)
+        return CommandResult(reply["exit_code"], reply["stdout"], reply["stderr"])
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().stop()
+            except queue.Empty:
+                return
+
+    def _replace(self, worker: _Worker) -> None:
+        worker.stop()
+        with self._lock:
+            if self._closed:
+                return
+            self.recycled += 1
+        self._idle.put(_Worker(self._context, self.preload))
@@ -0,0 +1,374 @@
+"""Content-addressed file store shared by committed version workspaces."""
+
+from __future__ import annotations
+
+import errno
+import fcntl
+import os
+import re
+import shutil
+import stat
+import threading
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from git import GitCommandError, Repo
+
+from .config import AgentSettings
+from .git_repo import GitRepository
+
+FICLONE = 0x40049409  # ioctl(dst, FICLONE, src) from <linux/fs.h>
+COMMIT_DIR = re.compile(r"^[0-9a-f]{40}$")
+REGULAR_MODES = {"100644": "", "100755": ".x"}
+NO_REFLINK = {errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS}
+
+
+@dataclass
+class CollectResult:
+    versions_removed: int = 0
+    blobs_removed: int = 0
+    bytes_freed: int = 0
+
+
+def _clone_file(source: Path, destination: Path) -> None:
+    """Create `destination` as a copy-on-write clone of `source` (btrfs, XFS, ...)."""
+
+    with source.open("rb") as src, destination.open("wb") as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+
+class WorkspaceStore:
+    """Deduplicates committed version trees into `<workspace_root>/.store/blobs`.
+
+    Files are keyed by their git blob id (plus an executable marker) and version
+    directories link to the cached copy with reflinks where the filesystem
+    supports them and read-only hardlinks otherwise. Only tracked, unmodified
+    files are shared; `state/`, `logs/` and other ignored paths stay private to
+    each workspace.
+    """
+
+    def __init__(self, settings: AgentSettings) -> None:
+        self.mode = settings.workspace_dedup
+        self.workspace_root = settings.workspace_root
+        self.blobs = settings.workspace_root / ".store" / "blobs"
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    def blob_path(self, key: str) -> Path:
+        return self.blobs / key[:2] / key
+
+    def ingest(self, root: Path) -> int:
+        """Replace tracked files under `root` with links into the blob cache.
+
+        Returns the number of files now backed by the cache.
+        """
+
+        if not self.enabled:
+            return 0
+        repo = Repo(root)
+        modified = set(repo.git.diff("--name-only", "-z").split("\0"))
+        linked = 0
+        for key, rel in self._tracked(repo):
+            if rel in modified:
+                continue
+            target = root / rel
+            if not target.is_file() or target.is_symlink():
+                continue
+            blob = self.blob_path(key)
+            if not blob.exists():
+                self._adopt(target, blob)
+            self._link(blob, target)
+            linked += 1
+        self._refresh(repo)
+        return linked
+
+    def materialize(self, repo: GitRepository, commit: str, destination: Path) -> GitRepository:
+        """Check out `commit` at `destination` as a worktree populated from the cache."""
+
+        if not self.enabled:
+            return repo.add_worktree(destination, commit)
+        if destination.exists():
+            repo.remove_worktree(destination)
+        repo.repo.git.worktree("prune")
+        repo.repo.git.worktree("add", "--no-checkout", "--detach", str(destination), commit)
+        checkout = Repo(destination)
+        listing = checkout.git.ls_tree("-r", "-z", "--full-tree", commit)
+        for entry in filter(None, listing.split("\0")):
+            meta, rel = entry.split("\t", 1)
+            mode, kind, sha = meta.split()
+            target = destination / rel
+            target.parent.mkdir(parents=True, exist_ok=True)
+            if mode == "120000":
+                os.symlink(os.fsdecode(checkout.odb.stream(bytes.fromhex(sha)).read()), target)
+            elif kind == "blob" and mode in REGULAR_MODES:
+                blob = self.blob_path(sha + REGULAR_MODES[mode])
+                if not blob.exists():
+                    self._write_blob(checkout, sha, mode, blob)
+                self._link(blob, target)
+        checkout.git.read_tree(commit)
+        self._refresh(checkout)
+        return GitRepository(checkout)
+
+    def collect(self, live_commits: Iterable[str]) -> CollectResult:
+        """Delete version directories outside `live_commits` and unreferenced blobs.
+
+        The repository that owns the shared object store (the one whose `.git`
+        is a directory) is always kept, even when no record points at it.
+        """
+
+        live = set(live_commits)
+        result = CollectResult()
+        owners: Set[Path] = set()
+        referenced: Set[str] = set()
+        for path in self.version_dirs():
+            if (path / ".git").is_dir():
+                owners.add(path)
+            elif path.name not in live:
+                shutil.rmtree(path, ignore_errors=True)
+                result.versions_removed += 1
+                continue
+            referenced.update(key for key, _ in self._tracked(Repo(path)))
+        for owner in owners:
+            Repo(owner).git.worktree("prune")
+        if self.blobs.exists():
+            for blob in self.blobs.glob("*/*"):
+                if blob.name in referenced or blob.name.startswith("."):
+                    continue
+                result.bytes_freed += blob.stat().st_size
+                blob.unlink()
+                result.blobs_removed += 1
+        return result
+
+    def stats(self) -> Dict[str, int]:
+        blobs = list(self.blobs.glob("*/*")) if self.blobs.exists() else []
+        return {"blobs": len(blobs), "bytes": sum(blob.stat().st_size for blob in blobs)}
+
+    def owners(self) -> List[Path]:
+        """Workspaces holding a real `.git` directory, i.e. the shared object stores."""
+
+        return [path for path in self.version_dirs() if (path / ".git").is_dir()]
+
+    def version_dirs(self) -> Iterator[Path]:
+        if not self.workspace_root.exists():
+            return
+        for path in sorted(self.workspace_root.iterdir()):
+            if path.is_dir() and COMMIT_DIR.match(path.name) and (path / ".git").exists():
+                yield path
+
+    @staticmethod
+    def _tracked(repo: Repo) -> Iterator[Tuple[str, str]]:
+        listing = repo.git.ls_files("-s", "-z")
+        for entry in filter(None, listing.split("\0")):
+            meta, rel = entry.split("\t", 1)
+            mode, sha, _ = meta.split()
+            if mode in REGULAR_MODES:
+                yield sha + REGULAR_MODES[mode], rel
+
+    def _adopt(self, target: Path, blob: Path) -> None:
+        """Seed the cache with `target`'s content and freeze it read-only."""
+
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        staged = blob.with_name(f".{blob.name}.{os.getpid()}")
+        shutil.copy2(target, staged)
+        self._freeze(staged)
+        os.replace(staged, blob)
+
+    def _write_blob(self, repo: Repo, sha: str, mode: str, blob: Path) -> None:
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        staged = blob.with_name(f".{blob.name}.{os.getpid()}")
+        staged.write_bytes(repo.odb.stream(bytes.fromhex(sha)).read())
+        if mode == "100755":
+            staged.chmod(0o755)
+        self._freeze(staged)
+        os.replace(staged, blob)
+
+    @staticmethod
+    def _freeze(path: Path) -> None:
+        # Hardlinked workspaces share this inode, so in-place edits must fail loudly.
+        path.chmod(stat.S_IMODE(path.stat().st_mode) & ~0o222)
+
+    def _link(self, blob: Path, target: Path) -> None:
+        staged = target.with_name(f".{target.name}.{os.getpid()}.link")
+        staged.unlink(missing_ok=True)
+        if self.mode in ("auto", "reflink"):
+            try:
+                _clone_file(blob, staged)
+                shutil.copymode(blob, staged)
+                os.replace(staged, target)
+                return
+            except OSError as err:
+                staged.unlink(missing_ok=True)
+                if self.mode == "reflink" or err.errno not in NO_REFLINK:
+                    raise
+                self.mode = "hardlink"
+        os.link(blob, staged)
+        os.replace(staged, target)
+
+    @staticmethod
+    def _refresh(repo: Repo) -> None:
+        # Linking changes inode/ctime; refresh the index so `git status` stays cheap.
+        try:
+            repo.git.update_index("-q", "--refresh")
+        except GitCommandError:
+            pass
+
+
+def _private_bytes(root: Path) -> int:
+    """Bytes that removing `root` would free (files not hardlinked elsewhere)."""
+
+    total = 0
+    for dirpath, _, files in os.walk(root):
+        for name in files:
+            info = os.lstat(os.path.join(dirpath, name))
+            if info.st_nlink == 1:
+                total += info.st_size
+    return total
+
+
+class WorkspaceCache:
+    """Keeps recently used version workspaces on disk within a byte budget.
+
+    Evicted versions keep only their commit (pinned under `refs/versions/`) in
+    the repository that owns the shared object store; their `state/` and
+    `logs/` directories are parked under `.store/parked/<commit>` and restored
+    when the version is checked out again. Repositories owning an object store,
+    workspaces pinned by a running job and versions for which `in_use` is true
+    (such as those with a registered Runner or Tuner) are never evicted.
+    """
+
+    def __init__(
+        self,
+        settings: AgentSettings,
+        store: WorkspaceStore,
+        *,
+        in_use: Optional[Callable[[str], bool]] = None,
+    ) -> None:
+        self.settings = settings
+        self.store = store
+        self.in_use = in_use or (lambda commit: False)
+        self.budget = settings.workspace_disk_budget
+        self.parked = settings.workspace_root / ".store" / "parked"
+        self._resident: "OrderedDict[str, int]" = OrderedDict()
+        self._pins: Counter = Counter()
+        self._guard = threading.RLock()
+        self._loaded = False
+
+    def path_for(self, commit: str) -> Path:
+        return self.settings.workspace_root / commit
+
+    def is_resident(self, commit: str) -> bool:
+        return self.path_for(commit).exists()
+
+    def can_restore(self, commit: str) -> bool:
+        return self._owner_of(commit) is not None
+
+    @contextmanager
+    def pin(self, commit: str) -> Iterator[None]:
+        """Keep `commit` resident (never evicted) while the block runs."""
+
+        with self._guard:
+            self._pins[commit] += 1
+        try:
+            yield
+        finally:
+            with self._guard:
+                self._pins[commit] -= 1
+                if self._pins[commit] <= 0:
+                    del self._pins[commit]
+
+    def ensure(self, commit: str) -> Path:
+        path = self.path_for(commit)
+        with self._guard:
+            self._load()
+            if not path.exists():
+                owner = self._owner_of(commit)
+                if owner is None:
+                    raise FileNotFoundError(f"No repository holds commit {commit}")
+                self.store.materialize(GitRepository(Repo(owner)), commit, path)
+                self._unpark(commit, path)
+            self._resident[commit] = _private_bytes(path)
+            self._resident.move_to_end(commit)
+        return path
+
+    def admit(self, path: Path) -> List[str]:
+        """Record a freshly committed workspace, then evict down to the budget."""
+
+        with self._guard:
+            self._load()
+            self._resident[path.name] = _private_bytes(path)
+            self._resident.move_to_end(path.name)
+        return self.enforce()
+
+    def enforce(self) -> List[str]:
+        if self.budget is None:
+            return []
+        evicted: List[str] = []
+        with self._guard:
+            self._load()
+            total = sum(self._resident.values())
+            for commit in list(self._resident):
+                if total <= self.budget:
+                    break
+                path = self.path_for(commit)
+                if self._pins[commit] or (path / ".git").is_dir() or self.in_use(commit):
+                    continue
+                owner = self._owner_of(commit)
+                if owner is None:
+                    continue
+                total -= self._resident.pop(commit)
+                self._evict(commit, path, GitRepository(Repo(owner)))
+                evicted.append(commit)
+        return evicted
+
+    def reload(self) -> None:
+        """Forget tracked sizes; the next call rescans the workspace root."""
+
+        with self._guard:
+            self._resident.clear()
+            self._loaded = False
+
+    def stats(self) -> Dict[str, Optional[int]]:
+        with self._guard:
+            return {
+                "resident": len(self._resident),
+                "resident_bytes": sum(self._resident.values()),
+                "budget_bytes": self.budget,
+            }
+
+    def _load(self) -> None:
+        if self._loaded:
+            return
+        dirs = sorted(self.store.version_dirs(), key=lambda path: path.stat().st_mtime)
+        for path in dirs:
+            self._resident[path.name] = _private_bytes(path)
+        self._loaded = True
+
+    def _owner_of(self, commit: str) -> Optional[Path]:
+        for owner in self.store.owners():
+            if GitRepository(Repo(owner)).has_commit(commit):
+                return owner
+        return None
+
+    def _evict(self, commit: str, path: Path, owner: GitRepository) -> None:
+        parked = self.parked / commit
+        for name in (self.settings.state_dirname, self.settings.logs_dirname):
+            if (path / name).exists():
+                parked.mkdir(parents=True, exist_ok=True)
+                shutil.rmtree(parked / name, ignore_errors=True)
+                shutil.move(str(path / name), str(parked / name))
+        owner.keep(commit)
+        owner.remove_worktree(path)
+
+    def _unpark(self, commit: str, path: Path) -> None:
+        parked = self.parked / commit
+        if not parked.exists():
+            return
+        for child in parked.iterdir():
+            shutil.rmtree(path / child.name, ignore_errors=True)
+            shutil.move(str(child), str(path / child.name))
+        parked.rmdir()
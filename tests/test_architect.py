@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+import asyncio
+import importlib
+from pathlib import Path
+
+import pytest
+
+from scalable_textgrad.codex_client import CodexResult
+from scalable_textgrad.git_repo import GitRepository
+
+
+class RecordingCodex:
+    """Codex stand-in that appends each prompt to a file in the workspace."""
+
+    def __init__(self) -> None:
+        self.prompts: list[str] = []
+        self.resumed: list[str | None] = []
+        self.expired: set[str] = set()
+
+    def run(self, prompt: str, workdir: Path, resume: str | None = None, **_: object) -> CodexResult:
+        self.prompts.append(prompt)
+        self.resumed.append(resume)
+        if resume in self.expired:
+            return CodexResult(exit_code=1, stdout="", stderr="session not found")
+        with (Path(workdir) / "notes.txt").open("a") as handle:
+            handle.write(f"{len(self.prompts)}\n")
+        session = resume or f"session-{len(self.prompts)}"
+        return CodexResult(exit_code=0, stdout="", stderr="", last_message="ok", session_id=session)
+
+
+def architect_module():
+    # Imported lazily: the module builds its global service from the environment.
+    return importlib.import_module("scalable_textgrad.architect.service")
+
+
+@pytest.fixture
+def architect(tmp_path, monkeypatch):
+    monkeypatch.setenv("STG_WORKSPACE_ROOT", str(tmp_path / "agents"))
+    module = architect_module()
+    service = module.ArchitectService()
+    service.codex = RecordingCodex()
+    started = service.start_agent(module.StartAgentRequest(description="demo"))
+    return service, started
+
+
+def test_coalesces_feedback_for_same_version(architect):
+    service, started = architect
+    module = architect_module()
+    service.settings.architect_coalesce_window = 0.2
+
+    async def scenario():
+        requests = [module.ArchitectChatRequest(message=f"feedback {idx}") for idx in range(3)]
+        jobs = [service.submit_chat(started.commit_hash, request) for request in requests]
+        assert len({job.id for job in jobs}) == 1
+        return await service.outcome(jobs[0]), jobs[0]
+
+    result, job = asyncio.run(scenario())
+    assert result["result"] == "committed"
+    assert job.merged == 3
+    assert len(service.codex.prompts) == 2  # bootstrap + one merged feedback run
+    assert all(f"feedback {idx}" in service.codex.prompts[-1] for idx in range(3))
+    assert service.registry.get_by_commit(result["commit_hash"]).version == "0.0.1"
+
+
+def test_feedback_stages_linked_worktrees(architect):
+    service, started = architect
+    module = architect_module()
+
+    async def chat(version: str, message: str):
+        return await service.handle_chat(version, module.ArchitectChatRequest(message=message))
+
+    first = asyncio.run(chat(started.commit_hash, "first"))
+    second = asyncio.run(chat(first.commit_hash, "second"))
+
+    root = service.settings.workspace_root
+    for response in (first, second):
+        workspace = root / response.commit_hash
+        # Linked worktrees carry a `.git` file pointing at the shared object store.
+        assert (workspace / ".git").is_file()
+        assert not (root / f"{response.commit_hash}{service.settings.staging_suffix}").exists()
+    repo = GitRepository.open(root / second.commit_hash)
+    assert repo.repo.head.commit.parents[0].hexsha == first.commit_hash
+    assert (root / second.commit_hash / "notes.txt").read_text() == "1\n2\n3\n"
+
+
+def test_evicted_versions_are_checked_out_on_demand(architect):
+    service, started = architect
+    module = architect_module()
+    service.workspaces.budget = 0  # keep nothing but the repository owning the objects
+    root = service.settings.workspace_root
+
+    async def chat(version: str, message: str):
+        return await service.handle_chat(version, module.ArchitectChatRequest(message=message))
+
+    first = asyncio.run(chat(started.commit_hash, "first"))
+    assert not (root / first.commit_hash).exists()
+    assert (root / started.commit_hash).exists()
+
+    workspace = service.workspaces.ensure(first.commit_hash)
+    (workspace / "state").mkdir()
+    (workspace / "state" / "active.state.json").write_text("{}")
+    assert service.workspaces.enforce() == [first.commit_hash]
+
+    second = asyncio.run(chat(first.commit_hash, "second"))
+    assert second.result == "committed"
+    assert (root / first.commit_hash / "state" / "active.state.json").read_text() == "{}"
+    assert not (root / second.commit_hash).exists()
+    restored = service.workspaces.ensure(second.commit_hash)
+    assert (restored / "notes.txt").read_text() == "1\n2\n3\n"
+
+
+def test_versions_with_registered_endpoints_are_never_evicted(architect):
+    service, started = architect
+    module = architect_module()
+    service.workspaces.budget = 0
+    first = asyncio.run(
+        service.handle_chat(started.commit_hash, module.ArchitectChatRequest(message="first"))
+    )
+    workspace = service.workspaces.ensure(first.commit_hash)
+    service.registry.register_service(
+        commit_hash=first.commit_hash, version="0.0.1", component="runner", base_url="http://runner"
+    )
+    assert service.workspaces.enforce() == []
+    assert workspace.exists()
+
+    service.registry.deregister_service(
+        commit_hash=first.commit_hash, component="runner", base_url="http://runner"
+    )
+    assert service.workspaces.enforce() == [first.commit_hash]
+
+
+def test_feedback_resumes_the_codex_session_of_its_lineage(architect):
+    service, started = architect
+    module = architect_module()
+
+    def chat(version: str) -> str:
+        request = module.ArchitectChatRequest(message="more")
+        return asyncio.run(service.handle_chat(version, request)).commit_hash
+
+    child = chat(started.commit_hash)
+    sibling = chat(started.commit_hash)
+    grandchild = chat(child)
+    assert service.codex.resumed[1:] == ["session-1", None, "session-1"]
+    assert service.registry.get_by_commit(sibling) is not None
+
+    service.codex.expired.add("session-1")
+    latest = service.settings.paths_for(service.settings.workspace_root / chat(grandchild))
+    assert service.codex.resumed[-2:] == ["session-1", None]  # expired, retried fresh
+    assert module.load_metadata(latest.metadata_file).codex_session == "session-6"
+
+
+def test_bootstrap_and_feedback_schedule_codex_as_one_agent(tmp_path, monkeypatch):
+    monkeypatch.setenv("STG_WORKSPACE_ROOT", str(tmp_path / "agents"))
+    module = architect_module()
+    service = module.ArchitectService()
+    service.codex = RecordingCodex()
+    agents = []
+    slot = service.codex_slots.slot
+    record = lambda agent, priority: agents.append(agent) or slot(agent, priority)  # noqa: E731
+    monkeypatch.setattr(service.codex_slots, "slot", record)
+    started = service.start_agent(module.StartAgentRequest(description="demo"))
+    request = module.ArchitectChatRequest(message="more")
+    asyncio.run(service.handle_chat(started.commit_hash, request))
+    repo = GitRepository.open(Path(started.workspace))
+    assert agents == [repo.root_commit()] * 2
+    assert service.codex_slots._served == {}
@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+
+import pytest
+from fastapi import HTTPException
+from pydantic import BaseModel
+
+
+class Outcome(BaseModel):
+    value: int
+
+
+def test_jobs_run_bounded_and_report_progress(tmp_path, monkeypatch) -> None:
+    # The architect package builds its service on import; keep its workspace out of the repo.
+    monkeypatch.setenv("STG_WORKSPACE_ROOT", str(tmp_path / "agents"))
+    from scalable_textgrad.architect.jobs import JobQueue, JobStatus, QueueFull
+
+    active = 0
+    peak = 0
+    guard = threading.Lock()
+
+    def work(value: int):
+        def run(progress) -> Outcome:
+            nonlocal active, peak
+            with guard:
+                active += 1
+                peak = max(peak, active)
+            progress("codex", value=value)
+            time.sleep(0.05)
+            with guard:
+                active -= 1
+            if value < 0:
+                raise HTTPException(status_code=409, detail="conflict")
+            return Outcome(value=value)
+
+        return run
+
+    async def scenario() -> None:
+        queue = JobQueue(concurrency=2, max_pending=5, history=10)
+        jobs = [queue.submit("chat", work(idx)) for idx in range(4)]
+        failing = queue.submit("chat", work(-1))
+        with pytest.raises(QueueFull):
+            queue.submit("chat", work(99))
+        assert all(job.status is JobStatus.QUEUED for job in jobs)
+
+        stages = [event.stage async for event in queue.events(jobs[0].id)]
+        assert stages == ["started", "codex", "succeeded"]
+        for idx, job in enumerate(jobs):
+            done = await queue.wait(job.id)
+            assert done.result == {"value": idx}
+        failed = await queue.wait(failing.id)
+        assert failed.status is JobStatus.FAILED
+        assert failed.error == {"status_code": 409, "detail": "conflict"}
+        assert queue.stats()["pending"] == 0
+        queue.shutdown()
+
+    asyncio.run(scenario())
+    assert peak == 2
+
+
+def test_job_slots_go_to_bootstrap_before_feedback(tmp_path, monkeypatch) -> None:
+    monkeypatch.setenv("STG_WORKSPACE_ROOT", str(tmp_path / "agents"))
+    from scalable_textgrad.architect.jobs import JobQueue, QueueFull
+
+    order = []
+
+    def work(value: int):
+        def run(progress) -> Outcome:
+            order.append(value)
+            time.sleep(0.05)
+            return Outcome(value=value)
+
+        return run
+
+    async def scenario() -> None:
+        queue = JobQueue(concurrency=1, max_pending=4, history=10)
+        jobs = [queue.submit("chat", work(0), priority=1)]
+        await asyncio.sleep(0.01)  # the first job holds the only slot
+        jobs.append(queue.submit("chat", work(2), priority=2))
+        jobs.append(queue.submit("chat", work(1), priority=1))
+        jobs.append(queue.submit("start", work(-1), priority=0))
+        assert queue.stats()["queued_by_kind"] == {"chat": 2, "start": 1}
+        with pytest.raises(QueueFull) as full:
+            queue.submit("chat", work(9))
+        assert full.value.retry_after >= 1
+        for job in jobs:
+            await queue.wait(job.id)
+        assert queue.stats()["wait_seconds_max"] > 0
+        queue.shutdown()
+
+    asyncio.run(scenario())
+    assert order == [0, -1, 1, 2]
+
+
+def test_codex_scheduler_caps_prioritizes_and_shares_fairly(tmp_path, monkeypatch) -> None:
+    monkeypatch.setenv("STG_WORKSPACE_ROOT", str(tmp_path / "agents"))
+    from scalable_textgrad.architect.scheduler import CodexPriority, CodexScheduler
+
+    scheduler = CodexScheduler(1)
+    order = []
+    release = threading.Event()
+
+    def run(agent: str, priority: CodexPriority, label: str) -> None:
+        with scheduler.slot(agent, priority):
+            order.append(label)
+            if label == "first":
+                release.wait()
+
+    first = threading.Thread(target=run, args=("a", CodexPriority.FEEDBACK, "first"))
+    first.start()
+    while scheduler.stats()["running"] != 1:
+        time.sleep(0.01)
+    waiting = [
+        ("a", CodexPriority.FEEDBACK, "a-feedback"),
+        ("c", CodexPriority.ESCALATION, "c-escalation"),
+        ("b", CodexPriority.FEEDBACK, "b-feedback"),
+        ("d", CodexPriority.BOOTSTRAP, "d-bootstrap"),
+    ]
+    threads = [threading.Thread(target=run, args=args) for args in waiting]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.02)  # fix the arrival order
+    stats = scheduler.stats()
+    assert stats["queue_depth"] == 4
+    assert stats["waiting"] == {"bootstrap": 1, "feedback": 2, "escalation": 1}
+    release.set()
+    for thread in [first, *threads]:
+        thread.join(timeout=5)
+    # "b" was never served, so it goes ahead of "a" despite arriving later.
+    assert order == ["first", "d-bootstrap", "b-feedback", "a-feedback", "c-escalation"]
+    assert scheduler.stats()["granted"] == 5
+
+
+def test_garbage_collection_excludes_workspace_jobs(tmp_path, monkeypatch) -> None:
+    monkeypatch.setenv("STG_WORKSPACE_ROOT", str(tmp_path / "agents"))
+    from scalable_textgrad.architect.jobs import JobQueue
+
+    events = []
+
+    def work(value: int):
+        def run(progress) -> Outcome:
+            events.append(("start", value))
+            time.sleep(0.05)
+            events.append(("end", value))
+            return Outcome(value=value)
+
+        return run
+
+    async def collect() -> None:
+        async with queue.gate.exclusive():
+            events.append(("gc", 0))
+            await asyncio.sleep(0.05)
+            events.append(("gc-end", 0))
+
+    async def scenario() -> None:
+        first = queue.submit("chat", work(1), lock=asyncio.Lock())
+        await asyncio.sleep(0.01)  # running, holds the gate
+        gc = asyncio.create_task(collect())
+        await asyncio.sleep(0.01)
+        # Its workspace lock did not exist when collection started; it still waits.
+        late = queue.submit("chat", work(2), lock=asyncio.Lock())
+        await asyncio.gather(gc, queue.wait(first.id), queue.wait(late.id))
+        queue.shutdown()
+
+    queue = JobQueue(concurrency=2, max_pending=4, history=10)
+    asyncio.run(scenario())
+    assert events == [("start", 1), ("end", 1), ("gc", 0), ("gc-end", 0), ("start", 2), ("end", 2)]
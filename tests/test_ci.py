@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+import os
+import sys
+import time
+
+from scalable_textgrad.ci import CIResultCache, PipelineResult, Step, StepResult, run_pipeline
+from scalable_textgrad.git_repo import GitRepository
+
+
+def sleeper(name: str, seconds: float, **kwargs) -> Step:
+    return Step(name, [sys.executable, "-c", f"import time; time.sleep({seconds})"], **kwargs)
+
+
+def test_pipeline_runs_steps_concurrently_with_timeouts(tmp_path):
+    steps = [
+        sleeper("a", 0.5),
+        sleeper("b", 0.5),
+        sleeper("slow", 5, timeout=0.5),
+        Step.fixed(StepResult("pytest", True, "tests.py missing; skipping", "")),
+    ]
+    started = time.monotonic()
+    result = run_pipeline(tmp_path, steps)
+    assert time.monotonic() - started < 2.5
+    assert [step.name for step in result.steps] == ["a", "b", "slow", "pytest"]
+    assert [step.success for step in result.steps] == [True, True, False, True]
+    assert "timed out" in result.steps[2].stderr
+    assert not result.success
+
+
+def test_unchanged_inputs_skip_step(tmp_path):
+    workdir, cache = tmp_path / "work", tmp_path / "cache"
+    workdir.mkdir()
+    (workdir / "runner.py").write_text("x = 1\n")
+    (workdir / "state").mkdir()
+    step = Step("check", [sys.executable, "-c", "print('ran')"], inputs=("**/*.py", "**/*.json"))
+
+    first = run_pipeline(workdir, [step], cache_dir=cache)
+    assert not first.steps[0].cached
+    # Runtime output under state/ is not an input.
+    (workdir / "state" / "active.state.json").write_text("{}")
+    again = run_pipeline(workdir, [step], cache_dir=cache)
+    assert again.steps[0].cached and again.steps[0].stdout.strip() == "ran"
+
+    (workdir / "runner.py").write_text("x = 2\n")
+    assert not run_pipeline(workdir, [step], cache_dir=cache).steps[0].cached
+
+
+def test_result_cache_hits_and_evicts_least_recent(tmp_path):
+    cache = CIResultCache(tmp_path, max_entries=2)
+    passed = PipelineResult(True, [StepResult("pytest", True, "1 passed", "", duration=2.0)])
+
+    assert cache.get("a") is None
+    cache.put("a", passed, 2.0)
+    cache.put("b", passed, 1.0)
+    assert cache.get("a").steps[0].stdout == "1 passed"  # refreshes "a"
+    os.utime(tmp_path / "b.json", (0, 0))
+    cache.put("c", passed, 1.0)
+
+    assert cache.get("b") is None
+    assert cache.get("c") is not None
+    assert cache.stats() == {"hits": 2, "misses": 2, "hit_rate": 0.5, "saved_seconds": 3.0}
+
+    # Failures are not kept, so a retry of the same tree runs CI again.
+    timed_out = PipelineResult(False, [StepResult("pytest", False, "", "timed out after 5s")])
+    cache.put("d", timed_out, 5.0)
+    assert cache.get("d") is None
+
+
+def test_result_cache_keys_selective_runs_by_their_selection(tmp_path):
+    cache = CIResultCache(tmp_path)
+    passed = PipelineResult(True, [StepResult("pytest", True, "1 passed", "")])
+    full = cache.key("tree", "tools")
+    subset = cache.key("tree", "tools", ["tests.py::test_a"])
+    assert subset != cache.key("tree", "tools", ["tests.py::test_b"])
+
+    cache.put(subset, passed, 1.0)
+    assert cache.get(full, cache.key("tree", "tools", ["tests.py::test_b"])) is None
+    assert cache.get(full, subset) is not None
+    # A passing full run covers any selection.
+    cache.put(full, passed, 1.0)
+    assert cache.get(full, cache.key("tree", "tools", ["tests.py::test_b"])) is not None
+    assert cache.stats()["hits"] == 2 and cache.stats()["misses"] == 1
+
+
+def test_tree_hash_identifies_working_copy(tmp_path):
+    repo = GitRepository.open(tmp_path / "repo")
+    (repo.worktree / "runner.py").write_text("x = 1\n")
+    repo.commit_all("init")
+    staging = repo.add_worktree(tmp_path / "staging")
+    clean = staging.tree_hash()
+    assert clean == repo.repo.head.commit.tree.hexsha
+
+    (staging.worktree / "tuner.py").write_text("y = 2\n")
+    dirty = staging.tree_hash()
+    assert dirty != clean
+    other = repo.add_worktree(tmp_path / "other")
+    (other.worktree / "tuner.py").write_text("y = 2\n")
+    assert other.tree_hash() == dirty
+    assert not staging.repo.index.diff(None) and staging.repo.untracked_files == ["tuner.py"]
@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import signal
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+
+from scalable_textgrad.codex_client import CodexRunner, CodexSessions, CodexTimeout
+from scalable_textgrad.config import AgentSettings
+
+FAKE_CODEX = """\
+import json, os, subprocess, sys, time
+
+def emit(event):
+    print(json.dumps(event), flush=True)
+
+emit({"type": "thread.started", "thread_id": "t-1"})
+if os.environ.get("FAKE_CODEX_DETACH"):
+    # Leaves the process group but keeps stderr open after Codex exits.
+    child = subprocess.Popen(
+        [sys.executable, "-c", "import time; time.sleep(30)"],
+        stdout=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    open(os.environ["FAKE_CODEX_DETACH"], "w").write(str(child.pid))
+if os.environ.get("FAKE_CODEX_CLOSE_STDOUT"):
+    os.close(1)
+    time.sleep(60)
+emit({"type": "turn.started"})
+# An oversized line whose end arrives after the reader already gave up on it.
+sys.stdout.write("x" * 5000)
+sys.stdout.flush()
+time.sleep(0.1)
+print("end-of-long-line", flush=True)
+if os.environ.get("FAKE_CODEX_HANG"):
+    child = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])
+    open(os.environ["FAKE_CODEX_HANG"], "w").write(str(child.pid))
+    time.sleep(60)
+time.sleep(0.5)
+emit({"type": "item.completed", "item": {"type": "agent_message", "text": "done"}})
+emit({"type": "turn.completed", "usage": {"output_tokens": 3}})
+"""
+
+
+def gone(pid: int) -> bool:
+    """True once `pid` has exited (zombies awaiting a reaper count as exited)."""
+
+    try:
+        status = Path(f"/proc/{pid}/status").read_text()
+    except FileNotFoundError:
+        return True
+    return "\nState:\tZ" in status
+
+
+@pytest.fixture
+def runner(tmp_path):
+    script = tmp_path / "codex"
+    script.write_text(f"#!{sys.executable}\n{FAKE_CODEX}")
+    script.chmod(0o755)
+    settings = AgentSettings(
+        workspace_root=tmp_path, codex_command=str(script), codex_max_line_bytes=1024
+    )
+    return CodexRunner(settings)
+
+
+def test_stream_yields_events_as_they_arrive(runner, tmp_path):
+    async def consume():
+        started = time.monotonic()
+        stream = runner.stream("hi", tmp_path)
+        seen = []
+        async for event in stream:
+            seen.append((event["type"], time.monotonic() - started))
+        return stream, seen
+
+    stream, seen = asyncio.run(consume())
+    assert [kind for kind, _ in seen] == [
+        "thread.started",
+        "turn.started",
+        "item.completed",
+        "turn.completed",
+    ]
+    assert seen[1][1] < seen[2][1] - 0.3  # the first events did not wait for the process to end
+    result = stream.result()
+    assert (result.exit_code, result.last_message, stream.dropped_lines) == (0, "done", 1)
+    assert not any("end-of-long-line" in line for line in stream.stdout_tail)
+
+
+def test_run_reports_events_and_times_out(runner, tmp_path, monkeypatch):
+    events = []
+    result = runner.run("hi", tmp_path, json_output=True, on_event=events.append)
+    assert result.exit_code == 0 and len(result.events) == len(events) == 4
+    assert result.session_id == "t-1"
+    assert runner.command("again", resume="t-1")[-3:] == ["resume", "t-1", "again"]
+
+    pid_file = tmp_path / "child.pid"
+    monkeypatch.setenv("FAKE_CODEX_HANG", str(pid_file))
+    with pytest.raises(CodexTimeout):
+        runner.run("hi", tmp_path, json_output=True, timeout=1.0)
+    time.sleep(0.1)
+    # The whole process group is killed, including what Codex spawned.
+    assert gone(int(pid_file.read_text()))
+
+
+def test_cancelling_the_consumer_kills_codex(runner, tmp_path, monkeypatch):
+    pid_file = tmp_path / "child.pid"
+    monkeypatch.setenv("FAKE_CODEX_HANG", str(pid_file))
+
+    async def consume():
+        async for _ in runner.stream("hi", tmp_path):
+            pass
+
+    async def main():
+        task = asyncio.create_task(consume())
+        while not pid_file.exists() or not pid_file.read_text():
+            await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    time.sleep(0.1)
+    assert gone(int(pid_file.read_text()))
+
+
+def test_waits_after_stdout_closes_are_bounded(runner, tmp_path, monkeypatch):
+    monkeypatch.setenv("FAKE_CODEX_CLOSE_STDOUT", "1")
+    started = time.monotonic()
+    with pytest.raises(CodexTimeout):
+        runner.run("hi", tmp_path, timeout=1.0)
+    assert time.monotonic() - started < 5
+    monkeypatch.delenv("FAKE_CODEX_CLOSE_STDOUT")
+
+    pid_file = tmp_path / "detached.pid"
+    monkeypatch.setenv("FAKE_CODEX_DETACH", str(pid_file))
+    started = time.monotonic()
+    try:
+        assert runner.run("hi", tmp_path).exit_code == 0
+        assert time.monotonic() - started < 5
+    finally:
+        os.kill(int(pid_file.read_text()), signal.SIGKILL)
+
+
+def test_failing_callback_kills_codex_immediately(runner, tmp_path, monkeypatch):
+    pid_file = tmp_path / "child.pid"
+    monkeypatch.setenv("FAKE_CODEX_HANG", str(pid_file))
+
+    def on_event(event):
+        if event["type"] == "turn.started":
+            while not pid_file.exists() or not pid_file.read_text():
+                time.sleep(0.05)
+            raise ValueError("consumer failed")
+
+    async def main():
+        with pytest.raises(ValueError):
+            await runner.run_async("hi", tmp_path, json_output=True, on_event=on_event)
+        await asyncio.sleep(0.1)
+        # Checked while the loop is still running, before any generator finalizer.
+        return gone(int(pid_file.read_text()))
+
+    assert asyncio.run(main())
+
+
+def test_sessions_are_claimed_once_across_instances(tmp_path):
+    path = tmp_path / "state" / "sessions.json"
+    CodexSessions(path).advance("t-1", "abc")
+    # One instance per worker process, all sharing the file.
+    workers = [CodexSessions(path) for _ in range(8)]
+    with ThreadPoolExecutor(len(workers)) as pool:
+        claims = list(pool.map(lambda sessions: sessions.claim("t-1", "abc"), workers))
+    assert claims.count(True) == 1
+    workers[0].advance("t-1", "def")
+    assert CodexSessions(path).claim("t-1", "def")
@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import pytest
+
+from scalable_textgrad.ci import run_ci
+from scalable_textgrad.git_repo import GitRepository
+from scalable_textgrad.impact import ImpactAnalyzer
+
+pytest.importorskip("coverage")
+
+RUNNER = """\
+X = 1
+
+
+def a():
+    return 1
+
+
+def b():
+    return 2
+"""
+
+TESTS = """\
+from runner import a, b
+
+
+def test_a():
+    assert a() == 1
+
+
+class TestB:
+    def test_b(self):
+        assert b() == 2
+"""
+
+
+@pytest.fixture
+def lineage(tmp_path):
+    """A committed version with recorded coverage, plus a fresh staging worktree."""
+
+    base = GitRepository.open(tmp_path / "base")
+    (base.worktree / "runner.py").write_text(RUNNER)
+    (base.worktree / "tests.py").write_text(TESTS)
+    base.commit_all("bootstrap")
+    analyzer = ImpactAnalyzer(tmp_path / "impact")
+
+    plan = analyzer.plan(base.head, base)
+    assert plan.tests is None
+    assert run_ci(base.worktree, coverage_rc=plan.coverage_rc).success
+    impact = analyzer.record(plan, base.worktree)
+    analyzer.discard(plan)
+    analyzer.save(base.head, impact)
+    assert impact["tests"]["tests.py::TestB::test_b"]["runner.py"] == ["b"]
+    return analyzer, base, base.add_worktree(tmp_path / "staging")
+
+
+def edit(repo: GitRepository, name: str, old: str, new: str) -> None:
+    path: Path = repo.worktree / name
+    path.write_text(path.read_text().replace(old, new))
+
+
+def test_selects_tests_that_ran_changed_functions(lineage):
+    analyzer, base, staging = lineage
+    edit(staging, "runner.py", "return 2", "return 1 + 1")
+    (staging.worktree / "README.md").write_text("docs\n")
+
+    plan = analyzer.plan(base.head, staging)
+    assert plan.tests == ["tests.py::TestB::test_b"]
+    # Selective runs are not recorded, so they stay shardable and step-cacheable.
+    assert plan.coverage_rc is None
+    result = run_ci(staging.worktree, tests=plan.tests, coverage_rc=plan.coverage_rc)
+    assert result.success and "1 passed" in result.steps[-1].stdout
+    impact = analyzer.record(plan, staging.worktree)
+    analyzer.discard(plan)
+    assert impact["selective_runs"] == 1
+    assert set(impact["tests"]) == {"tests.py::test_a", "tests.py::TestB::test_b"}
+    assert impact["stale"] == ["tests.py::TestB::test_b"]
+
+    # test_b's map may be out of date now; it runs with every change until a full run.
+    staging.commit_all("b")
+    analyzer.save(staging.head, impact)
+    edit(staging, "runner.py", "return 1\n", "return 0 + 1\n")
+    assert analyzer.plan(staging.head, staging).tests == [
+        "tests.py::TestB::test_b",
+        "tests.py::test_a",
+    ]
+
+
+def test_new_tests_and_module_changes(lineage):
+    analyzer, base, staging = lineage
+    edit(staging, "runner.py", "X = 1", "X = 2")
+    with (staging.worktree / "tests.py").open("a") as handle:
+        handle.write("\n\ndef test_new():\n    assert True\n")
+    plan = analyzer.plan(base.head, staging)
+    assert plan.tests == ["tests.py::TestB::test_b", "tests.py::test_a", "tests.py::test_new"]
+    analyzer.discard(plan)
+
+    (staging.worktree / "data.json").write_text("{}")
+    plan = analyzer.plan(base.head, staging)
+    assert plan.tests is None and plan.reason == "data.json changed"
+    analyzer.discard(plan)
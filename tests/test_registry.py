@@ -1,6 +1,17 @@
 from __future__ import annotations
 
-from scalable_textgrad.registry import VersionRegistry
+from datetime import datetime, timezone
+
+import pytest
+
+from scalable_textgrad.registry import (
+    BaseVersionRegistry,
+    JournalStore,
+    JsonFileStore,
+    RegistryStore,
+    SqliteVersionRegistry,
+    VersionRegistry,
+)
 
 
 def test_registry_persists(tmp_path):
@@ -26,3 +37,112 @@ def test_registry_persists(tmp_path):
     assert record.runner.base_url == "http://localhost:9000"
     assert record.changelog_uri == "https://example/changelog"
     assert "stable" in record.tags
+
+
+def test_journal_replays_and_compacts(tmp_path):
+    registry_path = tmp_path / "registry.json"
+    store = JournalStore(registry_path, compact_every=3, background=False)
+    registry = VersionRegistry(registry_path, store=store)
+    for idx in range(4):
+        registry.upsert(commit_hash=f"c{idx}", version=f"0.0.{idx}")
+    registry.upsert(commit_hash="c0", version="0.1.0")
+
+    assert store.journal_path.exists()
+    assert not store.compacting_path.exists()
+    with store.journal_path.open("a") as handle:
+        handle.write('{"op": "put", "record": {"version"')  # torn append
+
+    reopened = VersionRegistry(registry_path, store=JournalStore(registry_path))
+    assert reopened.count() == 4
+    record = reopened.get_by_commit("c0")
+    assert record is not None and record.version == "0.1.0"
+
+    reopened.upsert(commit_hash="c9", version="0.0.9")
+    reopened.store.compact()
+    assert not reopened.store.journal_path.exists()
+    assert VersionRegistry(registry_path).get_by_commit("c9") is not None
+
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_page_versions_filters_before_paginating(tmp_path, backend):
+    if backend == "sqlite":
+        registry = SqliteVersionRegistry(tmp_path / "registry.sqlite3")
+    else:
+        registry = VersionRegistry(tmp_path / "registry.json")
+    created = []
+    for idx in range(6):
+        record = registry.upsert(
+            commit_hash=f"c{idx}", version=f"0.0.{idx}", tags=["stable"] if idx % 2 else []
+        )
+        created.append(record.created_at)
+
+    first = registry.page_versions(limit=2, tags=["stable"])
+    assert [r.commit_hash for r in first.records] == ["c5", "c3"]
+    second = registry.page_versions(limit=2, tags=["stable"], cursor=first.next_cursor)
+    assert [r.commit_hash for r in second.records] == ["c1"]
+    assert second.next_cursor is None
+
+    since = created[3].replace(tzinfo=timezone.utc)
+    recent = registry.page_versions(limit=5, offset=1, since=since)
+    assert [r.commit_hash for r in recent.records] == ["c4", "c3"]
+    assert registry.get_by_version("0.0.2").commit_hash == "c2"
+    registry.close()
+
+
+def test_indexes_follow_updates(tmp_path):
+    registry = VersionRegistry(tmp_path / "registry.json")
+    registry.upsert(commit_hash="a", version="1.0.0", tags=["stable"])
+    registry.upsert(commit_hash="b", version="1.0.0", tags=["stable", "canary"])
+    assert [r.commit_hash for r in registry.list_by_version("1.0.0")] == ["b", "a"]
+    assert registry.get_by_version("1.0.0").commit_hash == "b"
+    assert [r.commit_hash for r in registry.page_versions(tags=["canary", "stable"]).records] == ["b"]
+
+    registry.upsert(commit_hash="b", version="1.1.0", tags=["canary"])
+    assert registry.get_by_version("1.0.0").commit_hash == "a"
+    assert registry.get_by_version("1.1.0").commit_hash == "b"
+    assert [r.commit_hash for r in registry.page_versions(tags=["stable"]).records] == ["a"]
+    assert registry.page_versions(tags=["stable", "canary"]).records == []
+
+    reopened = VersionRegistry(tmp_path / "registry.json")
+    assert [r.commit_hash for r in reopened.page_versions(tags=["canary"]).records] == ["b"]
+    assert [r.commit_hash for r in reopened.list_versions(limit=1, offset=1)] == ["a"]
+
+
+def test_heartbeat_batches_rewrite_the_json_file_once(tmp_path, monkeypatch):
+    from scalable_textgrad import registry as registry_module
+
+    path = tmp_path / "registry.json"
+    registry = VersionRegistry(path, store=JsonFileStore(path))
+    for idx in range(3):
+        registry.register_service(
+            commit_hash=f"c{idx}", version=f"0.0.{idx}", component="runner", base_url="http://r"
+        )
+    writes = []
+    real_write = registry_module._write_snapshot
+    monkeypatch.setattr(
+        registry_module, "_write_snapshot", lambda *args: writes.append(1) or real_write(*args)
+    )
+    seen = datetime(2030, 1, 1)
+    beats = {(f"c{idx}", "runner", "http://r"): seen for idx in range(3)}
+    assert registry.record_heartbeats(beats) == 3
+    assert len(writes) == 1
+    reopened = VersionRegistry(path, store=JsonFileStore(path))
+    assert reopened.get_by_commit("c2").runner.last_heartbeat == seen
+
+
+def test_incomplete_store_fails_when_constructed():
+    class LoadOnly(RegistryStore):
+        def load(self):
+            return []
+
+    with pytest.raises(TypeError):
+        LoadOnly()
+
+
+def test_incomplete_registry_fails_when_constructed():
+    class ReadOnly(BaseVersionRegistry):
+        def count(self):
+            return 0
+
+    with pytest.raises(TypeError):
+        ReadOnly()
@@ -0,0 +1,74 @@
+"""Lookup latency micro-benchmark for the in-memory registry indexes.
+
+Skipped by default; run with `STG_BENCHMARK=1 pytest -s tests/test_registry_benchmark.py`.
+"""
+
+from __future__ import annotations
+
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Callable, List, Mapping
+
+import pytest
+
+from scalable_textgrad.registry import RegistryStore, VersionRecord, VersionRegistry
+
+pytestmark = pytest.mark.skipif(
+    not os.environ.get("STG_BENCHMARK"), reason="set STG_BENCHMARK=1 to run benchmarks"
+)
+
+
+class SyntheticStore(RegistryStore):
+    """Serves pre-built records and discards writes, isolating index cost from I/O."""
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+
+    def load(self) -> List[VersionRecord]:
+        base = datetime(2024, 1, 1)
+        template = VersionRecord(version="0.0.0", commit_hash="template")
+        return [
+            template.model_copy(
+                update={
+                    "version": f"{idx // 1000}.{(idx // 10) % 100}.{idx % 10}",
+                    "commit_hash": f"{idx:040x}",
+                    "created_at": base + timedelta(seconds=idx),
+                    "tags": ["stable"] if idx % 100 == 0 else [],
+                }
+            )
+            for idx in range(self.size)
+        ]
+
+    def save(self, record: VersionRecord, records: Mapping[str, VersionRecord]) -> None:
+        pass
+
+
+def _per_call_us(fn: Callable[[int], object], rounds: int = 2000) -> float:
+    start = time.perf_counter()
+    for idx in range(rounds):
+        fn(idx)
+    return (time.perf_counter() - start) / rounds * 1e6
+
+
+@pytest.mark.parametrize("size", [10_000, 100_000, 1_000_000])
+def test_lookup_latency(tmp_path, size):
+    registry = VersionRegistry(tmp_path / "registry.json", store=SyntheticStore(size))
+    since = datetime(2024, 1, 1) + timedelta(seconds=size // 2)
+    step = max(size // 2000, 1)
+
+    results = {
+        "get_by_commit": _per_call_us(lambda i: registry.get_by_commit(f"{i * step:040x}")),
+        "get_by_version": _per_call_us(
+            lambda i: registry.get_by_version(f"{(i * step) // 1000}.{((i * step) // 10) % 100}.0")
+        ),
+        "list_versions": _per_call_us(lambda i: registry.list_versions(limit=50, offset=i % 100)),
+        "page_since": _per_call_us(lambda i: registry.page_versions(limit=50, since=since)),
+        "page_tag": _per_call_us(lambda i: registry.page_versions(limit=50, tags=["stable"])),
+        "upsert": _per_call_us(
+            lambda i: registry.upsert(commit_hash=f"new-{i}", version="9.9.9", tags=["stable"]), 500
+        ),
+    }
+    print(f"\nregistry size={size}: " + ", ".join(f"{k}={v:.1f}us" for k, v in results.items()))
+    assert registry.count() == size + 500
+    assert registry.get_by_version("9.9.9") is not None
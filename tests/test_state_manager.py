@@ -1,11 +1,23 @@
 from __future__ import annotations
 
+import array
+import asyncio
+import json
+import mmap
+import os
+import threading
+import time
 from pathlib import Path
+from typing import Any
 
 import pytest
 
 from scalable_textgrad.config import AgentSettings
-from scalable_textgrad.state_manager import StateManager, StateValidationError
+from scalable_textgrad.state_manager import StateManager, StateValidationError, _directory_watch
+from scalable_textgrad.state_patch import PatchError, apply_patch
+from scalable_textgrad.state_watch import inotify_available
+
+real_loads = json.loads
 
 
 def make_manager(tmp_path: Path) -> StateManager:
@@ -31,3 +43,356 @@ def test_occ_guard(tmp_path: Path) -> None:
     manager = make_manager(tmp_path)
     with pytest.raises(StateValidationError):
         manager.write_state("staging", {"boom": True}, expected_token="not-valid")
+
+
+def test_patch_state_logs_changes_and_compacts(tmp_path: Path) -> None:
+    manager = make_manager(tmp_path)
+    manager.dirs.schema_file.write_text(
+        json.dumps(
+            {
+                "type": "object",
+                "required": ["arms"],
+                "properties": {
+                    "arms": {
+                        "type": "object",
+                        "additionalProperties": {
+                            "type": "object",
+                            "properties": {"pulls": {"type": "integer", "minimum": 0}},
+                        },
+                    }
+                },
+            }
+        )
+    )
+    manager = StateManager(manager.dirs, compact_every=3)
+    token = manager.write_state("staging", {"arms": {"a": {"pulls": 0}}}, None)
+
+    bump = [{"op": "replace", "path": "/arms/a/pulls", "value": 1}]
+    token = manager.patch_state("staging", bump, token)
+    token = manager.patch_state("staging", {"arms": {"b": {"pulls": 0}}}, token)
+    log = manager.dirs.staging_state_file.with_suffix(".ops.jsonl")
+    assert len(log.read_text().splitlines()) == 2
+    # Another process sees the same document by replaying the log.
+    reader = StateManager(manager.dirs)
+    doc = reader.read_state("staging")
+    assert doc.token == token and doc.payload == {"arms": {"a": {"pulls": 1}, "b": {"pulls": 0}}}
+
+    negative = [{"op": "replace", "path": "/arms/b/pulls", "value": -1}]
+    with pytest.raises(StateValidationError, match="arms.b.pulls"):
+        manager.patch_state("staging", negative, None)
+    with pytest.raises(StateValidationError, match="required"):
+        manager.patch_state("staging", [{"op": "remove", "path": "/arms"}], None)
+    with pytest.raises(StateValidationError, match="Stale"):
+        manager.patch_state("staging", {"arms": {}}, "old")
+
+    token = manager.patch_state("staging", [{"op": "remove", "path": "/arms/b"}], token)
+    assert not log.exists()  # folded into the state file after three entries
+    assert json.loads(manager.dirs.staging_state_file.read_text())["version_id"] == token
+    assert reader.read_state("staging").payload == {"arms": {"a": {"pulls": 1}}}
+
+
+def test_read_state_survives_a_compaction_while_reading(tmp_path: Path, monkeypatch) -> None:
+    manager = make_manager(tmp_path)
+    writer = StateManager(manager.dirs, compact_every=3)
+    token = writer.write_state("staging", {"n": 0}, None)
+    for n in (1, 2):
+        token = writer.patch_state("staging", {"n": n}, token)
+    path = manager.dirs.staging_state_file
+    real_read_text = Path.read_text
+    compacted = []
+
+    def read_text(self: Path, *args, **kwargs) -> str:
+        text = real_read_text(self, *args, **kwargs)
+        if self == path and not compacted:
+            compacted.append(None)
+            # Another writer folds the log into the file right after this read.
+            compacted[0] = writer.patch_state("staging", {"n": 3}, None)
+        return text
+
+    monkeypatch.setattr(Path, "read_text", read_text)
+    doc = manager.read_state("staging")
+    assert not path.with_suffix(".ops.jsonl").exists()
+    assert (doc.token, doc.payload) == (compacted[0], {"n": 3})
+
+
+def test_log_entries_escape_tokens_written_by_other_tools(tmp_path: Path) -> None:
+    manager = make_manager(tmp_path)
+    path = manager.dirs.staging_state_file
+    path.write_text(json.dumps({"version_id": 'v"1\\', "data": {"n": 0}}))
+    token = manager.patch_state("staging", {"n": 1}, 'v"1\\')
+    doc = StateManager(manager.dirs).read_state("staging")
+    assert (doc.token, doc.payload) == (token, {"n": 1})
+
+
+def test_json_patch_operations() -> None:
+    document = {"list": [1, 2], "nested": {"x": 1}}
+    patched, changed = apply_patch(
+        document,
+        [
+            {"op": "add", "path": "/list/-", "value": 3},
+            {"op": "move", "from": "/nested/x", "path": "/moved"},
+            {"op": "copy", "from": "/list", "path": "/copy"},
+            {"op": "test", "path": "/copy/2", "value": 3},
+        ],
+    )
+    assert patched == {"list": [1, 2, 3], "nested": {}, "moved": 1, "copy": [1, 2, 3]}
+    assert document == {"list": [1, 2], "nested": {"x": 1}}
+    assert set(changed) == {("list",), ("nested",), ()}
+    with pytest.raises(PatchError):
+        apply_patch(document, [{"op": "test", "path": "/list/0", "value": 9}])
+    # `test` compares JSON types: true is not the number 1, though 1.0 is.
+    apply_patch({"n": 1, "flag": True}, [{"op": "test", "path": "/n", "value": 1.0}])
+    for path, value in (("/n", True), ("/flag", 1), ("", {"n": True, "flag": True})):
+        with pytest.raises(PatchError):
+            apply_patch({"n": 1, "flag": True}, [{"op": "test", "path": path, "value": value}])
+
+
+def test_concurrent_writers_never_lose_updates(tmp_path: Path) -> None:
+    dirs = make_manager(tmp_path).dirs
+
+    def increment(times: int) -> None:
+        manager = StateManager(dirs)  # separate lock handles, as in separate processes
+        for _ in range(times):
+            while True:
+                doc = manager.read_state("staging")
+                try:
+                    manager.write_state("staging", {"n": doc.payload.get("n", 0) + 1}, doc.token)
+                    break
+                except StateValidationError:
+                    continue
+
+    threads = [threading.Thread(target=increment, args=(10,)) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert StateManager(dirs).read_state("staging").payload["n"] == 60
+
+
+def test_group_commit_shares_fsyncs_and_writes_are_atomic(tmp_path: Path, monkeypatch) -> None:
+    dirs = make_manager(tmp_path).dirs
+    real_fsync = os.fsync
+    calls = []
+
+    def slow_fsync(fd: int) -> None:
+        calls.append(fd)
+        time.sleep(0.01)
+        real_fsync(fd)
+
+    monkeypatch.setattr(os, "fsync", slow_fsync)
+    managers = [StateManager(dirs, durability="group") for _ in range(16)]
+    threads = [
+        threading.Thread(target=m.patch_state, args=("staging", {f"k{idx}": idx}, None))
+        for idx, m in enumerate(managers)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(StateManager(dirs).read_state("staging").payload) == 16
+    assert len(calls) < 16
+
+    before = dirs.active_state_file.read_text()
+
+    def crash(*_: object) -> None:
+        raise OSError("power cut")
+
+    monkeypatch.setattr(os, "replace", crash)
+    with pytest.raises(OSError):
+        StateManager(dirs).promote()
+    assert dirs.active_state_file.read_text() == before
+    assert not list(dirs.state_dir.glob("*.tmp"))
+
+
+def test_snapshots_are_shared_until_state_changes(tmp_path: Path, monkeypatch) -> None:
+    manager = make_manager(tmp_path)
+    token = manager.write_state("active", {"weights": [1, 2], "nested": {"x": 1}}, None)
+    first = manager.read_snapshot("active")
+    assert StateManager(manager.dirs).read_snapshot("active") is first
+    assert first.token == token and first.payload == {"weights": [1, 2], "nested": {"x": 1}}
+    with pytest.raises(TypeError):
+        first.payload["nested"]["x"] = 2  # type: ignore[index]
+    thawed = first.payload.thaw()
+    thawed["nested"]["x"] = 2
+    assert first.payload["nested"]["x"] == 1
+
+    parsed = []
+    monkeypatch.setattr(json, "loads", lambda *a, **k: parsed.append(1) or real_loads(*a, **k))
+    assert manager.read_snapshot("active") is first and not parsed
+
+    manager.patch_state("active", [{"op": "add", "path": "/weights/-", "value": 3}], token)
+    assert manager.read_snapshot("active").payload["weights"] == [1, 2, 3]
+    StateManager(manager.dirs).write_state("active", {"weights": []}, None)
+    assert manager.read_snapshot("active").payload == {"weights": []}
+
+
+@pytest.mark.skipif(not inotify_available(), reason="inotify is Linux only")
+def test_watched_snapshots_skip_file_checks_until_notified(tmp_path: Path, monkeypatch) -> None:
+    manager = make_manager(tmp_path)
+    watched = StateManager(manager.dirs, watch=True)
+    first = watched.read_snapshot("active")
+    time.sleep(0.05)  # let the watch settle
+    first = watched.read_snapshot("active")
+
+    stats = []
+    real_stat = Path.stat
+    monkeypatch.setattr(Path, "stat", lambda self, **k: stats.append(self) or real_stat(self, **k))
+    assert watched.read_snapshot("active") is first and not stats
+    monkeypatch.undo()
+
+    token = manager.write_state("active", {"value": 1}, None)
+    deadline = time.monotonic() + 2
+    while watched.read_snapshot("active").token != token:
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+@pytest.mark.skipif(not inotify_available(), reason="inotify is Linux only")
+def test_subscribers_are_notified_of_promotions_by_other_managers(tmp_path: Path) -> None:
+    manager = make_manager(tmp_path)
+    seen = []
+    delivered = threading.Event()
+
+    def on_change(token, snapshot) -> None:
+        seen.append((token, snapshot.payload.get("value")))
+        delivered.set()
+
+    subscription = StateManager(manager.dirs).subscribe(on_change)
+    assert subscription.mode == "inotify"
+    staging = manager.write_state("staging", {"value": 7}, None)
+    manager.write_state("staging", {"value": 8}, staging)  # staging changes are not delivered
+    manager.promote(expected_staging_token=manager.read_state("staging").token)
+    assert delivered.wait(2)
+    assert seen == [(manager.read_state("active").token, 8)]
+
+    subscription.close()
+    delivered.clear()
+    manager.write_state("active", {"value": 9}, None)
+    assert not delivered.wait(0.2)
+
+
+@pytest.mark.skipif(not inotify_available(), reason="inotify is Linux only")
+def test_slow_or_failing_subscribers_do_not_hold_up_others(tmp_path: Path) -> None:
+    manager = make_manager(tmp_path)
+    watched = StateManager(manager.dirs, watch=True)
+    watched.read_snapshot("active")
+    release = threading.Event()
+    delivered = threading.Event()
+    slow = manager.subscribe(lambda token, snapshot: release.wait(5))
+    fast = manager.subscribe(lambda token, snapshot: delivered.set())
+
+    def broken(names) -> None:
+        raise RuntimeError("listener bug")
+
+    _directory_watch(manager.dirs.state_dir).listeners.insert(0, broken)
+    try:
+        token = manager.write_state("active", {"value": 1}, None)
+        assert delivered.wait(2)
+        # The slow callback is still running; watched snapshots are already fresh.
+        assert watched.read_snapshot("active").token == token
+    finally:
+        _directory_watch(manager.dirs.state_dir).listeners.remove(broken)
+        release.set()
+        slow.close()
+        fast.close()
+
+
+def test_changes_iterates_polled_snapshots(tmp_path: Path) -> None:
+    manager = make_manager(tmp_path)
+
+    async def scenario() -> list:
+        changes = manager.changes(mode="poll", poll_interval=0.01)
+        first = asyncio.ensure_future(changes.__anext__())
+        await asyncio.sleep(0.05)  # subscribed, nothing changed yet
+        assert not first.done()
+        token = await asyncio.to_thread(manager.write_state, "active", {"value": 1}, None)
+        snapshot = await asyncio.wait_for(first, 2)
+        await changes.aclose()
+        return [token, snapshot]
+
+    token, snapshot = asyncio.run(scenario())
+    assert snapshot.token == token and snapshot.payload["value"] == 1
+
+
+def test_sidecar_arrays_are_memory_mapped_and_promoted_together(tmp_path: Path) -> None:
+    manager = make_manager(tmp_path)
+    manager.dirs.schema_file.write_text(json.dumps({"type": "object", "required": ["arms"]}))
+    manager = StateManager(manager.dirs)
+    manager.array_grace = 0.0
+    weights = memoryview(array.array("d", range(6))).cast("B").cast("d", [2, 3])
+    token = manager.write_state("staging", {"arms": 2}, None, arrays={"weights": weights})
+    refs = json.loads(manager.dirs.staging_state_file.read_text())["arrays"]
+    assert refs["weights"]["dtype"] == "<f8" and refs["weights"]["shape"] == [2, 3]
+
+    staged = manager.read_arrays("staging")["weights"]
+    assert staged.shape == (2, 3) and staged.tolist() == [[0, 1, 2], [3, 4, 5]]
+    if isinstance(staged, memoryview):  # without NumPy: a zero-copy view of the mapped file
+        assert staged.readonly and isinstance(staged.obj, mmap.mmap)
+
+    manager.promote(token)
+    active = manager.read_snapshot("active")
+    assert active.payload == {"arms": 2} and active.arrays["weights"].tolist()[1] == [3, 4, 5]
+
+    # Replacing the arrays everywhere drops the old file once nothing references it.
+    counts = array.array("q", [7])
+    token = manager.write_state("staging", {"arms": 1}, None, arrays={"counts": counts})
+    manager.promote(token)
+    files = list(manager.arrays_dir.glob("*.npy"))
+    assert len(files) == 1 and manager.read_arrays("active")["counts"].tolist() == [7]
+    with pytest.raises(StateValidationError):
+        manager.write_state("staging", {}, None, arrays={"counts": counts})
+
+
+def test_arrays_outlive_replacement_by_the_grace_period(tmp_path: Path) -> None:
+    manager = make_manager(tmp_path)
+    token = manager.write_state("staging", {}, None, arrays={"w": array.array("d", [1.0])})
+    manager.promote(token)
+    # Long in use: its age must not count towards the grace period.
+    for path in manager.arrays_dir.glob("*.npy"):
+        os.utime(path, (time.time() - 3600,) * 2)
+    snapshot = manager.read_snapshot("active")
+
+    for value in (2.0, 3.0):
+        token = manager.write_state("staging", {}, None, arrays={"w": array.array("d", [value])})
+        manager.promote(token)
+    assert snapshot.arrays["w"].tolist() == [1.0]
+    assert len(list(manager.arrays_dir.glob("*.npy"))) == 3
+
+    # Once unreferenced for longer than the grace period, the next sweep removes them.
+    for marker in manager.arrays_dir.glob(".*.unref"):
+        os.utime(marker, (time.time() - manager.array_grace - 1,) * 2)
+    manager.write_state("staging", {}, None, arrays={"w": array.array("d", [3.0])})
+    assert len(list(manager.arrays_dir.glob("*.npy"))) == 1
+    assert not list(manager.arrays_dir.glob(".*.unref"))
+
+
+def test_arrays_swept_between_writing_and_locking_are_written_again(
+    tmp_path: Path, monkeypatch
+) -> None:
+    from scalable_textgrad import state_manager
+
+    manager = make_manager(tmp_path)
+    weights = array.array("d", [1.0, 2.0])
+    manager.write_state("staging", {}, None, arrays={"w": weights})
+    real_write_npy = state_manager.write_npy
+
+    def write_then_sweep(directory: Path, value: Any, **kwargs: Any) -> dict:
+        ref = real_write_npy(directory, value, **kwargs)
+        # A sweep by another writer deletes the file before this one takes the lock.
+        (directory / f"{ref['sha256']}.npy").unlink(missing_ok=True)
+        monkeypatch.setattr(state_manager, "write_npy", real_write_npy)
+        return ref
+
+    monkeypatch.setattr(state_manager, "write_npy", write_then_sweep)
+    manager.write_state("staging", {}, None, arrays={"w": weights})
+    assert StateManager(manager.dirs).read_arrays("staging")["w"].tolist() == [1.0, 2.0]
+
+
+def test_c_long_arrays_are_described_by_their_native_width(tmp_path: Path) -> None:
+    manager = make_manager(tmp_path)
+    values = {"signed": array.array("l", [-1, 2]), "unsigned": array.array("L", [3])}
+    manager.write_state("staging", {}, None, arrays=values)
+    refs = manager.read_state("staging").array_refs
+    width = array.array("l").itemsize
+    assert (refs["signed"]["dtype"], refs["unsigned"]["dtype"]) == (f"<i{width}", f"<u{width}")
+    assert manager.read_arrays("staging")["signed"].tolist() == [-1, 2]
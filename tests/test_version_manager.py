@@ -0,0 +1,235 @@
+from __future__ import annotations
+
+import asyncio
+import importlib
+from datetime import timedelta
+
+import httpx
+import pytest
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.testclient import TestClient
+
+from scalable_textgrad.config import UpstreamPoolSettings
+
+
+def vm_module():
+    # Imported lazily: the module builds its global service from the environment.
+    return importlib.import_module("scalable_textgrad.version_manager.service")
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    monkeypatch.setenv("STG_WORKSPACE_ROOT", str(tmp_path))
+    return vm_module().VersionManagerService()
+
+
+def register(service, commit_hash: str, version: str, base_url: str, component: str = "runner"):
+    payload = vm_module().RegisterServiceRequest(
+        version=version, commit_hash=commit_hash, component=component, base_url=base_url
+    )
+    return service.register_service(payload)
+
+
+def route_urls(service, version: str, component: str = "runner") -> list[str]:
+    return [replica.base_url for replica in service._upstream_route(version, component)]
+
+
+def test_route_cache_hits_and_invalidates(service):
+    register(service, "abc", "0.1.0", "http://runner-a/")
+    assert route_urls(service, "0.1.0") == ["http://runner-a"]
+    assert route_urls(service, "0.1.0") == ["http://runner-a"]
+    assert route_urls(service, "abc") == ["http://runner-a"]
+    stats = service.routes.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 2)
+
+    register(service, "abc", "0.1.0", "http://runner-b")
+    assert route_urls(service, "0.1.0") == ["http://runner-a", "http://runner-b"]
+    assert route_urls(service, "abc") == ["http://runner-a", "http://runner-b"]
+
+    service.registry.deregister_service(
+        commit_hash="abc", component="runner", base_url="http://runner-a/"
+    )
+    assert route_urls(service, "abc") == ["http://runner-b"]
+
+    service.registry.upsert(commit_hash="abc", version="0.2.0")
+    with pytest.raises(HTTPException):
+        service._upstream_route("0.1.0", "runner")
+    assert route_urls(service, "0.2.0") == ["http://runner-b"]
+
+
+def test_balancer_spreads_load_and_ejects_failing_replicas(service):
+    register(service, "abc", "0.1.0", "http://runner-a")
+    register(service, "abc", "0.1.0", "http://runner-b")
+    route = service._upstream_route("0.1.0", "runner")
+    balancer = service.balancer
+    service.settings.proxy_balancer = "least_outstanding"
+
+    first = balancer.choose(route)
+    balancer.acquire(first)
+    second = balancer.choose(route)
+    assert second != first
+    balancer.release(first, ok=True)
+
+    for _ in range(service.settings.proxy_eject_after_failures):
+        balancer.record("http://runner-a", ok=False)
+    assert {balancer.choose(route).base_url for _ in range(20)} == {"http://runner-b"}
+    assert balancer.stats()["http://runner-a"]["ejected"]
+
+    balancer.record("http://runner-b", ok=False)
+    for _ in range(service.settings.proxy_eject_after_failures):
+        balancer.record("http://runner-b", ok=False)
+    # Every replica ejected: fall back to routing across all of them.
+    assert balancer.choose(route).base_url in {"http://runner-a", "http://runner-b"}
+
+    service.settings.replica_heartbeat_ttl = 60
+    for replica in route:
+        replica.endpoint.last_heartbeat -= timedelta(minutes=5)
+    with pytest.raises(LookupError):
+        balancer.choose(route)
+
+
+def test_balancer_forgets_deregistered_replicas(service):
+    register(service, "abc", "0.1.0", "http://runner-a")
+    register(service, "abc", "0.1.0", "http://runner-b")
+    balancer = service.balancer
+    route = service._upstream_route("0.1.0", "runner")
+    for replica in route:
+        balancer.acquire(replica)
+    balancer.release(route[0], ok=True)
+    probed = []
+
+    class Client:
+        async def get(self, url):
+            probed.append(url)
+            return httpx.Response(200)
+
+    for base_url in ("http://runner-a", "http://runner-b"):
+        service.registry.deregister_service(commit_hash="abc", component="runner", base_url=base_url)
+    assert set(balancer.stats()) == {"http://runner-b"}  # still has a request in flight
+    asyncio.run(balancer.probe(Client()))
+    assert probed == []
+    balancer.release(route[1], ok=False)
+    assert balancer.stats() == {}
+
+
+def test_streaming_proxy_relays_body_and_strips_hop_headers(service):
+    seen = {}
+
+    async def chunks():
+        for _ in range(1000):
+            yield b"chunk-"
+
+    async def upstream(request: httpx.Request) -> httpx.Response:
+        seen["body"] = await request.aread()
+        seen["headers"] = request.headers
+        headers = [("set-cookie", "a=1"), ("set-cookie", "b=2"), ("keep-alive", "5")]
+        return httpx.Response(200, headers=headers, content=chunks())
+
+    service.pools = vm_module().UpstreamPools(service.settings, transport=httpx.MockTransport(upstream))
+    register(service, "abc", "0.1.0", "http://runner")
+    app = FastAPI()
+
+    @app.api_route("/agent/{version}/{component}/{path:path}", methods=["GET", "POST"])
+    async def proxy(version: str, component: str, path: str, request: Request):
+        return await service.proxy(version, component, path, request)
+
+    with TestClient(app) as client:
+        resp = client.post(
+            "/agent/0.1.0/runner/tools/call?x=1",
+            content=b"payload" * 100,
+            headers={"Connection": "x-secret", "x-secret": "1", "x-keep": "2"},
+        )
+    assert resp.status_code == 200
+    assert resp.content == b"chunk-" * 1000
+    assert resp.headers.get_list("set-cookie") == ["a=1", "b=2"]
+    assert "keep-alive" not in resp.headers
+    assert seen["body"] == b"payload" * 100
+    assert "x-secret" not in seen["headers"] and seen["headers"]["x-keep"] == "2"
+    assert service.pools.stats()["http://runner"]["in_flight"] == 0
+
+
+def test_streaming_proxy_aborts_when_upstream_fails_mid_body(service):
+    async def chunks():
+        yield b"partial"
+        raise httpx.ReadError("upstream reset")
+
+    async def upstream(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, content=chunks())
+
+    service.pools = vm_module().UpstreamPools(service.settings, transport=httpx.MockTransport(upstream))
+    register(service, "abc", "0.1.0", "http://runner")
+    app = FastAPI()
+
+    @app.get("/agent/{version}/{component}/{path:path}")
+    async def proxy(version: str, component: str, path: str, request: Request):
+        return await service.proxy(version, component, path, request)
+
+    with TestClient(app) as client:
+        with pytest.raises(httpx.ReadError):
+            client.get("/agent/0.1.0/runner/stream")
+    assert service.pools.stats()["http://runner"]["in_flight"] == 0
+    stats = service.balancer.stats()["http://runner"]
+    assert stats["consecutive_failures"] == 1 and stats["outstanding"] == 0
+
+
+def test_proxy_rejects_requests_that_cannot_be_forwarded(service):
+    service.pools = vm_module().UpstreamPools(
+        service.settings, transport=httpx.MockTransport(lambda request: httpx.Response(200))
+    )
+    register(service, "abc", "0.1.0", "http://runner")
+    app = FastAPI()
+
+    @app.get("/agent/{version}/{component}/{path:path}")
+    async def proxy(version: str, component: str, path: str, request: Request):
+        return await service.proxy(version, component, path, request)
+
+    with TestClient(app) as client:
+        resp = client.get("/agent/0.1.0/runner/a%00b")  # NUL is not allowed in a URL path
+    assert resp.status_code == 400
+    assert service.pools.stats()["http://runner"]["in_flight"] == 0
+    assert service.balancer.stats()["http://runner"]["outstanding"] == 0
+
+
+def test_upstream_pools_are_per_origin(service):
+    service.settings.proxy_pool_overrides = {
+        "http://slow:9000": UpstreamPoolSettings(max_connections=2)
+    }
+    pools = vm_module().UpstreamPools(service.settings)
+    slow = pools.origin_for("http://slow:9000/agent/x")
+    fast = pools.origin_for("http://fast:9001")
+    assert pools.acquire(slow) is pools.acquire(slow)
+    assert pools.acquire(fast) is not pools.acquire(slow)
+    pools.release(fast)
+
+    stats = pools.stats()
+    assert stats[slow]["in_flight"] == 3 and stats[slow]["max_connections"] == 2
+    assert stats[fast]["in_flight"] == 0
+    assert stats[fast]["max_connections"] == service.settings.proxy_max_connections
+
+
+def test_heartbeats_stay_in_memory_until_flushed(service):
+    register(service, "abc", "0.1.0", "http://runner-a")
+    service.settings.replica_heartbeat_ttl = 60
+    route = service._upstream_route("0.1.0", "runner")
+    stale = route[0].endpoint.last_heartbeat - timedelta(minutes=5)
+    route[0].endpoint.last_heartbeat = stale
+    with pytest.raises(LookupError):
+        service.balancer.choose(route)
+
+    heartbeat = vm_module().HeartbeatRequest(
+        commit_hash="abc", component="runner", base_url="http://runner-a"
+    )
+    service.heartbeat(heartbeat)
+    assert service.balancer.choose(route).base_url == "http://runner-a"
+    journal = service.registry.store.journal_path
+    before = journal.read_text()
+
+    latest = service.heartbeat(heartbeat)["last_heartbeat"]
+    assert journal.read_text() == before
+    assert service.flush_heartbeats() == 1
+    assert service.flush_heartbeats() == 0
+    reopened = vm_module().VersionManagerService()
+    assert reopened.registry.get_by_commit("abc").runner.last_heartbeat.isoformat() == latest
+
+    with pytest.raises(HTTPException):
+        service.heartbeat(heartbeat.model_copy(update={"base_url": "http://unknown"}))
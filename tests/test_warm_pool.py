@@ -0,0 +1,42 @@
+from __future__ import annotations
+
+import subprocess
+
+import pytest
+
+from scalable_textgrad.ci import run_ci
+from scalable_textgrad.warm_pool import WarmPytestPool, pytest_invocation
+
+
+@pytest.fixture
+def pool():
+    pool = WarmPytestPool(size=1, max_runs=2, preload=["pytest"])
+    yield pool
+    pool.close()
+
+
+def test_runs_pytest_in_forked_children_and_recycles(tmp_path, pool):
+    (tmp_path / "runner.py").write_text("VALUE = 1\n")
+    (tmp_path / "tests.py").write_text("from runner import VALUE\n\n\ndef test_value():\n    assert VALUE == 1\n")
+
+    result = run_ci(tmp_path, pytest_runner=pool.run)
+    assert result.success and "1 passed" in result.steps[-1].stdout
+
+    # A fresh fork sees the edited module rather than a cached import.
+    (tmp_path / "runner.py").write_text("VALUE = 2\n")
+    result = run_ci(tmp_path, pytest_runner=pool.run)
+    assert not result.success and "1 failed" in result.steps[-1].stdout
+    assert pool.recycled == 1
+
+
+def test_timeout_kills_the_session(tmp_path, pool):
+    (tmp_path / "tests.py").write_text("import time\n\n\ndef test_slow():\n    time.sleep(30)\n")
+    with pytest.raises(subprocess.TimeoutExpired):
+        pool.run(["pytest", "-q", "tests.py"], tmp_path, timeout=0.5)
+    assert pool.run(["pytest", "-q", "--co", "tests.py"], tmp_path).exit_code == 0
+
+
+def test_pytest_invocation_accepts_coverage_commands():
+    command = ["/bin/coverage", "run", "--rcfile=/tmp/rc", "-m", "pytest", "-q", "tests.py"]
+    assert pytest_invocation(command) == (["-q", "tests.py"], "/tmp/rc")
+    assert pytest_invocation(["pytest", "-q"]) == (["-q"], None)
@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+from scalable_textgrad.config import AgentSettings
+from scalable_textgrad.git_repo import GitRepository
+from scalable_textgrad.workspace_store import WorkspaceStore
+
+
+def make_versions(root: Path):
+    """Bootstrap repo plus one linked worktree that changes a single file."""
+
+    base = root / "base"
+    base.mkdir(parents=True)
+    (base / "runner.py").write_text("print('runner')\n")
+    (base / "tests.py").write_text("def test_ok():\n    assert True\n")
+    repo = GitRepository.open(base)
+    first = repo.commit_all("bootstrap")
+    bootstrap = root / first
+    base.rename(bootstrap)
+    repo = GitRepository.open(bootstrap)
+
+    staging = repo.add_worktree(root / "staging")
+    (staging.worktree / "runner.py").write_text("print('runner v2')\n")
+    second = staging.commit_all("update")
+    repo.relocate(staging.worktree, root / second)
+    return repo, first, second
+
+
+def test_ingest_shares_identical_files(tmp_path):
+    store = WorkspaceStore(AgentSettings(workspace_root=tmp_path, workspace_dedup="hardlink"))
+    repo, first, second = make_versions(tmp_path)
+
+    assert store.ingest(tmp_path / first) == 2
+    assert store.ingest(tmp_path / second) == 2
+
+    old, new = tmp_path / first / "tests.py", tmp_path / second / "tests.py"
+    assert old.stat().st_ino == new.stat().st_ino
+    assert (tmp_path / first / "runner.py").stat().st_ino != (tmp_path / second / "runner.py").stat().st_ino
+    assert store.stats()["blobs"] == 3
+    assert GitRepository.open(tmp_path / second).is_clean()
+
+
+def test_materialize_and_collect(tmp_path):
+    store = WorkspaceStore(AgentSettings(workspace_root=tmp_path, workspace_dedup="hardlink"))
+    repo, first, second = make_versions(tmp_path)
+    store.ingest(tmp_path / first)
+    store.ingest(tmp_path / second)
+
+    # Only the bootstrap is still referenced: the second version and its blob go away.
+    result = store.collect([first])
+    assert (result.versions_removed, result.blobs_removed) == (1, 1)
+    assert not (tmp_path / second).exists()
+
+    restored = store.materialize(repo, second, tmp_path / second)
+    assert restored.head == second
+    assert restored.is_clean()
+    assert (restored.worktree / "runner.py").read_text() == "print('runner v2')\n"
+    assert (restored.worktree / "tests.py").stat().st_ino == (tmp_path / first / "tests.py").stat().st_ino